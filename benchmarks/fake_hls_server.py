@@ -0,0 +1,129 @@
+"""
+Stand-in for an HLS CDN, serving synthetic live media playlists, for the in-process HLS downloads (saa/hls.py).
+
+- GET /live/<name>.m3u8   - the live playlist, the last `window` segments up to now
+- GET /live/<name>/<n>.ts - segment n, synthetic MPEG-TS (bitrate / 8 * segment bytes), with n in the bytes after
+                            the first sync byte, to check segments are written in order
+
+The stream is scripted through the query string, which is passed on to the segment urls:
+    live_at=<epoch time>&duration=<seconds>&bitrate=<bits per second>&segment=<seconds>&window=<segments>
+    [&slow_every=<n>&slow_delay=<seconds>][&fail_every=<n>]
+
+The media sequence number of a segment is the number of segments since live_at. Once duration is up, the playlist
+ends (#EXT-X-ENDLIST). With slow_every, every nth segment takes slow_delay seconds longer to respond, and with
+fail_every, every nth segment gives a 404.
+
+Each new connection, and each request with --verbose, is printed as a json line, to check connections are kept alive.
+The tests (tests/test_hls.py) run it in a thread with make_server, and count the connections with server.connections.
+
+Usage:
+    python benchmarks/fake_hls_server.py --port 8090
+
+Then add hls_server to a fake stream's url, for the stand-in streamlink's --json to resolve it to this server:
+    url: "fake://name?live_at=<epoch>&hls_server=127.0.0.1:8090&segment=2&slow_every=5&slow_delay=3"
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import argparse
+import struct
+import json
+import time
+import sys
+import re
+
+TS_PACKET = b"\x47" + bytes(187)
+SEQUENCE = struct.Struct(">Q")
+SEGMENT_RE = re.compile(r"/live/(?P<name>[^/]+)/(?P<sequence>\d+)\.ts")
+PLAYLIST_RE = re.compile(r"/live/(?P<name>[^/]+)\.m3u8")
+
+
+class FakeHLSHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+        if self.server.print_connections:
+            print(json.dumps({"event": "connection", "client": "%s:%s" % self.client_address,
+                              "connections": self.server.connections}), flush=True)
+
+    def _respond(self, status, data, content_type="application/vnd.apple.mpegurl"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        if self.server.verbose:
+            print(json.dumps({"event": "request", "path": urlparse(self.path).path, "status": status,
+                              "time": time.time()}), flush=True)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        live_at = float(query.get("live_at", [self.server.started])[0])
+        end_at = live_at + float(query.get("duration", ["inf"])[0])
+        segment = float(query.get("segment", [2])[0])
+        now = time.time()
+
+        match = PLAYLIST_RE.fullmatch(url.path)
+        if match is not None:
+            if now < live_at:
+                return self._respond(404, b"not live")
+            window = int(query.get("window", [6])[0])
+            ended = now >= end_at
+            last = int((min(now, end_at) - live_at) // segment) - 1
+            first = max(last - window + 1, 0)
+            lines = ["#EXTM3U", "#EXT-X-VERSION:3", f"#EXT-X-TARGETDURATION:{segment:g}",
+                     f"#EXT-X-MEDIA-SEQUENCE:{first}"]
+            for sequence in range(first, last + 1):
+                lines += [f"#EXTINF:{segment:.3f},", f"{match.group('name')}/{sequence}.ts?{url.query}"]
+            if ended:
+                lines.append("#EXT-X-ENDLIST")
+            return self._respond(200, ("\n".join(lines) + "\n").encode("utf-8"))
+
+        match = SEGMENT_RE.fullmatch(url.path)
+        if match is None:
+            return self._respond(404, b"not found")
+        sequence = int(match.group("sequence"))
+        fail_every = int(query.get("fail_every", [0])[0])
+        if fail_every and sequence % fail_every == 0:
+            return self._respond(404, b"not found")
+        slow_every = int(query.get("slow_every", [0])[0])
+        if slow_every and sequence % slow_every == 0:
+            time.sleep(float(query.get("slow_delay", [0])[0]))
+        bitrate = int(query.get("bitrate", [2000000])[0])
+        packets = max(1, int(bitrate / 8 * segment) // len(TS_PACKET))
+        data = bytearray(TS_PACKET * packets)
+        SEQUENCE.pack_into(data, 1, sequence)
+        self._respond(200, bytes(data), "video/mp2t")
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(port=0, verbose=False, print_connections=True):
+    """
+    :param port: 0 for any free port (see server.server_port)
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeHLSHandler)
+    server.daemon_threads = True
+    server.started = time.time()
+    server.connections = 0
+    server.verbose = verbose
+    server.print_connections = print_connections
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--verbose", help="print each request", action="store_true")
+    args = parser.parse_args()
+
+    server = make_server(args.port, args.verbose)
+    print(f"Listening on 127.0.0.1:{args.port}", file=sys.stderr, flush=True)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
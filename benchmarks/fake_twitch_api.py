@@ -0,0 +1,98 @@
+"""
+Stand-in for the Twitch API endpoints the twitch probe plugin uses (saa/plugins/probes/twitch.py).
+
+- POST /oauth2/token  - gives out an app access token
+- GET  /helix/streams - the requested channels (user_login) that are live, needs the current token
+
+Each request is printed as a json line (path, logins, status), and kept in server.requests, to check how many
+requests the probe makes. The tests (tests/test_twitch_probe.py) run it in a thread with make_server.
+
+Usage:
+    python benchmarks/fake_twitch_api.py --port 8089 --live channel1 channel2 [--token-requests 5]
+
+Then point the probe at it in config.yml:
+    probes:
+      twitch:
+        client_id: "fake"
+        client_secret: "fake"
+        api_url: "http://127.0.0.1:8089/helix"
+        token_url: "http://127.0.0.1:8089/oauth2/token"
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import argparse
+import json
+import sys
+
+
+class FakeTwitchAPIHandler(BaseHTTPRequestHandler):
+
+    def _respond(self, status, body, logins=None):
+        # Recorded before responding, so the client never sees a response its request is not recorded for yet
+        request = {"path": urlparse(self.path).path, "logins": logins, "status": status}
+        self.server.requests.append(request)
+        if self.server.verbose:
+            print(json.dumps(request), flush=True)
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        if urlparse(self.path).path != "/oauth2/token":
+            return self._respond(404, {"message": "not found"})
+        self.server.token_number += 1
+        self.server.token_uses = 0
+        self._respond(200, {"access_token": f"token{self.server.token_number}", "expires_in": 3600,
+                            "token_type": "bearer"})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != "/helix/streams":
+            return self._respond(404, {"message": "not found"})
+        logins = parse_qs(url.query).get("user_login", [])
+        token_valid = self.headers.get("Authorization") == f"Bearer token{self.server.token_number}"
+        if self.server.token_requests and self.server.token_uses >= self.server.token_requests:
+            token_valid = False
+        if not token_valid or not self.headers.get("Client-Id"):
+            return self._respond(401, {"message": "Invalid OAuth token"}, logins)
+        self.server.token_uses += 1
+        data = [{"user_login": login, "type": "live"} for login in logins if login.lower() in self.server.live]
+        self._respond(200, {"data": data, "pagination": {}}, logins)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(port=0, live=(), token_requests=0, verbose=False):
+    """
+    :param port: 0 for any free port (see server.server_port)
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeTwitchAPIHandler)
+    server.daemon_threads = True
+    server.live = {c.lower() for c in live}
+    server.token_number = 0
+    server.token_uses = 0
+    server.token_requests = token_requests
+    server.requests = []
+    server.verbose = verbose
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--live", help="channels that are live", nargs="*", default=[])
+    parser.add_argument("--token-requests", help="requests each token is good for (to test renewing it), "
+                                                 "0 for no limit", type=int, default=0)
+    args = parser.parse_args()
+
+    server = make_server(args.port, args.live, args.token_requests, verbose=True)
+    print(f"Listening on 127.0.0.1:{args.port}", file=sys.stderr, flush=True)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+"""
+Benchmark harness - measures SAA's own overhead using the fake streamlink and rclone in benchmarks/bin.
+
+Runs streamers_watcher (and so a StreamArchiver per streamer) against N fake streams that go live shortly after
+start, then runs run_rclone over the recorded chunks.
+
+Reports:
+- CPU time and peak RSS of the SAA processes (not including the fake streamlink processes)
+- streamlink spawn rate (live checks + downloads per second)
+- time to detect live (first download writing - time the stream went live), including resolving with --resolve-delay
+- split latency (next chunk start - (previous chunk start + split_time))
+- run_rclone wall time and CPU
+
+Linux only (reads /proc).
+
+Usage:
+    python benchmarks/harness.py --streamers 20 --duration 30 --split-time 10
+"""
+from datetime import datetime
+import multiprocessing
+import statistics
+import threading
+import argparse
+import tempfile
+import resource
+import logging
+import signal
+import json
+import time
+import sys
+import os
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BIN_DIR = os.path.join(REPO_ROOT, "benchmarks", "bin")
+sys.path.insert(0, REPO_ROOT)
+
+import yaml
+import saa.saa
+import saa.rclone
+import saa.utils as utils
+
+CLK_TCK = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+log = logging.getLogger('root')
+
+
+def _read_stat(pid):
+    """
+    :return: (ppid, cpu seconds) of a process, or None if it has gone
+    """
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+    except (FileNotFoundError, ProcessLookupError, IndexError):
+        return None
+    return int(fields[1]), (int(fields[11]) + int(fields[12])) / CLK_TCK
+
+
+def _read_rss(pid):
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (FileNotFoundError, ProcessLookupError, IndexError):
+        return 0
+
+
+def _is_fake(pid):
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            return BIN_DIR.encode() in f.read()
+    except (FileNotFoundError, ProcessLookupError):
+        return False
+
+
+def descendants(root_pid):
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        stat = _read_stat(int(entry))
+        if stat is not None:
+            children.setdefault(stat[0], []).append(int(entry))
+    found, stack = [], [root_pid]
+    while stack:
+        pid = stack.pop()
+        found.append(pid)
+        stack.extend(children.get(pid, []))
+    return found
+
+
+class TreeSampler:
+    """
+    Samples CPU time and RSS of the SAA processes under a root process.
+    """
+
+    def __init__(self, root_pid, interval=0.5):
+        self.root_pid = root_pid
+        self.interval = interval
+        self.cpu = {}  # pid: last seen cpu seconds
+        self.peak_rss = 0
+        self.peak_processes = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.is_set():
+            rss = 0
+            pids = [pid for pid in descendants(self.root_pid) if not _is_fake(pid)]
+            for pid in pids:
+                stat = _read_stat(pid)
+                if stat is None:
+                    continue
+                self.cpu[pid] = stat[1]
+                rss += _read_rss(pid)
+            self.peak_rss = max(self.peak_rss, rss)
+            self.peak_processes = max(self.peak_processes, len(pids))
+            self._stop.wait(self.interval)
+
+
+def write_streamers_file(path, work_dir, streamers, live_at, duration, split_time, bitrate, recheck, resolve_delay=0):
+    conf = {}
+    for i in range(streamers):
+        name = f"bench{i:04d}"
+        conf[name] = {
+            "url": f"fake://{name}?live_at={live_at}&duration={duration}&bitrate={bitrate}&resolve_delay={resolve_delay}",
+            "name": name,
+            "download_directory": os.path.join(work_dir, "download", name),
+            "split_time": split_time,
+            "recheck_channel_interval": recheck,
+            "rclone": {"remote_dir": f"remote:/{name}"},
+        }
+    with open(path, "w") as f:
+        yaml.dump({"streamers": conf}, f)
+
+
+def stop_tree(root_pid, timeout=10):
+    """
+    Kill the watcher so it does not restart anything, SIGTERM the archivers so they clean up their
+    streamlink process, then kill anything left.
+    """
+    pids = descendants(root_pid)
+    os.kill(root_pid, signal.SIGKILL)
+    for pid in pids:
+        if pid != root_pid and not _is_fake(pid):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+    deadline = time.time() + timeout
+    while time.time() < deadline and any(_read_stat(pid) is not None for pid in pids[1:]):
+        time.sleep(0.2)
+    for pid in pids[1:]:
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+
+def read_events(path):
+    events = []
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                try:
+                    events.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+    return events
+
+
+def summarise(values):
+    if not values:
+        return {"count": 0}
+    values = sorted(values)
+    return {"count": len(values),
+            "mean": statistics.mean(values),
+            "p50": values[len(values) // 2],
+            "p95": values[min(len(values) - 1, int(len(values) * 0.95))],
+            "max": values[-1]}
+
+
+def bench_watcher(args, work_dir, streamers_file, live_at):
+    watcher = multiprocessing.Process(target=saa.saa.streamers_watcher, args=({}, streamers_file, {}),
+                                      name="StreamWatcher")
+    start = time.time()
+    watcher.start()
+    sampler = TreeSampler(watcher.pid)
+    sampler.start()
+    time.sleep(max(0.0, live_at + args.duration + args.tail - time.time()))
+    sampler.stop()
+    elapsed = time.time() - start
+    stop_tree(watcher.pid)
+    watcher.join()
+
+    events = read_events(os.environ["FAKE_STREAMLINK_LOG"])
+    starts = {}
+    for event in events:
+        if event["event"] == "start":
+            starts.setdefault(event["url"], []).append(event["time"])
+    detect = [min(times) - live_at for times in starts.values()]
+    split = []
+    for times in starts.values():
+        times.sort()
+        split.extend(b - (a + args.split_time) for a, b in zip(times, times[1:]))
+
+    return {
+        "wall_s": elapsed,
+        "saa_cpu_s": sum(sampler.cpu.values()),
+        "saa_peak_rss_mib": sampler.peak_rss / 1024 / 1024,
+        "saa_peak_processes": sampler.peak_processes,
+        "streamlink_spawns": len([e for e in events if e["event"] in ("check", "start")]),
+        "streamlink_spawn_rate_per_s": len([e for e in events if e["event"] in ("check", "start")]) / elapsed,
+        "streamers_detected": len(starts),
+        "time_to_detect_live_s": summarise(detect),
+        "split_latency_s": summarise(split),
+    }
+
+
+def bench_rclone(work_dir, streamers_file):
+    files = sum(len(f) for _, _, f in os.walk(os.path.join(work_dir, "download")))
+    before_self = resource.getrusage(resource.RUSAGE_SELF)
+    before_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    start = time.time()
+    saa.rclone.run_rclone({}, streamers_file)
+    elapsed = time.time() - start
+    after_self = resource.getrusage(resource.RUSAGE_SELF)
+    after_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    moved = sum(len(f) for _, _, f in os.walk(os.path.join(work_dir, "remote")))
+    return {
+        "wall_s": elapsed,
+        "saa_cpu_s": (after_self.ru_utime + after_self.ru_stime) - (before_self.ru_utime + before_self.ru_stime),
+        "rclone_cpu_s": ((after_children.ru_utime + after_children.ru_stime)
+                         - (before_children.ru_utime + before_children.ru_stime)),
+        "files_found": files,
+        "files_transferred": moved,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--streamers", help="number of streamers", type=int, default=10)
+    parser.add_argument("--live-delay", help="seconds after start the streams go live", type=float, default=3)
+    parser.add_argument("--duration", help="seconds the streams are live for", type=float, default=20)
+    parser.add_argument("--split-time", help="split_time for each streamer", type=int, default=8)
+    parser.add_argument("--bitrate", help="fake stream bitrate in bits/s", type=int, default=2000000)
+    parser.add_argument("--recheck", help="recheck_channel_interval for each streamer", type=float, default=2)
+    parser.add_argument("--resolve-delay", help="seconds the fake streams take to resolve (plugin/API requests)",
+                        type=float, default=0)
+    parser.add_argument("--tail", help="seconds to keep running after the streams end", type=float, default=5)
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--json", help="print results as json", action="store_true")
+    args = parser.parse_args()
+
+    log.addHandler(utils.LoggingHandler())
+    log.setLevel(args.log_level)
+
+    with tempfile.TemporaryDirectory(prefix="saa-bench-") as work_dir:
+        os.environ["PATH"] = BIN_DIR + os.pathsep + os.environ.get("PATH", "")
+        # So the archivers' forkserver (see saa.workers) can preload saa, as if it was installed
+        os.environ["PYTHONPATH"] = REPO_ROOT + os.pathsep + os.environ.get("PYTHONPATH", "")
+        os.environ["FAKE_STREAMLINK_LOG"] = os.path.join(work_dir, "streamlink-events.jsonl")
+        os.environ["FAKE_RCLONE_ROOT"] = os.path.join(work_dir, "remote")
+        streamers_file = os.path.join(work_dir, "streamers.yml")
+        live_at = time.time() + args.live_delay
+        write_streamers_file(streamers_file, work_dir, args.streamers, live_at, args.duration, args.split_time,
+                             args.bitrate, args.recheck, args.resolve_delay)
+
+        results = {
+            "started": datetime.utcnow().isoformat(),
+            "params": vars(args),
+            "watcher": bench_watcher(args, work_dir, streamers_file, live_at),
+            "rclone": bench_rclone(work_dir, streamers_file),
+        }
+
+    if args.json:
+        print(json.dumps(results, indent=2, default=str))
+        return
+
+    for section in ("watcher", "rclone"):
+        print(f"[{section}]")
+        for key, value in results[section].items():
+            if isinstance(value, dict):
+                value = "  ".join(f"{k}={v:.3f}" if isinstance(v, float) else f"{k}={v}" for k, v in value.items())
+            elif isinstance(value, float):
+                value = f"{value:.3f}"
+            print(f"  {key:<30} {value}")
+
+
+if __name__ == "__main__":
+    main()
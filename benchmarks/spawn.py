@@ -0,0 +1,94 @@
+"""
+Spawn benchmark - how long it takes to start archiver workers, by multiprocessing start method (see saa.workers).
+
+Starts a burst of workers (like the StreamWatcher does on startup, or when streamers.yml changes) against offline
+fake streams, and reports for each worker:
+
+- start: how long Process.start() blocks the StreamWatcher for
+- first check: from starting the worker to it having finished its first live check (last_check_time in its
+  ArchiverControl state), which includes running the fake streamlink once
+
+The StreamWatcher's imports are loaded first, so fork starts from a process as warm as the StreamWatcher.
+Linux only.
+
+Usage:
+    python benchmarks/spawn.py [--workers 20] [--runs 3] [--methods fork forkserver]
+"""
+import statistics
+import argparse
+import tempfile
+import logging
+import time
+import sys
+import os
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+import saa.saa  # noqa: E402,F401 - the StreamWatcher's imports
+import saa.workers as workers  # noqa: E402
+from saa.control import ArchiverControl  # noqa: E402
+
+
+def run_burst(context, count: int, directory: str):
+    """
+    :return: [(start seconds, first check seconds)] for each worker
+    """
+    started = []
+    for i in range(count):
+        control = ArchiverControl(context)
+        kwargs = {'url': f"fake://spawn{i}?live_at={int(time.time()) + 86400}", 'name': f"spawn{i}",
+                  'download_directory': os.path.join(directory, f"spawn{i}"), 'recheck_channel_interval': 3600}
+        start_time = time.time()
+        process = workers.start_worker(context, kwargs['name'], kwargs, None, control)
+        started.append((process, control, start_time, time.time() - start_time))
+
+    results = []
+    deadline = time.time() + 60
+    for process, control, start_time, start in started:
+        while control.state()['last_check_time'] == 0 and time.time() < deadline:
+            time.sleep(0.005)
+        results.append((start, control.state()['last_check_time'] - start_time))
+    for process, _, _, _ in started:
+        process.terminate()
+    for process, _, _, _ in started:
+        process.join()
+    return results
+
+
+def summarise(method, results):
+    starts = [r[0] * 1000 for r in results]
+    checks = [r[1] * 1000 for r in results if r[1] > 0]
+    print(f"{method:<12} start median {statistics.median(starts):7.1f}ms max {max(starts):7.1f}ms  "
+          f"first check median {statistics.median(checks):7.1f}ms p95 "
+          f"{sorted(checks)[int(len(checks) * 0.95) - 1 if len(checks) > 1 else 0]:7.1f}ms  "
+          f"({len(results) - len(checks)} timed out)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", help="workers started per burst", type=int, default=20)
+    parser.add_argument("--runs", help="bursts per start method", type=int, default=3)
+    parser.add_argument("--methods", help="start methods to compare", nargs="+", default=["fork", "forkserver"])
+    args = parser.parse_args()
+
+    os.environ["PATH"] = os.path.join(REPO_ROOT, "benchmarks", "bin") + os.pathsep + os.environ["PATH"]
+    # The forkserver is a new interpreter, it needs to be able to import saa (as if it was installed) to preload it
+    os.environ["PYTHONPATH"] = REPO_ROOT + os.pathsep + os.environ.get("PYTHONPATH", "")
+    log = logging.getLogger('root')
+    log.addHandler(logging.NullHandler())
+    log.setLevel(logging.CRITICAL)
+
+    with tempfile.TemporaryDirectory() as directory:
+        for method in args.methods:
+            context = workers.get_context(method)
+            # Started along with the StreamWatcher, so not counted
+            workers.start_forkserver(context)
+            results = []
+            for _ in range(args.runs):
+                results.extend(run_burst(context, args.workers, directory))
+            summarise(method, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Startup benchmark - import time and peak RSS of loading SAA with and without reporting plugins enabled.
+
+Each scenario runs in a fresh interpreter so module caches do not carry over between runs.
+
+Usage:
+    python benchmarks/startup.py [--runs 5] [--plugins influxdb]
+"""
+import subprocess
+import argparse
+import json
+import sys
+import os
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIO = """
+import resource, time, json, sys
+from queue import Queue
+start = time.perf_counter()
+import saa.saa
+from saa.plugins.pluginhandler import ReportingPluginHandler
+handler = ReportingPluginHandler(Queue(), {plugin_configs})
+elapsed = time.perf_counter() - start
+print(json.dumps({{
+    "import_s": elapsed,
+    "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    "modules": len(sys.modules),
+    "loaded_plugins": sorted(handler._plugins),
+}}))
+"""
+
+
+def run_scenario(plugin_configs: dict, runs: int):
+    results = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", SCENARIO.format(plugin_configs=repr(plugin_configs))],
+                                capture_output=True, check=True, cwd=REPO_ROOT)
+        results.append(json.loads(output.stdout.decode(encoding="UTF-8").strip().splitlines()[-1]))
+    return results
+
+
+def summarise(name, results):
+    import_times = sorted(r["import_s"] for r in results)
+    rss = sorted(r["max_rss_kb"] for r in results)
+    print(f"{name:<24} import median {import_times[len(import_times) // 2] * 1000:8.1f}ms  "
+          f"max rss median {rss[len(rss) // 2] / 1024:6.1f}MiB  "
+          f"modules {results[-1]['modules']:5d}  "
+          f"loaded plugins {results[-1]['loaded_plugins']}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", help="number of runs per scenario", type=int, default=5)
+    parser.add_argument("--plugins", help="plugins to enable for the second scenario", nargs="+",
+                        default=["influxdb"])
+    args = parser.parse_args()
+
+    summarise("no plugins", run_scenario({}, args.runs))
+    summarise(f"plugins {','.join(args.plugins)}", run_scenario({p: {} for p in args.plugins}, args.runs))
+
+
+if __name__ == "__main__":
+    main()
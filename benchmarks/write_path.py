@@ -0,0 +1,151 @@
+"""
+Write path benchmark - Streamlink writing chunks itself (-o) vs through SAA (saa.writer).
+
+Runs N fake streamlink processes in parallel, all writing to the same directory, for each mode:
+
+- direct   - streamlink -o <file>, as SAA does by default
+- piped    - streamlink --stdout into a ChunkWriter with no options (the cost of piping alone)
+- tuned    - as piped, with preallocation (from the bitrate and duration), a larger write buffer and drop_page_cache
+
+Reports per mode:
+- throughput (total bytes written / wall time) and the fake streams' target throughput
+- CPU time of this process (the ChunkWriter threads), not including the fake streamlink processes
+- extents per file (fragmentation), from the FIEMAP ioctl. "n/a" if the filesystem does not support it.
+
+Linux only. Fragmentation only shows on a real filesystem (e.g. ext4/XFS), not tmpfs.
+
+Usage:
+    python benchmarks/write_path.py --directory /mnt/disk1/bench --streams 32 --duration 30 --bitrate 20000000
+"""
+import subprocess
+import statistics
+import argparse
+import tempfile
+import resource
+import struct
+import shutil
+import fcntl
+import json
+import time
+import sys
+import os
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BIN_DIR = os.path.join(REPO_ROOT, "benchmarks", "bin")
+sys.path.insert(0, REPO_ROOT)
+
+from saa.writer import ChunkWriter
+
+FS_IOC_FIEMAP = 0xC020660B
+FIEMAP_FLAG_SYNC = 0x01
+FIEMAP_HEADER = struct.Struct("=QQLLLL")  # start, length, flags, mapped extents, extent count, reserved
+
+MODES = ("direct", "piped", "tuned")
+
+
+def count_extents(path):
+    """
+    :return: number of extents the file is in, or None if FIEMAP is not supported
+    """
+    request = FIEMAP_HEADER.pack(0, 0xFFFFFFFFFFFFFFFF, FIEMAP_FLAG_SYNC, 0, 0, 0)
+    try:
+        with open(path, "rb") as f:
+            result = fcntl.ioctl(f.fileno(), FS_IOC_FIEMAP, request)
+    except OSError:
+        return None
+    return FIEMAP_HEADER.unpack(result)[3]
+
+
+def cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run_mode(mode, directory, args):
+    """
+    :return: dict of results for the mode
+    """
+    url = f"fake://bench?live_at={time.time()}&duration={args.duration}&bitrate={args.bitrate}"
+    streamlink = os.path.join(BIN_DIR, "streamlink")
+    paths = [os.path.join(directory, f"{mode}_{i}.ts") for i in range(args.streams)]
+
+    cpu_before, start = cpu_seconds(), time.perf_counter()
+    processes, writers = [], []
+    for path in paths:
+        if mode == "direct":
+            processes.append(subprocess.Popen([streamlink, url, "best", "-o", path],
+                                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+            continue
+        process = subprocess.Popen([streamlink, url, "best", "--stdout"],
+                                   stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        if mode == "tuned":
+            writer = ChunkWriter(process.stdout, path, buffer_size=args.buffer_size,
+                                 preallocate_bytes=int(args.bitrate // 8 * args.duration), drop_cache=True)
+        else:
+            writer = ChunkWriter(process.stdout, path)
+        writer.start()
+        processes.append(process)
+        writers.append(writer)
+
+    for process in processes:
+        process.wait()
+    for writer in writers:
+        writer.join()
+    wall = time.perf_counter() - start
+    cpu = cpu_seconds() - cpu_before
+
+    total_bytes = sum(os.path.getsize(p) for p in paths if os.path.exists(p))
+    extents = [count_extents(p) for p in paths if os.path.exists(p)]
+    extents = [e for e in extents if e is not None]
+    return {
+        "mode": mode,
+        "files": len(paths),
+        "bytes": total_bytes,
+        "wall_seconds": wall,
+        "throughput_mb_s": total_bytes / wall / 1e6,
+        "target_mb_s": args.bitrate / 8 * args.streams / 1e6,
+        "writer_cpu_seconds": cpu,
+        "extents_mean": statistics.mean(extents) if extents else None,
+        "extents_max": max(extents) if extents else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--directory", help="directory to write to (on the filesystem to test), "
+                                            "default is a temporary directory", default=None)
+    parser.add_argument("--streams", help="number of parallel streams", type=int, default=16)
+    parser.add_argument("--duration", help="seconds each stream writes for", type=float, default=20)
+    parser.add_argument("--bitrate", help="fake stream bitrate in bits/s", type=int, default=20000000)
+    parser.add_argument("--buffer-size", help="write buffer size for the tuned mode", type=int, default=8 * 1024 * 1024)
+    parser.add_argument("--modes", help="modes to run", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--json", help="print results as json", action="store_true")
+    args = parser.parse_args()
+
+    base = args.directory or tempfile.gettempdir()
+    os.makedirs(base, exist_ok=True)
+    work_dir = tempfile.mkdtemp(prefix="saa-write-bench-", dir=base)
+    results = []
+    try:
+        for mode in args.modes:
+            results.append(run_mode(mode, work_dir, args))
+            # Start each mode with an empty directory, so free space layout is similar
+            for name in os.listdir(work_dir):
+                os.unlink(os.path.join(work_dir, name))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{args.streams} streams x {args.duration}s at {args.bitrate / 1e6:.1f}Mbit/s, in {base}")
+    print(f"{'mode':<8} {'MB/s':>8} {'target':>8} {'cpu s':>8} {'extents (mean/max)':>20}")
+    for r in results:
+        extents = "n/a" if r["extents_mean"] is None else f"{r['extents_mean']:.1f}/{r['extents_max']}"
+        print(f"{r['mode']:<8} {r['throughput_mb_s']:>8.1f} {r['target_mb_s']:>8.1f} "
+              f"{r['writer_cpu_seconds']:>8.2f} {extents:>20}")
+
+
+if __name__ == "__main__":
+    main()
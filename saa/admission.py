@@ -0,0 +1,241 @@
+"""
+Admission control for recordings, run by the StreamWatcher.
+
+With capacity limits set in config.yml, a streamer that goes live asks to be admitted before it starts recording.
+Its expected load is added to the current load of all recordings and checked against the limits:
+
+    max_recordings  - recordings at once
+    max_cpu         - CPU used by Streamlink processes, in cores
+    max_ingress     - bytes/s being written to chunks (from chunk growth)
+    max_disk_write  - bytes/s written to the disks recordings are on (from /proc/diskstats, so including other programs)
+
+The expected load of a stream is its expected_bitrate if set, otherwise the average of the current recordings.
+
+If it fits, it is admitted. If not, recordings of streamers with a lower priority are stopped (preempted) to make room,
+lowest first, if that would be enough. Otherwise it is queued, and admitted once there is room, highest priority
+(then longest waiting) first. Streamers with a priority below refuse_below are refused rather than queued,
+and ask again at their next live check. Preempted streamers ask again straight away (so are queued).
+
+Decisions are logged, and reported to the reporting plugins as events (admitted, queued, refused, preempted).
+"""
+from datetime import datetime
+import logging
+import time
+import os
+
+from saa.control import (COMMAND_ADMIT, COMMAND_REFUSE, COMMAND_PREEMPT,
+                         ADMISSION_WAITING, ADMISSION_ADMITTED)
+from saa.volumes import device_of, read_sectors_written, volume_directories, SECTOR_SIZE
+
+log = logging.getLogger('root')
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+LIMITS = ("max_recordings", "max_cpu", "max_ingress", "max_disk_write")
+
+
+def process_cpu_seconds(pid):
+    """
+    :return: user + system CPU time of the process in seconds, None if it can not be read
+    """
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # The process name (2nd field) can contain spaces, so split after it
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def streamer_directories(config: dict):
+    """
+    :return: the directories a streamer records to
+    """
+    if config.get('volumes'):
+        return volume_directories(config['volumes'], config['name'])
+    return [config.get('download_directory') or os.path.join(".", config['name'])]
+
+
+class AdmissionController:
+
+    def __init__(self, capacity: dict, processes: dict, reporting_queue=None):
+        """
+        :param capacity: capacity section of config.yml, limits that are not set are not checked
+        :param processes: streamers_watcher's current processes, key: {'process', 'config', 'control', ...}
+        :param reporting_queue: master reporting queue, to report decisions to the reporting plugins
+        """
+        self.limits = {k: float(capacity[k]) for k in LIMITS if capacity.get(k) is not None}
+        self.refuse_below = capacity.get('refuse_below')
+        self.processes = processes
+        self.reporting_queue = reporting_queue
+        self._cpu_samples = {}  # streamlink pid: (time, cpu seconds)
+        self._disk_sample = None  # (time, {device: sectors written})
+        self._waiting_since = {}  # key: time it started waiting
+        self._queued = set()  # keys that have been told they are queued (so it is only logged once)
+        self._admitted = {}  # key: expected usage when admitted, used until the recording has been measured
+        self._decided = set()  # keys sent a decision that they have not acted on yet (still waiting)
+
+    @staticmethod
+    def _priority(proc):
+        return int(proc['config'].get('priority') or 0)
+
+    def _cpu(self, pid):
+        """
+        :return: CPU used by the process since the last sample, in cores
+        """
+        now, cpu = time.monotonic(), process_cpu_seconds(pid)
+        last = self._cpu_samples.get(pid)
+        if cpu is None:
+            return 0.0
+        self._cpu_samples[pid] = (now, cpu)
+        if last is None or now <= last[0]:
+            return 0.0
+        return max(cpu - last[1], 0.0) / (now - last[0])
+
+    def _disk_write(self):
+        """
+        :return: bytes/s written to the devices any streamer records to, since the last sample
+        """
+        devices = set()
+        for proc in self.processes.values():
+            for directory in streamer_directories(proc['config']):
+                try:
+                    devices.add(device_of(directory))
+                except OSError:
+                    continue
+        now, sectors = time.monotonic(), read_sectors_written()
+        last, self._disk_sample = self._disk_sample, (now, sectors)
+        if last is None or now <= last[0]:
+            return 0.0
+        return sum((sectors[d] - last[1][d]) * SECTOR_SIZE for d in devices
+                   if d in sectors and d in last[1]) / (now - last[0])
+
+    def usage(self):
+        """
+        :return: (total usage, {key: usage of the recording}), usage being a dict of the limits
+        """
+        recordings = {}
+        for key, proc in self.processes.items():
+            state = proc['control'].state()
+            if not proc['process'].is_alive():
+                continue
+            if state['admission'] == ADMISSION_WAITING and key in self._decided and key in self._admitted:
+                # Admitted, but not started yet
+                recordings[key] = self._admitted[key]
+                continue
+            if state['admission'] != ADMISSION_ADMITTED:
+                continue
+            measured = {'max_recordings': 1.0,
+                        'max_cpu': self._cpu(state['streamlink_pid']) if state['streamlink_pid'] else 0.0,
+                        'max_ingress': state['bytes_per_second'],
+                        'max_disk_write': state['bytes_per_second']}
+            expected = self._admitted.get(key, {})
+            recordings[key] = {limit: measured[limit] or expected.get(limit, 0.0) for limit in LIMITS}
+        for key in set(self._admitted) - set(recordings):
+            self._admitted.pop(key)
+        live_pids = {p['control'].state()['streamlink_pid'] for p in self.processes.values()}
+        for pid in set(self._cpu_samples) - live_pids:
+            self._cpu_samples.pop(pid)
+
+        total = {limit: sum(r[limit] for r in recordings.values()) for limit in LIMITS}
+        # Disk writes are measured at the device, rather than summed per recording
+        total['max_disk_write'] = self._disk_write()
+        return total, recordings
+
+    @staticmethod
+    def _expected(config, recordings):
+        """
+        :return: expected usage of a new recording
+        """
+        count = len(recordings)
+        expected = {limit: sum(r[limit] for r in recordings.values()) / count if count else 0.0 for limit in LIMITS}
+        expected['max_recordings'] = 1.0
+        if config.get('expected_bitrate'):
+            expected['max_ingress'] = expected['max_disk_write'] = int(config['expected_bitrate']) / 8
+        return expected
+
+    def _fits(self, usage, expected):
+        return all(usage[limit] + expected[limit] <= value for limit, value in self.limits.items())
+
+    def _report(self, key, event):
+        log.info(f"[Admission] {event.capitalize()} {key} (priority {self._priority(self.processes[key])})")
+        if self.reporting_queue is None:
+            return
+        self.reporting_queue.put({'streamer': self.processes[key]['config']['name'],
+                                  'pid': self.processes[key]['process'].pid,
+                                  'time_utc': int(datetime.now().strftime('%s')),
+                                  'event': event,
+                                  'value': self._priority(self.processes[key]),
+                                  'is_live': True,
+                                  'chunks': 0})
+
+    def step(self):
+        """
+        Decide on the streamers waiting to be admitted.
+        """
+        now = time.time()
+        waiting = [key for key, proc in self.processes.items()
+                   if proc['process'].is_alive() and proc['control'].state()['admission'] == ADMISSION_WAITING]
+        self._decided &= set(waiting)
+        waiting = [key for key in waiting if key not in self._decided]
+        for key in set(self._waiting_since) - set(waiting):
+            self._waiting_since.pop(key)
+            self._queued.discard(key)
+        if not waiting:
+            return
+        for key in waiting:
+            self._waiting_since.setdefault(key, now)
+
+        usage, recordings = self.usage()
+        queue_full = False
+        for key in sorted(waiting, key=lambda k: (-self._priority(self.processes[k]), self._waiting_since[k])):
+            proc = self.processes[key]
+            priority = self._priority(proc)
+            expected = self._expected(proc['config'], recordings)
+
+            if not queue_full and self._fits(usage, expected):
+                self._admit(key, expected, usage, recordings)
+                continue
+
+            # Make room by stopping lower priority recordings, if that would be enough
+            victims = []
+            freed = dict(usage)
+            # (not ones that have been admitted but not started yet, they would not see it)
+            for victim in sorted((k for k in recordings
+                                  if k not in self._decided and self._priority(self.processes[k]) < priority),
+                                 key=lambda k: self._priority(self.processes[k])):
+                victims.append(victim)
+                freed = {limit: freed[limit] - recordings[victim][limit] for limit in LIMITS}
+                if self._fits(freed, expected):
+                    break
+            if not queue_full and victims and self._fits(freed, expected):
+                for victim in victims:
+                    self.processes[victim]['control'].send(COMMAND_PREEMPT)
+                    self._report(victim, "preempted")
+                    recordings.pop(victim)
+                    self._admitted.pop(victim, None)
+                usage = freed
+                self._admit(key, expected, usage, recordings)
+                continue
+
+            # Anything after this, of lower or equal priority, waits behind it
+            queue_full = True
+            if self.refuse_below is not None and priority < self.refuse_below:
+                proc['control'].send(COMMAND_REFUSE)
+                self._report(key, "refused")
+                self._decided.add(key)
+                self._waiting_since.pop(key)
+                self._queued.discard(key)
+            elif key not in self._queued:
+                self._queued.add(key)
+                self._report(key, "queued")
+
+    def _admit(self, key, expected, usage, recordings):
+        self.processes[key]['control'].send(COMMAND_ADMIT)
+        self._report(key, "admitted")
+        self._decided.add(key)
+        self._waiting_since.pop(key)
+        self._queued.discard(key)
+        for limit in LIMITS:
+            usage[limit] += expected[limit]
+        recordings[key] = self._admitted[key] = expected
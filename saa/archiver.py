@@ -7,6 +7,18 @@ import traceback
 import logging
 import signal
 import saa.utils as utils
+import saa.profiling as profiling
+import saa.instrumentation as instrumentation
+from saa.journal import ChunkJournal
+from saa.volumes import VolumePool, volume_directories
+import saa.checksum as checksum_module
+import saa.streamlinklog as streamlinklog
+import saa.pipeline as pipeline_module
+from saa.retention import RetentionPolicy
+from saa.writer import ChunkWriter
+from saa.control import (COMMAND_RECHECK, COMMAND_CUT, COMMAND_ADMIT, COMMAND_REFUSE, COMMAND_PREEMPT,
+                         ADMISSION_NONE, ADMISSION_WAITING, ADMISSION_ADMITTED)
+import sqlite3
 import time
 import json
 import sys
@@ -25,12 +37,80 @@ from saa.const import (
     DEFAULT_DOWNLOAD_DIR,
     STREAMER_UPDATE_COM_STATUS_SLEEP,
     STREAM_WATCHDOG_DEFAULT_SLEEP,
+    STREAMER_CHUNK_WRITER_JOIN_TIMEOUT,
+    STREAM_STALL_TIMEOUT,
+    STREAMLINK_ERROR_RESTART_COUNT,
+    STREAMLINK_ERROR_STALL_TIMEOUT,
+    STREAM_RESOLUTION_MAX_AGE,
+    STREAM_RESOLVED_URL_PREFIXES,
+    STREAMLINK_LOG_FILE_EXT,
+    VOLUME_MIN_FREE_BYTES,
+    PIPELINE_MAX_BACKLOG,
+    RETENTION_CHECK_INTERVAL,
+    HLS_CONCURRENCY,
+    HLS_PREFETCH,
+    HLS_RESUME_MAX_AGE,
     NEWLINE_CHAR
 )
 
 log = logging.getLogger('root')
 
 
+class _AdoptedProcess:
+    """
+    A Streamlink process started by a previous SAA (handoff mode), in place of a Popen.
+
+    It is not our child, so it can't be waited on. /proc is checked instead, comparing the process' start time
+    so a reused PID is not mistaken for it. The exit code is not known, so once it has exited poll() gives
+    UNKNOWN_RETURNCODE, which is handled like Streamlink failing rather than like a chunk being cut.
+    """
+    UNKNOWN_RETURNCODE = 1
+
+    def __init__(self, pid, start_time):
+        self.pid = pid
+        self.start_time = start_time
+
+    @staticmethod
+    def process_start_time(pid):
+        """
+        :return: start time of the process (in clock ticks since boot), None if it is not running
+        """
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                # The process name (2nd field) can contain spaces, so split after it
+                fields = f.read().rsplit(")", 1)[1].split()
+        except (OSError, IndexError):
+            return None
+        if fields[0] == "Z":
+            return None
+        return int(fields[19])
+
+    @classmethod
+    def find(cls, pid, start_time):
+        """
+        :return: the process, None if it is no longer running
+        """
+        if start_time is None or cls.process_start_time(pid) != start_time:
+            return None
+        return cls(pid, start_time)
+
+    def poll(self):
+        return None if self.process_start_time(self.pid) == self.start_time else self.UNKNOWN_RETURNCODE
+
+    def send_signal(self, sig):
+        if self.poll() is None:
+            try:
+                os.kill(self.pid, sig)
+            except ProcessLookupError:
+                pass
+
+    def terminate(self):
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self):
+        self.send_signal(signal.SIGKILL)
+
+
 class StreamArchiver:
 
     def __init__(self, url,
@@ -43,6 +123,22 @@ class StreamArchiver:
                  quality=STREAM_DEFAULT_QUALITY,
                  com_queue=None,
                  recheck_channel_interval=RECHECK_CHANNEL_STATUS_TIME,
+                 profile_directory=None,
+                 enable_instrumentation=False,
+                 checksum=None,
+                 stall_timeout=STREAM_STALL_TIMEOUT,
+                 volumes=None,
+                 volume_min_free=None,
+                 expected_bitrate=None,
+                 write_buffer_size=None,
+                 drop_page_cache=False,
+                 handoff=False,
+                 admission_control=False,
+                 resolution_max_age=STREAM_RESOLUTION_MAX_AGE,
+                 pipeline=None,
+                 pipeline_max_backlog=PIPELINE_MAX_BACKLOG,
+                 retention=None,
+                 hls_engine=None,
                  *args, **kwargs):
 
         self.url = str(url)
@@ -58,11 +154,24 @@ class StreamArchiver:
             download_directory = os.path.join(DEFAULT_DOWNLOAD_DIR, self.streamer_name)  # TODO: Sanitize this
         self.download_directory = str(download_directory)
 
+        # With a volume pool, each chunk is placed in the streamer's directory on the least loaded volume (see saa.volumes)
+        # self.download_directory and self._journal are then those of the directory the current chunk is in.
+        self.download_directories = [self.download_directory]
+        self.__volume_pool = None
+        if volumes:
+            self.download_directories = volume_directories(volumes, self.streamer_name)
+            self.download_directory = self.download_directories[0]
+            self.__volume_pool = VolumePool(self.download_directories, min_free=int(
+                volume_min_free if volume_min_free is not None else VOLUME_MIN_FREE_BYTES))
+
         self.streamlink_bin = str(streamlink_bin)
         self.quality = str(quality)
         self.make_dirs = bool(make_dirs)
 
         self._current_process = None
+        self._journal = None
+        self._journals = {}  # download directory: journal
+        self.__current_chunk = None  # (temp filename, start time, journal chunk id)
         self.__stdout_queue = None
         self.__stdout_thread = None
         self.__stderr_queue = None
@@ -72,19 +181,97 @@ class StreamArchiver:
         self.__chunk_start_time = 0
         self.__split_by_time = True
 
+        # Stall detection: the chunk has to grow at least once every stall_timeout seconds
+        self.stall_timeout = float(stall_timeout if stall_timeout is not None else STREAM_STALL_TIMEOUT)
+        self.__chunk_bytes = 0
+        self.__last_progress_time = 0
+        self.__stalled_for = 0
+        # Streamlink's log, classified (see saa.streamlinklog)
+        self.__download_errors = 0  # segment and playlist errors since the chunk last grew
+        self.__stream_ended = False  # if Streamlink has said the stream ended
+
         # Extra Stats
         self.__current_chunks = 0  # amount of chunks done for the current livestream (resets when stream is down)
         self.__stream_start_time = None
+        self.__stalls = 0  # amount of times Streamlink has stalled since the archiver started
+        # amount of each counted Streamlink log event since the archiver started
+        self.__streamlink_events = {event: 0 for event in streamlinklog.COUNTED_EVENTS}
+        self.__last_chunk = None  # stats of the last finished chunk
 
         # External reporting communication (for reporting plugins)
         self.__master_reporting_queue = com_queue
         self.__reporting_thread = None
 
+        # Control API (see saa.control)
+        self.__control = None
+        self.__recheck_now = threading.Event()
+        self.__cut_now = threading.Event()
+
+        # Admission control (see saa.admission), the StreamWatcher decides when a live stream can be recorded
+        self.admission_control = bool(admission_control)
+        self.__admission_decided = threading.Event()
+        self.__admitted = False
+        self.__preempt = threading.Event()
+
         self._recheck_interval = recheck_channel_interval or RECHECK_CHANNEL_STATUS_TIME
+        # The first chunk is downloaded from the stream the live check resolved, if it is no older than this
+        self.resolution_max_age = float(resolution_max_age or 0)
+        self.__live_check = None  # (time, streams from streamlink --json) of the last live check that was live
+        self.__chunk_resolved = False  # if the current chunk is being downloaded from the live check's resolved stream
+        self.profile_directory = profile_directory
+        self.enable_instrumentation = bool(enable_instrumentation)
+
+        # Checksum algorithm for recordings (see saa.checksum)
+        self.checksum = None
+        if checksum is not None:
+            try:
+                checksum_module.new_hasher(str(checksum))
+                self.checksum = str(checksum).lower()
+            except ValueError as e:
+                log.critical(f"{e}. Recording without checksums.")
+
+        # The SAA write path (see saa.writer), used for checksums and/or any of these
+        self.expected_bitrate = int(expected_bitrate) if expected_bitrate else None  # bits/s, to preallocate chunks
+        self.write_buffer_size = int(write_buffer_size) if write_buffer_size else None
+        self.drop_page_cache = bool(drop_page_cache)
+        self.write_through_saa = (self.checksum is not None or self.expected_bitrate is not None
+                                  or self.write_buffer_size is not None or self.drop_page_cache)
+        self.__chunk_writer = None
+
+        # In-process HLS downloads, Streamlink only resolves the stream (see saa.hls)
+        self.hls_engine = bool(hls_engine)
+        self.hls_concurrency = utils.try_get(hls_engine, lambda x: x['concurrency'], int) or HLS_CONCURRENCY
+        self.hls_prefetch = utils.try_get(hls_engine, lambda x: x['prefetch'], int) or HLS_PREFETCH
+        self.__hls_resume = None  # (last segment's media sequence number, time) of the last in-process download
+
+        # Handoff mode: on SIGHUP, leave Streamlink recording for the next SAA to adopt (see handoff_handler)
+        self.handoff = bool(handoff)
+        if self.handoff and self.write_through_saa:
+            log.warning("Recordings written through SAA can not be handed off, handoff is disabled for this streamer.")
+            self.handoff = False
+        if self.handoff and self.hls_engine:
+            log.warning("In-process HLS downloads can not be handed off, handoff is disabled for this streamer.")
+            self.handoff = False
+        self.__streamlink_log = None  # in handoff mode, Streamlink logs to a file rather than a pipe
+
+        # Post-processing steps run on finished chunks before they are uploaded (see saa.pipeline)
+        try:
+            self.pipeline_steps = pipeline_module.build_steps(pipeline)
+        except ValueError as e:
+            log.critical(f"{e}. Uploading chunks without post-processing.")
+            self.pipeline_steps = ()
+        self.pipeline_max_backlog = int(pipeline_max_backlog if pipeline_max_backlog is not None
+                                        else PIPELINE_MAX_BACKLOG)
+        self.__pipeline_queue = None
+
+        # Budgets for keeping uploaded chunks locally (see saa.retention)
+        self.retention = RetentionPolicy.from_conf(retention)
+        self.__evicted = {"chunks": 0, "bytes": 0}  # since the archiver started
 
     @staticmethod
+    @instrumentation.timed("start_streamlink_process")
     def _start_streamlink_process(stream_url, file: str, quality=STREAM_DEFAULT_QUALITY, optional_sl_args=None,
-                                  streamlink_bin=STREAMLINK_BINARY):
+                                  streamlink_bin=STREAMLINK_BINARY, to_stdout=False, log_file=None):
         """
 
         Start Streamlink, downloading the given stream to the given file.
@@ -92,6 +279,9 @@ class StreamArchiver:
         :param url: url of stream
         :param file: file to download to
         :param quality: quality of the stream
+        :param to_stdout: write the stream to stdout instead of file (Streamlink then logs to stderr)
+        :param log_file: write Streamlink's output to this file, in its own session,
+                         so it can keep running after we exit (handoff mode)
         :return: the process object
         """
         if optional_sl_args is None:
@@ -104,9 +294,15 @@ class StreamArchiver:
         else:
             optional_sl_args.extend(['-l', 'debug'])
 
-        return subprocess.Popen([streamlink_bin, stream_url, quality, "-o", file] + optional_sl_args,
+        output_args = ["--stdout"] if to_stdout else ["-o", file]
+        if log_file is not None:
+            with open(log_file, "wb") as f:
+                return subprocess.Popen([streamlink_bin, stream_url, quality] + output_args + optional_sl_args,
+                                        stdout=f, stderr=subprocess.STDOUT, start_new_session=True)
+        return subprocess.Popen([streamlink_bin, stream_url, quality] + output_args + optional_sl_args,
                                 stdout=subprocess.PIPE, stderr=subprocess.PIPE)
 
+    @instrumentation.timed("is_live")
     def _is_live(self):
         """
 
@@ -117,6 +313,11 @@ class StreamArchiver:
         :param url:
         :return: True if there is a stream, false if not
         """
+        self.__live_check = None
+        if self._probed_offline():
+            log.debug(f"{self.streamer_name} is offline according to a probe plugin, not checking with Streamlink.")
+            return False
+        check_time = time.time()
         try:
             process_ = subprocess.run([STREAMLINK_BINARY, self.url, '--json'] + self.streamlink_args,
                                       capture_output=True)
@@ -169,42 +370,111 @@ class StreamArchiver:
 
         # if there is no error key in the json output, assume good.
         if "error" not in json_output:
+            self.__live_check = (check_time, json_output.get("streams") or {})
             return True
 
         else:
             log.debug(f"Streamlink said: {json_output['error']}")
             return False
 
-    def _stream_download_handler(self, stream_url):
+    def _probed_offline(self):
+        """
+        :return: True if a probe plugin has recently found the streamer to be offline (see ProbePluginHandler)
+        """
+        if self.__control is None:
+            return False
+        state = self.__control.state()
+        return time.time() < state['probe_expires'] and not state['probe_live']
+
+    def _live_check_stream(self, max_age):
+        """
+        The stream (of the configured quality) the last live check resolved. It can only be used once.
+
+        :param max_age: seconds since the live check it can be used for (as the stream urls can expire), 0 for never
+        :return: the stream from streamlink --json ({type, url, headers}), None if there is none
+        """
+        live_check, self.__live_check = self.__live_check, None
+        if live_check is None or not max_age or time.time() - live_check[0] > max_age:
+            return None
+        streams = live_check[1]
+        stream = next((streams[q.strip()] for q in self.quality.split(",") if q.strip() in streams), None)
+        if not isinstance(stream, dict) or not stream.get("url"):
+            return None
+        return stream
+
+    def _resolved_stream(self):
+        """
+        The stream the last live check resolved, so Streamlink can download it without resolving it again.
+        It can only be used while it is no older than self.resolution_max_age.
+
+        :return: (url, quality, extra Streamlink args) to download it with, None to resolve the stream again
+        """
+        stream = self._live_check_stream(self.resolution_max_age)
+        if stream is None or stream.get("type") not in STREAM_RESOLVED_URL_PREFIXES:
+            return None
+        args = []
+        for header, value in (stream.get("headers") or {}).items():
+            args.extend(["--http-header", f"{header}={value}"])
+        return STREAM_RESOLVED_URL_PREFIXES[stream["type"]] + stream["url"], STREAM_DEFAULT_QUALITY, args
+
+    def _start_hls_download(self, file):
+        """
+        Start an in-process download of the stream (see saa.hls), from the stream the live check resolved if it is
+        still fresh, otherwise resolving it again. If the last download stopped just now (the chunk was cut), this one
+        carries on from the segment after its last one.
+
+        :return: HLSDownload, None to download the stream with Streamlink
+        """
+        # Only imported for streamers using it, as it loads requests
+        from saa.hls import HLSDownload, UnsupportedPlaylist
+
+        stream = self._live_check_stream(self.resolution_max_age)
+        if stream is None and self._is_live():
+            stream = self._live_check_stream(float("inf"))
+        if stream is None or stream.get("type") != "hls":
+            log.debug("No HLS stream resolved, downloading the stream with Streamlink.")
+            return None
+        start_after = None
+        if self.__hls_resume is not None and time.time() - self.__hls_resume[1] <= HLS_RESUME_MAX_AGE:
+            start_after = self.__hls_resume[0]
+        download = HLSDownload(stream["url"], file, headers=stream.get("headers"), concurrency=self.hls_concurrency,
+                               prefetch=self.hls_prefetch, start_after=start_after, to_stdout=self.write_through_saa)
+        try:
+            return download.start()
+        except UnsupportedPlaylist as e:
+            log.warning(f"The stream can not be downloaded in process ({e}), using Streamlink for it from now on.")
+            self.hls_engine = False
+        except (OSError, ValueError) as e:
+            log.warning(f"Could not fetch the stream's playlist ({e}), downloading it with Streamlink.")
+        return None
+
+    def _stream_download_handler(self, stream_url, adopted=None):
 
         """
         Loop that handles downloading the stream, splitting it every X amount of time
+
+        :param adopted: (chunk, process, chunk start time) of a recording handed off by the previous SAA,
+                        to carry on with as the first chunk
         """
 
         errors = 0
         while True:
 
             # One loop = one split
-            # Get start times
-            start_time_p, start_time_m = utils.get_utc_nice(), utils.get_utc_machine()
-
-            # Create a filename for this loop
-            # Start with identifier (in this case "D") so we can always check if download has failed
-            filename = start_time_p + "_" + self.streamer_name + ".ts" + TEMP_FILE_EXT
-
-            log.info(f"Starting download of stream {filename}.")
-
-            # Start the download process
-            self._current_process = self._start_streamlink_process(stream_url,
-                                                                   os.path.join(self.download_directory, filename),
-                                                                   optional_sl_args=self.streamlink_args,
-                                                                   quality=self.quality,
-                                                                   streamlink_bin=self.streamlink_bin)
+            chunk_start_time = None
+            if adopted is not None:
+                self.__current_chunk, self._current_process, chunk_start_time = adopted
+                adopted = None
+                log.info(f"Carrying on with download of stream {self.__current_chunk[0]}.")
+                self._set_control_state(chunks=self.__current_chunks)
+            else:
+                self._start_chunk(stream_url)
 
             # Start the stream watchdog, which will sleep and watch until we next split the stream
-            status = self._stream_watchdog()
+            status = self._stream_watchdog(chunk_start_time)
             self.__current_chunks += 1
-            if status == 0:
+            download = self._current_process
+            if status == 0 or status == 3 or status == 4:
                 log.info(f"Cutting stream")
                 if self._current_process.poll() is None:
                     self._current_process.kill()
@@ -230,27 +500,214 @@ class StreamArchiver:
                     # So if it does then something has gone wrong and we should terminate it.
                     self._current_process.terminate()
 
-            log.debug(f"Finalizing files...")
-            end_time_p, end_time_m = utils.get_utc_nice(), utils.get_utc_machine()
+            if getattr(download, "last_sequence", None) is not None:
+                # An in-process HLS download, the next one carries on from its last segment
+                self.__hls_resume = (download.last_sequence, time.time())
 
-            # Rename the file as a completed split
-            if os.path.exists(os.path.join(self.download_directory, filename)):
-                os.rename(os.path.join(self.download_directory, filename), os.path.join(self.download_directory,
-                                                                                        start_time_p + "_to_" + end_time_p + "_" + self.streamer_name + ".ts"))
+            log.debug(f"Finalizing files...")
+            with instrumentation.span("finalize_chunk"):
+                chunk_bytes = self._finalize_current_chunk()
+            self._chunk_done(chunk_bytes, time.time() - self.__chunk_start_time, stalled=status == 3)
 
             # Run some checks based on the return code
+            if status == 4:
+                return 4
+            if status > 0 and self.__chunk_resolved and chunk_bytes == 0:
+                # e.g. the resolved stream url had expired, so resolve it again rather than taking it as the end
+                log.debug("Could not download the stream resolved by the live check, resolving it again.")
+                continue
             if status > 0:
                 # Stream has ended
                 if status == 1:
                     log.info(f"Stream has ended.")
                     return 1
-                # Stream has crashed, after 3 errors abort (TODO)
-                if status == 2 or status == -1:
+                # Stream has crashed or stalled, after 3 errors abort (TODO)
+                # A stalled stream is restarted straight away, and so is a crashed one.
+                if status == 2 or status == 3 or status == -1:
                     errors += 1
                     if errors > 3:
                         log.warning("Finished due to error with stream (-1)")
                         return -1
 
+    def _start_chunk(self, stream_url):
+        """
+        Start recording a new chunk.
+        """
+        # Get start times
+        start_time_p, start_time_m = utils.get_utc_nice(), utils.get_utc_machine()
+
+        # Create a filename for this loop
+        # Start with identifier (in this case "D") so we can always check if download has failed
+        filename = start_time_p + "_" + self.streamer_name + ".ts" + TEMP_FILE_EXT
+
+        if self.__volume_pool is not None:
+            self._use_directory(self.__volume_pool.choose() or self.download_directory)
+
+        log.info(f"Starting download of stream {filename}.")
+        self._set_control_state(chunks=self.__current_chunks)
+        chunk_id = self._journal.open_chunk(filename) if self._journal is not None else None
+        self.__current_chunk = (filename, start_time_p, chunk_id)
+
+        self.__chunk_resolved = False
+        self._current_process = None
+        if self.hls_engine:
+            self._current_process = self._start_hls_download(os.path.join(self.download_directory, filename))
+
+        log_file = None
+        if self._current_process is None:
+            # Start the download process, from the stream the live check resolved if it is still fresh
+            quality, streamlink_args = self.quality, self.streamlink_args
+            resolved = self._resolved_stream()
+            self.__chunk_resolved = resolved is not None
+            if resolved is not None:
+                stream_url, quality, resolved_args = resolved
+                streamlink_args = streamlink_args + resolved_args
+                log.debug("Downloading the stream resolved by the live check.")
+            if self.handoff and chunk_id is not None:
+                log_file = self._journal.side_file_path(chunk_id, STREAMLINK_LOG_FILE_EXT)
+            self._current_process = self._start_streamlink_process(stream_url,
+                                                                   os.path.join(self.download_directory, filename),
+                                                                   optional_sl_args=streamlink_args,
+                                                                   quality=quality,
+                                                                   streamlink_bin=self.streamlink_bin,
+                                                                   to_stdout=self.write_through_saa,
+                                                                   log_file=log_file)
+        if log_file is not None:
+            self.__streamlink_log = open(log_file, "r", errors="replace")
+        if self.write_through_saa:
+            self.__chunk_writer = ChunkWriter(self._current_process.stdout,
+                                              os.path.join(self.download_directory, filename),
+                                              algorithm=self.checksum,
+                                              buffer_size=self.write_buffer_size,
+                                              preallocate_bytes=self._expected_chunk_bytes(),
+                                              drop_cache=self.drop_page_cache)
+            self.__chunk_writer.start()
+
+    def _finalize_current_chunk(self):
+        """
+        Finalize the chunk currently being recorded (Streamlink must have exited already).
+        :return: size of the chunk in bytes
+        """
+        if self.__current_chunk is None:
+            return 0
+        filename, start_time_p, chunk_id = self.__current_chunk
+        self.__current_chunk = None
+
+        digest = None
+        if self.__chunk_writer is not None:
+            digest, chunk_bytes = self.__chunk_writer.join(timeout=STREAMER_CHUNK_WRITER_JOIN_TIMEOUT)
+            self.__chunk_writer = None
+            if digest is None and self.checksum is not None:
+                log.error(f"Failed to write {filename} through SAA, no manifest will be written for it.")
+        else:
+            chunk_bytes = self._file_size(os.path.join(self.download_directory, filename))
+
+        self._close_streamlink_log()
+
+        end_time_p = utils.get_utc_nice()
+        # Rename the file as a completed split
+        self._finalize_chunk(chunk_id, filename, start_time_p + "_to_" + end_time_p + "_" + self.streamer_name + ".ts",
+                             digest)
+        return chunk_bytes
+
+    def _expected_chunk_bytes(self):
+        """
+        :return: bytes to preallocate for a chunk, 0 if expected_bitrate is not set
+        """
+        if self.expected_bitrate is None:
+            return 0
+        return self.expected_bitrate // 8 * self.split_time
+
+    @staticmethod
+    def _file_size(path):
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return 0
+
+    def _current_chunk_bytes(self):
+        """
+        :return: bytes written to the current chunk so far
+        """
+        if self.__chunk_writer is not None:
+            return self.__chunk_writer.bytes_written
+        if self.__current_chunk is None:
+            return 0
+        return self._file_size(os.path.join(self.download_directory, self.__current_chunk[0]))
+
+    def _chunk_done(self, chunk_bytes, duration, stalled=False):
+        """
+        Record the stats of a finished chunk, and report them (and the stall, if it stalled).
+        """
+        bytes_per_second = chunk_bytes / duration if duration > 0 else 0.0
+        self.__last_chunk = {"bytes": chunk_bytes, "duration": duration, "bytes_per_second": bytes_per_second,
+                             "stalled": stalled}
+        log.debug(f"Chunk finished: {chunk_bytes} bytes in {duration:.1f}s ({bytes_per_second / 1000:.1f} kB/s)")
+        if stalled:
+            self.__stalls += 1
+            self._report_event("stall", self.__stalled_for)
+        if chunk_bytes > 0:
+            self._report_event("chunk", bytes_per_second)
+
+    def _finalize_chunk(self, chunk_id, temp_name, final_name, digest=None):
+        """
+        Rename a chunk to its final name, recording it in the journal (if there is one).
+
+        :param chunk_id: id of the chunk in the journal, None if there is no journal
+        :param digest: checksum of the chunk, if set the manifest is written for it
+        :return: True if the chunk was finalized, False if there was no file
+        """
+        temp_path = os.path.join(self.download_directory, temp_name)
+        if not os.path.exists(temp_path):
+            if chunk_id is not None:
+                self._journal.discard_chunk(chunk_id)
+            return False
+        if chunk_id is not None:
+            self._journal.begin_finalize(chunk_id, final_name, size=os.path.getsize(temp_path))
+        os.rename(temp_path, os.path.join(self.download_directory, final_name))
+        if digest is not None:
+            checksum_module.write_manifest(self.download_directory, final_name, self.checksum, digest)
+        if chunk_id is not None:
+            self._finalize_journal_chunk(chunk_id, final_name)
+        return True
+
+    def _post_processing(self):
+        """
+        :return: True if finished chunks go through the post-processing pipeline
+        """
+        return bool(self.pipeline_steps) and self.__pipeline_queue is not None and self._journal is not None
+
+    def _finalize_journal_chunk(self, chunk_id, final_name):
+        """
+        Mark a renamed chunk as ready to be uploaded, or as waiting for post-processing.
+        """
+        process = self._post_processing()
+        if process and self._journal.processing_count() >= self.pipeline_max_backlog:
+            log.warning(f"{self.pipeline_max_backlog} chunks are already waiting for post-processing, "
+                        f"uploading {final_name} without it.")
+            process = False
+        self._journal.finalize_chunk(chunk_id, process=process)
+        if process:
+            self._notify_pipeline()
+
+    def _notify_pipeline(self):
+        self.__pipeline_queue.put({'streamer': self.streamer_name, 'directory': self.download_directory,
+                                   'steps': self.pipeline_steps})
+
+    def _resume_post_processing(self):
+        """
+        Pick up the chunks left waiting for post-processing, or if it is off now, let them be uploaded as they are.
+        """
+        for directory, journal in self._journals.items():
+            if journal is None or not journal.processing_count():
+                continue
+            if self._post_processing():
+                self.__pipeline_queue.put({'streamer': self.streamer_name, 'directory': directory,
+                                           'steps': self.pipeline_steps})
+            else:
+                log.info(f"Post-processing is off, uploading {journal.finish_processing()} chunks in {directory} "
+                         f"without it.")
+
     def __start_std_watcher(self, std):
         queue = Queue()
         thread = threading.Thread(target=self.__enqueue_std, args=(std, queue))
@@ -295,7 +752,8 @@ class StreamArchiver:
         if queue is None and thread is None:
             thread, queue = self.__start_std_watcher(std)
 
-        if not thread.is_alive():
+        if not thread.is_alive() and (queue is None or queue.empty()):
+            # Not before what it read has been, e.g. Streamlink's last lines before it exited
             thread, queue = self.__start_std_watcher(std)
 
         data.clear()
@@ -329,6 +787,64 @@ class StreamArchiver:
         except ValueError:  # If the file is closed
             return
 
+    def _read_streamlink_log(self, lines=10):
+        """
+        Read new lines from Streamlink's log file (handoff mode)
+        """
+        data = []
+        for x in range(lines):
+            line = self.__streamlink_log.readline()
+            if not line:
+                break
+            data.append(line)
+        return data
+
+    def _close_streamlink_log(self, remove=True):
+        if self.__streamlink_log is None:
+            return
+        self.__streamlink_log.close()
+        if remove:
+            try:
+                os.unlink(self.__streamlink_log.name)
+            except OSError:
+                pass
+        self.__streamlink_log = None
+
+    def _read_streamlink_output(self, lines=20):
+        """
+        :return: (lines of Streamlink's log, lines of anything else it wrote to stderr)
+        """
+        if self.__streamlink_log is not None:
+            return self._read_streamlink_log(lines=lines), []
+        if self.write_through_saa:
+            # The stream itself is on stdout (being read by the chunk writer), so Streamlink logs to stderr
+            return self._read_stderr(lines=lines), []
+        return self._read_stdout(lines=lines), self._read_stderr(lines=lines)
+
+    def _handle_streamlink_output(self, stdout_data, stderr_data):
+        """
+        Log and count what Streamlink has logged, see saa.streamlinklog for the events.
+        """
+        for line in stderr_data:
+            # Not sure if Streamlink outputs to stderr, but just in case...
+            log.error(f"[Streamlink][stderr]: {line}")
+
+        for line in stdout_data:
+            entry = streamlinklog.classify(line)
+            if entry.event in self.__streamlink_events:
+                self.__streamlink_events[entry.event] += 1
+
+            if entry.event == streamlinklog.EVENT_LOG:
+                log.debug(f"[Streamlink]: {line.strip()}")
+            elif entry.event in (streamlinklog.EVENT_SEGMENT_ERROR, streamlinklog.EVENT_PLAYLIST_RELOAD_FAILED):
+                self.__download_errors += 1
+                log.debug(f"Stream has probably ended - Streamlink said: {entry.message}")
+            elif entry.event == streamlinklog.EVENT_STREAM_ENDED:
+                self.__stream_ended = True
+                log.debug(f"[Streamlink]: {line.strip()}")
+            else:
+                log.error(f"[Streamlink][stdout]:{line}")
+
     def __s_wd_keep_running(self):
         """
 
@@ -346,7 +862,7 @@ class StreamArchiver:
 
         return False
 
-    def _stream_watchdog(self):
+    def _stream_watchdog(self, chunk_start_time=None):
 
         """
 
@@ -359,75 +875,150 @@ class StreamArchiver:
         0 - success, still running
         1 - Stream has finished
         2 - Streamlink exit code > 0 (crashed etc)
+        3 - Stalled, the chunk has not grown for self.stall_timeout seconds (Streamlink is still running)
+        4 - Preempted by admission control, to make room for a higher priority stream (Streamlink is still running)
 
+        :param chunk_start_time: when the chunk started, if not now (an adopted recording)
         """
 
-        if not isinstance(self._current_process, subprocess.Popen):
+        if self._current_process is None:
             return -1
 
-        self.__chunk_start_time = time.time()
+        self.__chunk_start_time = chunk_start_time or time.time()
+        self.__chunk_bytes = 0
+        self.__last_progress_time = time.time()
+        self.__download_errors = 0
+        self.__stream_ended = False
+        self._set_control_state(chunk_start_time=self.__chunk_start_time, streamlink_pid=self._current_process.pid,
+                                bytes_per_second=0)
+        # Only cut requests made during this chunk count
+        self.__cut_now.clear()
 
         while self.__s_wd_keep_running():
 
-            stdout_data = self._read_stdout(lines=20)
-            stderr_data = self._read_stderr(lines=20)
+            if self.__preempt.is_set():
+                log.warning("Stopping recording, to make room for a higher priority stream.")
+                return 4
+
+            self._handle_streamlink_output(*self._read_streamlink_output(lines=20))
 
             current_proc_state = self._current_process.poll()
             if current_proc_state is not None:
+                # Whatever it logged before exiting
+                self._handle_streamlink_output(*self._read_streamlink_output(lines=1000))
                 log.debug(f"Return code of process is {current_proc_state}")
+                if current_proc_state == 0 and self.__stream_ended:
+                    # Check straight away if it is still live, rather than restarting Streamlink to find out
+                    log.debug("Streamlink says the stream has ended.")
+                    self.__recheck_now.set()
+                    return 1
                 return current_proc_state
 
-            for line in stderr_data:
-                # Not sure if Streamlink outputs to stderr, but just in case...
-                log.error(f"[Streamlink][stderr]: {line}")
-
-            for line in stdout_data:
-                # TODO: Process logs from stdout
-                if "error" not in line.lower():
-                    log.debug("[Streamlink]: " + str(line).strip())
-                    continue
-
-                # TODO: Streamlink will eventually quit with this error.
-                # Do we want to override this?
-                if "failed to reload playlist: unable to open url" in line.lower() or "failed to open segment" in line.lower():
-                    log.debug(f"Stream has probably ended - Streamlink said: {line}")
-                    break
-
-                log.error(f"[Streamlink][stdout]:{line}")
-
-            time.sleep(STREAM_WATCHDOG_DEFAULT_SLEEP)
+            chunk_bytes = self._current_chunk_bytes()
+            if chunk_bytes > self.__chunk_bytes:
+                self.__chunk_bytes = chunk_bytes
+                self.__last_progress_time = time.time()
+                self.__download_errors = 0
+                self._set_control_state(bytes_per_second=chunk_bytes / max(time.time() - self.__chunk_start_time, 1))
+            elif self.stall_timeout and time.time() - self.__last_progress_time > self.stall_timeout:
+                self.__stalled_for = time.time() - self.__last_progress_time
+                log.warning(f"Streamlink has not written anything for {self.__stalled_for:.0f}s, "
+                            f"it has stalled. Restarting it.")
+                return 3
+            elif (self.stall_timeout and self.__download_errors >= STREAMLINK_ERROR_RESTART_COUNT
+                  and time.time() - self.__last_progress_time > STREAMLINK_ERROR_STALL_TIMEOUT):
+                self.__stalled_for = time.time() - self.__last_progress_time
+                log.warning(f"Streamlink has failed to download the stream {self.__download_errors} times, and has not "
+                            f"written anything for {self.__stalled_for:.0f}s. Restarting it.")
+                return 3
+
+            if self.__cut_now.wait(STREAM_WATCHDOG_DEFAULT_SLEEP) and not self.__preempt.is_set():
+                log.info("Cutting chunk early, as requested through the control API.")
+                return 0
 
         return 0
 
-    def _streamer_watchdog(self):
+    def _streamer_watchdog(self, adopted=None):
 
         """
 
         Checks if streamer is streaming, and if so, triggers the download handler.
 
+        :param adopted: recording handed off by the previous SAA, see _adopt_handoffs
         """
         run = True
         not_live_runs = 0
 
         while run:
-            stream_status = self._is_live()
+            if adopted is not None:
+                # Still recording, so still live
+                stream_status = True
+            else:
+                stream_status = self._is_live()
+                self._set_control_state(last_check_time=time.time())
 
             if not stream_status:
+                self._withdraw_admission()
                 if not_live_runs == 0:
                     log.info(f"{self.streamer_name} is not currently live.")
                     not_live_runs += 1
                 else:
                     log.debug(f"{self.streamer_name} is not currently live.")
+            elif adopted is None and not self._request_admission():
+                # Queued or refused, the command thread wakes us up if admitted
+                not_live_runs = 0
             else:
                 log.info(f"{self.streamer_name} is live, archiving started.")
                 not_live_runs = 0
                 self.__current_chunks = 0
-                self.__stream_start_time = time.time()
-                return_code = self._stream_download_handler(self.url)
+                self.__stream_start_time = adopted[2] if adopted is not None else time.time()
+                self._set_control_state(is_live=True, stream_start_time=self.__stream_start_time, chunks=0)
+                if adopted is not None and self.admission_control:
+                    # Already recording, so counts as admitted
+                    self._set_control_state(admission=ADMISSION_ADMITTED)
+                return_code = self._stream_download_handler(self.url, adopted)
+                adopted = None
                 self.__current_chunks = 0
                 self.__stream_start_time = None
+                self._set_control_state(is_live=False, stream_start_time=0, chunk_start_time=0,
+                                        admission=ADMISSION_NONE, streamlink_pid=0, bytes_per_second=0)
+                if return_code == 4:
+                    # Preempted, ask to be admitted again straight away
+                    self.__recheck_now.set()
+
+            # Sleep until the next check, or until a recheck is requested through the control API
+            self.__recheck_now.wait(self._recheck_interval)
+            self.__recheck_now.clear()
+
+    def _request_admission(self):
+        """
+        Ask the StreamWatcher to admit recording the stream, when there is admission control (see saa.admission).
+        The decision comes back as a command, which also wakes up the streamer watchdog to ask again.
+
+        :return: True if admitted (or there is no admission control), False if waiting or refused
+        """
+        if not self.admission_control or self.__control is None:
+            return True
+        if not self.__admission_decided.is_set():
+            log.debug("Waiting to be admitted by admission control.")
+            self._set_control_state(admission=ADMISSION_WAITING)
+            return False
+        self.__admission_decided.clear()
+        if not self.__admitted:
+            log.info(f"{self.streamer_name} is live, but there is no capacity to record it.")
+            self._set_control_state(admission=ADMISSION_NONE)
+            return False
+        self.__preempt.clear()
+        self._set_control_state(admission=ADMISSION_ADMITTED)
+        return True
 
-            time.sleep(self._recheck_interval)
+    def _withdraw_admission(self):
+        """
+        Stop waiting to be admitted (the stream is no longer live).
+        """
+        if self.admission_control:
+            self.__admission_decided.clear()
+            self._set_control_state(admission=ADMISSION_NONE)
 
     def _display_config(self):
 
@@ -435,22 +1026,92 @@ class StreamArchiver:
                  f"Configuration:\n"
                  f"Stream Name: {self.streamer_name}\n"
                  f"URL: {self.url}\n"
-                 f"Download Directory: {self.download_directory}\n"
+                 f"Download Directories: {', '.join(self.download_directories)}\n"
                  f"Stream Split Length: {self.split_time}s\n"
                  f"Quality: {self.quality}\n"
+                 f"Stall Timeout: {f'{self.stall_timeout:g}s' if self.stall_timeout else 'off'}\n"
                  f"Make Directories: {self.make_dirs}\n"
+                 f"Post-processing: {', '.join(step.name for step in self.pipeline_steps) or 'none'}\n"
+                 f"Retention: {self.retention or 'none'}\n"
+                 f"In-process HLS downloads: "
+                 f"{f'{self.hls_concurrency} segments at once, {self.hls_prefetch} ahead' if self.hls_engine else 'off'}\n"
                  f"Extra Streamlink args {self.streamlink_args}"
                  f"\n----------\n"
                  "")
 
+    def _open_journal(self):
+        try:
+            self._journal = ChunkJournal(self.download_directory, self.streamer_name)
+        except sqlite3.Error as e:
+            log.warning(f"Could not open chunk journal, falling back to scanning the download directory: {e}")
+            self._journal = None
+        self._journals[self.download_directory] = self._journal
+
+    def _use_directory(self, directory):
+        """
+        Switch to one of the download directories (and its journal), for the next chunk.
+        """
+        self.download_directory = directory
+        if directory not in self._journals:
+            self._open_journal()
+        self._journal = self._journals[directory]
+
+    def _cleanup_all(self):
+        """
+        Run cleanup on every download directory.
+        """
+        current = self.download_directory
+        for directory in self.download_directories:
+            self._use_directory(directory)
+            self.cleanup()
+        self._use_directory(current)
+
+    @instrumentation.timed("cleanup")
     def cleanup(self):
+        """
+        Finalize any chunks that were left unfinished (e.g. after a crash or being killed).
+
+        With a journal, only the chunks it has as open are looked at.
+        Without one (or when the journal has just been created), falls back to scanning the download directory.
+        """
+        if self._journal is None or self._journal.created:
+            self._cleanup_directory_scan()
+            if self._journal is not None:
+                self._journal.created = False
+        if self._journal is None:
+            return
+
+        total_cleaned = 0
+        for chunk in self._journal.open_chunks():
+            temp_path = os.path.join(self.download_directory, chunk['temp_name'])
+            if os.path.exists(temp_path):
+                # Name it based on last mod time, unless we got as far as deciding the final name
+                final_name = chunk['final_name'] or (chunk['temp_name'][:15] + "_to_" + datetime.utcfromtimestamp(
+                    os.path.getmtime(temp_path)).strftime(TIME_NICE_FORMAT) + "_" + self.streamer_name + ".ts")
+                self._finalize_chunk(chunk['id'], chunk['temp_name'], final_name)
+                total_cleaned += 1
+            elif chunk['final_name'] and os.path.exists(os.path.join(self.download_directory, chunk['final_name'])):
+                # Crashed after the rename
+                self._finalize_journal_chunk(chunk['id'], chunk['final_name'])
+                total_cleaned += 1
+            else:
+                self._journal.discard_chunk(chunk['id'])
+        log.debug(f"Cleaned up {total_cleaned} unfinished streams.")
 
-        # Cleanup any files in the download directory that have failed (assuming this is the only instance)
+    def _cleanup_directory_scan(self):
+        """
+        Cleanup any files in the download directory that have failed (assuming this is the only instance),
+        by renaming based on last mod time and removing the temp file ext.
 
-        # Does so by renaming based on last mod time and removes the temp file ext
+        If there is a (new) journal, the streamer's existing finished chunks are added to it, so they still get uploaded.
+        """
         total_cleaned = 0
         for file in os.listdir(self.download_directory):
             if not file.endswith(TEMP_FILE_EXT):
+                if self._journal is not None and file.endswith("_" + self.streamer_name + ".ts") and "_to_" in file:
+                    path = os.path.join(self.download_directory, file)
+                    self._journal.add_finalized(file, os.path.getctime(path), os.path.getmtime(path),
+                                                os.path.getsize(path))
                 continue
             if file[16:-len(".ts" + TEMP_FILE_EXT)].lower() != self.streamer_name.lower():
                 continue
@@ -458,9 +1119,13 @@ class StreamArchiver:
                 os.path.getmtime(os.path.join(self.download_directory, file))).strftime(TIME_NICE_FORMAT)
             # Assuming filename is in the format <start_time>_<stream_name>.<ext>.<TEMP_FILE_EXT>
             new_name = file[:15] + "_to_" + last_mod + "_" + file[16:-len(".ts" + TEMP_FILE_EXT)] + ".ts"
-            os.rename(os.path.join(self.download_directory, file), os.path.join(self.download_directory, new_name))
+            if self._journal is not None:
+                chunk_id = self._journal.open_chunk(file, os.path.getctime(os.path.join(self.download_directory, file)))
+                self._finalize_chunk(chunk_id, file, new_name)
+            else:
+                os.rename(os.path.join(self.download_directory, file), os.path.join(self.download_directory, new_name))
             total_cleaned += 1
-        log.debug(f"Cleaned up {total_cleaned} unfinished streams.")
+        log.debug(f"Cleaned up {total_cleaned} unfinished streams (directory scan).")
 
     def kill_handler(self, sig, frame):
         """
@@ -488,14 +1153,157 @@ class StreamArchiver:
                     said = True
 
             log.debug("Cleaning up...")
-            self.cleanup()
+            self._finalize_current_chunk()
+            self._cleanup_all()
             log.debug("All finished now, exiting. Bye!")
             sys.exit(0)
         sys.exit(0)
 
+    def handoff_handler(self, sig, frame):
+        """
+        SIGHUP: exit, leaving Streamlink recording for the next SAA to adopt (handoff mode).
+        Without handoff mode, this is the same as being killed.
+        """
+        if multiprocessing.current_process().name == self.streamer_name and self.handoff:
+            self._hand_off()
+        self.kill_handler(sig, frame)
+
+    def _hand_off(self):
+        """
+        Record the current recording in the journal, and let go of it, so kill_handler leaves it running.
+        """
+        if self.__current_chunk is None or self._current_process is None or self._current_process.poll() is not None:
+            return
+        filename, start_time_p, chunk_id = self.__current_chunk
+        if chunk_id is None:
+            return
+        start_time = _AdoptedProcess.process_start_time(self._current_process.pid)
+        if start_time is None:
+            return
+        self._journal.add_handoff(chunk_id, self._current_process.pid, start_time)
+        log.info(f"Handing off download of stream {filename} (Streamlink PID {self._current_process.pid}).")
+        self.__current_chunk = None
+        self._current_process = None
+        self._close_streamlink_log(remove=False)
+
+    def _adopt_handoffs(self):
+        """
+        Take over the recordings handed off by the previous SAA.
+        Handoffs whose Streamlink has since exited are removed, leaving their chunk for cleanup to finalize.
+        Only one recording is carried on with, any others (there shouldn't be) are stopped.
+
+        :return: (chunk, process, chunk start time) of the recording to carry on with, None if there isn't one
+        """
+        adopted = None
+        current = self.download_directory
+        for directory in self.download_directories:
+            journal = self._journals.get(directory)
+            if journal is None:
+                continue
+            for handoff in journal.handoffs():
+                log_file = journal.side_file_path(handoff['chunk_id'], STREAMLINK_LOG_FILE_EXT)
+                process = _AdoptedProcess.find(handoff['pid'], handoff['pid_start_time'])
+                if process is None or adopted is not None:
+                    journal.remove_handoff(handoff['chunk_id'])
+                    if process is not None:
+                        log.warning(f"Stopping extra handed off Streamlink process {process.pid}.")
+                        process.kill()
+                    try:
+                        os.unlink(log_file)
+                    except OSError:
+                        pass
+                    continue
+                current = directory
+                self._use_directory(directory)
+                self.__streamlink_log = open(log_file, "r", errors="replace")
+                self.__streamlink_log.seek(0, os.SEEK_END)
+                temp_name = handoff['temp_name']
+                adopted = ((temp_name, temp_name[:15], handoff['chunk_id']), process, handoff['start_time'])
+                log.info(f"Adopted handed off download of stream {temp_name} (Streamlink PID {process.pid}).")
+        self._use_directory(current)
+        return adopted
+
     def set_reporting_queue(self, queue: multiprocessing.Queue):
         self.__master_reporting_queue = queue
 
+    def set_pipeline_queue(self, queue):
+        self.__pipeline_queue = queue
+
+    def set_control(self, control):
+        """
+        :param control: saa.control.ArchiverControl for this archiver
+        """
+        self.__control = control
+
+    def _set_control_state(self, **kwargs):
+        if self.__control is not None:
+            self.__control.set_state(**kwargs)
+
+    def __start_control_thread(self):
+        if self.__control is not None:
+            thread = threading.Thread(target=self.__handle_commands)
+            thread.daemon = True
+            thread.start()
+            return True
+        return False
+
+    def __handle_commands(self):
+        """
+        Separate thread that takes commands from the control API and wakes the watchdogs accordingly.
+        """
+        while True:
+            try:
+                command = self.__control.commands.get()
+            except (EOFError, OSError):
+                return
+            log.debug(f"Received control command {command}")
+            if command == COMMAND_RECHECK:
+                self.__recheck_now.set()
+            elif command == COMMAND_CUT:
+                self.__cut_now.set()
+            elif command in (COMMAND_ADMIT, COMMAND_REFUSE):
+                self.__admitted = command == COMMAND_ADMIT
+                self.__admission_decided.set()
+                self.__recheck_now.set()
+            elif command == COMMAND_PREEMPT:
+                self.__preempt.set()
+                self.__cut_now.set()
+
+    def __start_retention_thread(self):
+        if self.retention is not None:
+            thread = threading.Thread(target=self.__run_retention)
+            thread.daemon = True
+            thread.start()
+            return True
+        return False
+
+    def __run_retention(self):
+        """
+        Separate thread that deletes uploaded chunks once they are over the retention budgets.
+        It has its own connections to the journals, as SQLite connections can not be shared between threads.
+        """
+        journals = {}
+        while True:
+            try:
+                for directory in self.download_directories:
+                    if journals.get(directory) is None:
+                        journals[directory] = ChunkJournal.open_existing(directory, self.streamer_name)
+                self._apply_retention({d: j for d, j in journals.items() if j is not None})
+            except (sqlite3.Error, OSError) as e:
+                log.warning(f"Could not apply retention: {e}")
+            time.sleep(RETENTION_CHECK_INTERVAL)
+
+    @instrumentation.timed("retention")
+    def _apply_retention(self, journals):
+        chunks, reclaimed = self.retention.apply(journals)
+        if chunks == 0:
+            return
+        self.__evicted["chunks"] += chunks
+        self.__evicted["bytes"] += reclaimed
+        log.info(f"Deleted {chunks} uploaded chunks ({reclaimed / 1024 ** 2:.1f}MiB) to keep within the retention "
+                 f"budgets.")
+        self._report_event("evicted", reclaimed, is_live=self._current_process is not None)
+
     def __start_ext_com_thread(self):
         if self.__master_reporting_queue is not None:
             self.__reporting_thread = threading.Thread(target=self.__enqueue_communicate)
@@ -504,6 +1312,20 @@ class StreamArchiver:
             return True
         return False
 
+    def _report_event(self, event, value, is_live=True):
+        """
+        Push an event (e.g. a stall) to the master reporting queue, alongside the periodic status payloads.
+        """
+        if self.__master_reporting_queue is None:
+            return
+        self.__master_reporting_queue.put({'streamer': self.streamer_name,
+                                           'pid': multiprocessing.current_process().pid,
+                                           'time_utc': int(datetime.now().strftime('%s')),
+                                           'event': event,
+                                           'value': value,
+                                           'is_live': is_live,
+                                           'chunks': self.__current_chunks})
+
     def __enqueue_communicate(self):
         """
         Separate thread that pushes information about the streamer state to the master reporting queue.
@@ -513,6 +1335,9 @@ class StreamArchiver:
                        'pid': multiprocessing.current_process().pid,
                        'time_utc': int(datetime.now().strftime('%s')),
                        "is_live": False,
+                       "stalls": self.__stalls,
+                       "streamlink_events": dict(self.__streamlink_events),
+                       "evicted": dict(self.__evicted),
                        }
             if self._current_process is not None:
                 if self._current_process.poll() is None:
@@ -525,11 +1350,19 @@ class StreamArchiver:
                     except TypeError:
                         stream_time_elapsed = 0
 
+                    chunk_bytes = self._current_chunk_bytes()
                     payload = {**payload, **{"is_live": True,
                                              "chunk_time_elapsed": chunk_time_elapsed,
                                              'streamlink_pid': self._current_process.pid,
                                              'stream_time_elapsed': stream_time_elapsed,
-                                             'chunks': self.__current_chunks}}
+                                             'chunks': self.__current_chunks,
+                                             'chunk_bytes': chunk_bytes,
+                                             'chunk_bytes_per_second':
+                                                 chunk_bytes / chunk_time_elapsed if chunk_time_elapsed > 0 else 0.0}}
+            if self.__last_chunk is not None:
+                payload['last_chunk'] = self.__last_chunk
+            if instrumentation.is_enabled():
+                payload['spans'] = instrumentation.snapshot()
             self.__master_reporting_queue.put(payload)
             time.sleep(STREAMER_UPDATE_COM_STATUS_SLEEP)
 
@@ -538,10 +1371,12 @@ class StreamArchiver:
         Main entry function to start the archiver
         """
         log.info("Launching Archiver")
-        # Create download directory
-        if not os.path.exists(self.download_directory) and self.make_dirs:
+        # Create download directories
+        for directory in self.download_directories:
+            if os.path.exists(directory) or not self.make_dirs:
+                continue
             try:
-                os.makedirs(self.download_directory, exist_ok=True)
+                os.makedirs(directory, exist_ok=True)
             except (PermissionError,) as er:
                 log.critical("Permission Error was raised while trying to create download directory. "
                              "Please check the permissions of the location. "
@@ -553,11 +1388,23 @@ class StreamArchiver:
                 log.debug(f"Error:: {er}")
                 sys.exit(1)
 
+        # Open the journal of each download directory, leaving the first one current
+        for directory in reversed(self.download_directories):
+            self._use_directory(directory)
+
         # setup signals
         signal.signal(signal.SIGTERM, self.kill_handler)
         signal.signal(signal.SIGINT, self.kill_handler)
-
-        self.cleanup()
+        signal.signal(signal.SIGHUP, self.handoff_handler)
+        profiling.install_profiling_handlers(self.profile_directory)
+        instrumentation.enable(self.enable_instrumentation)
+
+        adopted = self._adopt_handoffs()
+        self._cleanup_all()
+        if adopted is not None:
+            # Only now, so cleanup did not take the adopted chunk for one left unfinished
+            self._journal.remove_handoff(adopted[0][2])
+        self._resume_post_processing()
         self._display_config()
         try:
             sqs = self.__start_ext_com_thread()
@@ -565,7 +1412,11 @@ class StreamArchiver:
                 log.debug("Started external reporting thread")
             else:
                 log.debug("No master reporting queue present, not starting external reporting thread.")
-            self._streamer_watchdog()
+            if self.__start_control_thread():
+                log.debug("Started control command thread")
+            if self.__start_retention_thread():
+                log.debug("Started retention thread")
+            self._streamer_watchdog(adopted)
         except Exception:
             """
             Catch all exception here so we can be sure we gracefully shut down and kill Streamlink process etc.
@@ -577,8 +1428,12 @@ class StreamArchiver:
             self.kill_handler(1, None)
 
 
-def worker(master_reporting_queue=None, *args, **kwargs):
+def worker(master_reporting_queue=None, control=None, pipeline_queue=None, *args, **kwargs):
     a = StreamArchiver(*args, **kwargs)
     if master_reporting_queue is not None:
         a.set_reporting_queue(master_reporting_queue)
+    if control is not None:
+        a.set_control(control)
+    if pipeline_queue is not None:
+        a.set_pipeline_queue(pipeline_queue)
     a.run()
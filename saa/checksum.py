@@ -0,0 +1,50 @@
+"""
+Inline checksums for recordings.
+
+When a streamer has a checksum algorithm set, the chunk is written through SAA (see saa.writer), hashing the stream
+as it goes. At finalize, a sidecar manifest (<chunk>.<algorithm>.manifest) is written next to the chunk, in the same
+format as sha256sum and friends, which rclone can check the remote against (rclone check --checkfile)
+without reading the chunk again.
+
+md5, sha1 and sha256 come from hashlib. xxh3 and xxh128 need the optional xxhash package.
+"""
+import hashlib
+import os
+
+from saa.const import MANIFEST_FILE_EXT
+
+HASHLIB_ALGORITHMS = ("md5", "sha1", "sha256")
+XXHASH_ALGORITHMS = ("xxh3", "xxh128")
+
+
+def new_hasher(algorithm: str):
+    """
+    :raises ValueError: if the algorithm is not supported (or xxhash is not installed for xxh3/xxh128)
+    """
+    algorithm = algorithm.lower()
+    if algorithm in HASHLIB_ALGORITHMS:
+        return hashlib.new(algorithm)
+    if algorithm in XXHASH_ALGORITHMS:
+        try:
+            import xxhash
+        except ImportError:
+            raise ValueError(f"{algorithm} requires the xxhash package (pip install xxhash)")
+        return xxhash.xxh3_64() if algorithm == "xxh3" else xxhash.xxh128()
+    raise ValueError(f"Unsupported checksum algorithm {algorithm}, "
+                     f"supported are {', '.join(HASHLIB_ALGORITHMS + XXHASH_ALGORITHMS)}")
+
+
+def manifest_name(chunk_name, algorithm):
+    return f"{chunk_name}.{algorithm.lower()}{MANIFEST_FILE_EXT}"
+
+
+def write_manifest(directory, chunk_name, algorithm, digest):
+    """
+    Write the sidecar manifest for a chunk.
+    :return: name of the manifest file
+    """
+    name = manifest_name(chunk_name, algorithm)
+    with open(os.path.join(directory, name), "w") as f:
+        f.write(f"{digest}  {chunk_name}\n")
+    return name
+
@@ -0,0 +1,156 @@
+"""
+Cluster mode, spreading streamers over several SAA nodes.
+
+Every node uses the same streamers.yml, and a coordination store on shared storage (an SQLite database,
+relying on its file locking, so the storage has to support POSIX locks, e.g. NFSv4). Each node only runs the
+streamers it holds a lease on. Every StreamWatcher loop, in one transaction, a node:
+
+    1. records a heartbeat, with its capacity
+    2. renews its leases for streamers still in streamers.yml
+    3. works out its share of the streamers: its capacity / the total capacity of the nodes with a recent heartbeat
+    4. claims streamers with no lease (or an expired one) up to its share
+    5. releases streamers over its share (e.g. a node has joined), that are not recording
+
+A recording is never moved while its owner is renewing its lease, only once the lease expires (the node has died or
+lost the store for lease_ttl seconds). A node that can not reach the store stops its streamers once its leases would have
+expired, so two nodes never record the same streamer for long. Clocks of the nodes need to be in sync (e.g. NTP).
+"""
+import sqlite3
+import logging
+import socket
+import math
+import time
+
+from saa.const import CLUSTER_LEASE_TTL, CLUSTER_BUSY_TIMEOUT
+
+log = logging.getLogger('root')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS nodes (
+    node_id TEXT PRIMARY KEY,
+    capacity REAL NOT NULL,
+    heartbeat REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS leases (
+    streamer TEXT PRIMARY KEY,
+    node_id TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+"""
+
+
+class SqliteLeaseStore:
+    """
+    Coordination store in an SQLite database on shared storage.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = sqlite3.connect(path, timeout=CLUSTER_BUSY_TIMEOUT, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        # WAL needs shared memory, so does not work across hosts
+        self._conn.execute("PRAGMA journal_mode=DELETE")
+        self._conn.executescript(SCHEMA)
+
+    def transaction(self):
+        """
+        Take the write lock straight away, so nodes claiming streamers at the same time are serialized.
+        """
+        self._conn.execute("BEGIN IMMEDIATE")
+        return self._conn
+
+    def commit(self):
+        self._conn.execute("COMMIT")
+
+    def rollback(self):
+        if self._conn.in_transaction:
+            self._conn.execute("ROLLBACK")
+
+    def close(self):
+        self._conn.close()
+
+
+class ClusterMember:
+
+    def __init__(self, store: SqliteLeaseStore, node_id=None, capacity=1.0, lease_ttl=CLUSTER_LEASE_TTL):
+        """
+        :param node_id: unique name of this node, default is the hostname
+        :param capacity: how many streamers this node can take, relative to the other nodes
+        :param lease_ttl: seconds a lease lasts without being renewed
+        """
+        self.store = store
+        self.node_id = node_id or socket.gethostname()
+        self.capacity = float(capacity)
+        self.lease_ttl = lease_ttl
+        self.owned = set()
+        self._last_renewed = None
+
+    def update(self, streamers, recording=()):
+        """
+        Renew, claim and release leases.
+        :param streamers: keys of all the (enabled) streamers
+        :param recording: keys of this node's streamers that are recording, these are never released
+        :return: set of the streamer keys this node owns
+        """
+        now = time.time()
+        try:
+            owned = self._update(now, sorted(streamers), set(recording))
+        except sqlite3.Error as e:
+            self._rollback()
+            # Waiting for a locked store can take up to CLUSTER_BUSY_TIMEOUT, during which the leases may have expired
+            if self._last_renewed is not None and time.time() - self._last_renewed < self.lease_ttl:
+                log.warning(f"[Cluster] Could not update leases, keeping the current streamers for now: {e}")
+                return set(self.owned)
+            if self.owned:
+                log.error(f"[Cluster] Could not update leases for {self.lease_ttl}s, they will have expired. "
+                          f"Stopping all streamers: {e}")
+            self.owned = set()
+            return set()
+
+        for key in sorted(owned - self.owned):
+            log.info(f"[Cluster] Claimed {key}")
+        for key in sorted(self.owned - owned):
+            log.info(f"[Cluster] Released {key}")
+        self.owned = owned
+        self._last_renewed = now
+        return set(owned)
+
+    def _update(self, now, streamers, recording):
+        conn = self.store.transaction()
+        try:
+            conn.execute("INSERT OR REPLACE INTO nodes (node_id, capacity, heartbeat) VALUES (?, ?, ?)",
+                         (self.node_id, self.capacity, now))
+            conn.execute("DELETE FROM nodes WHERE heartbeat < ?", (now - self.lease_ttl,))
+            conn.executemany("DELETE FROM leases WHERE streamer = ?",
+                             [(row['streamer'],) for row in conn.execute("SELECT streamer FROM leases")
+                              if row['streamer'] not in set(streamers)])
+
+            leases = {row['streamer']: row for row in conn.execute("SELECT * FROM leases")}
+            owned = {key for key, row in leases.items() if row['node_id'] == self.node_id and row['expires'] >= now}
+            total_capacity = conn.execute("SELECT SUM(capacity) FROM nodes").fetchone()[0] or self.capacity
+            share = math.ceil(len(streamers) * self.capacity / total_capacity)
+
+            free = [key for key in streamers if key not in leases or leases[key]['expires'] < now]
+            for key in free[:max(share - len(owned), 0)]:
+                owned.add(key)
+            if len(owned) > share:
+                for key in sorted(owned - recording, reverse=True)[:len(owned) - share]:
+                    owned.discard(key)
+                    conn.execute("DELETE FROM leases WHERE streamer = ? AND node_id = ?", (key, self.node_id))
+
+            conn.executemany("INSERT OR REPLACE INTO leases (streamer, node_id, expires) VALUES (?, ?, ?)",
+                             [(key, self.node_id, now + self.lease_ttl) for key in owned])
+            self.store.commit()
+        except BaseException:
+            self._rollback()
+            raise
+        return owned
+
+    def _rollback(self):
+        """
+        Roll back the current transaction, if the store can still be reached.
+        """
+        try:
+            self.store.rollback()
+        except sqlite3.Error as e:
+            log.debug(f"[Cluster] Could not roll back: {e}")
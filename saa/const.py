@@ -9,6 +9,13 @@ TEMP_FILE_EXT = ".sapart"
 
 LOG_LEVEL_DEFAULT = "INFO"
 
+# log writer (saa.logwriter) defaults
+LOG_FILE_MAX_BYTES = 10 * 1024 * 1024
+LOG_FILE_BACKUP_COUNT = 5
+LOG_RATE_LIMIT = 0  # messages per second per process, 0 is off
+LOG_DEDUPE_WINDOW = 0  # seconds, 0 is off
+LOG_WRITER_FLUSH_INTERVAL = 5
+
 # Stream archiver defaults
 STREAM_SPLIT_TIME = 86400
 STREAMER_DEFAULT_NAME = "unknown_stream"
@@ -17,6 +24,46 @@ STREAM_WATCHDOG_DEFAULT_SLEEP = 1
 STREAMERS_WATCHER_DEFAULT_SLEEP = 5
 STREAMLINK_ARGS_DEFAULT = []
 STREAMER_UPDATE_COM_STATUS_SLEEP = 10
+STREAMER_CHUNK_WRITER_JOIN_TIMEOUT = 30
+STREAM_STALL_TIMEOUT = 0  # seconds without the chunk growing before Streamlink is restarted, 0 is off
+# Streamlink is restarted sooner if it has logged this many download errors (segments, playlist reloads) since the chunk
+# last grew, and it has not grown for STREAMLINK_ERROR_STALL_TIMEOUT seconds (see saa.streamlinklog)
+STREAMLINK_ERROR_RESTART_COUNT = 3
+STREAMLINK_ERROR_STALL_TIMEOUT = 10
+STREAM_RESOLUTION_MAX_AGE = 0  # seconds the stream resolved by a live check can be downloaded from directly, 0 is off
+# Streamlink url prefix to download a resolved stream directly, by its type in streamlink --json
+STREAM_RESOLVED_URL_PREFIXES = {"hls": "hls://", "dash": "dash://", "http": "httpstream://"}
+
+# volume pool placement (saa.volumes)
+VOLUME_MIN_FREE_BYTES = 10 * 1024 ** 3
+VOLUME_THROUGHPUT_BUCKET = 5 * 1024 ** 2  # bytes/s, volumes writing within the same bucket count as equally loaded
+
+# inline checksums (saa.checksum) and the SAA write path (saa.writer)
+CHUNK_WRITER_READ_SIZE = 1024 * 1024
+CHUNK_WRITER_DROP_CACHE_INTERVAL = 64 * 1024 * 1024  # with drop_page_cache, bytes between flushing and dropping
+MANIFEST_FILE_EXT = ".manifest"
+
+# reporting plugin defaults
+REPORTING_PLUGIN_HANDLER_SLEEP = 2
+
+# probe plugin defaults
+PROBE_DEFAULT_TTL = 30  # seconds a probe's verdict is used for, probes are run twice as often
+PROBE_HTTP_TIMEOUT = 10
+
+# history reporting plugin defaults
+HISTORY_DEFAULT_DIR = "history"
+HISTORY_DEFAULT_RETENTION_DAYS = 30
+HISTORY_FILE_EXT = ".history"
+# room for event records (chunks, stalls, admission, eviction) on top of the status payloads, per hour of retention
+HISTORY_EVENT_RECORDS_PER_HOUR = 120
+
+# profiling (saa.profiling)
+TRACEMALLOC_FRAMES = 10
+TRACEMALLOC_TOP_STATS = 50
+
+# timing spans (saa.instrumentation), histogram bucket upper bounds in seconds
+SPAN_HISTOGRAM_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                          0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500)
 
 # rclone defaults
 RCLONE_BIN_LOCATION = "rclone"
@@ -32,4 +79,56 @@ STREAMERS_REQUIRED_FIELDS = {
 }
 
 DEFAULT_DOWNLOAD_DIR = "."
+
+# chunk journal (saa.journal)
+JOURNAL_FILE_EXT = ".saajournal"
+JOURNAL_BUSY_TIMEOUT = 30
+
+# handoff mode
+STREAMLINK_LOG_FILE_EXT = ".streamlink.log"
+HANDOFF_JOIN_TIMEOUT = 30
 NEWLINE_CHAR = "\n"
+
+# archiver worker processes (saa.workers)
+WORKER_START_METHOD = "forkserver"
+# modules imported once in the forkserver. Each worker runs the script SAA was started with (e.g. the saa script)
+# again as __mp_main__, which only imports saa.saa, so that is preloaded too.
+WORKER_PRELOAD_MODULES = ("__main__", "saa.utils", "saa.logwriter", "saa.archiver", "saa.pipeline", "saa.workers",
+                          "saa.saa")
+
+# post-processing pipeline (saa.pipeline)
+PIPELINE_WORKERS = 2  # steps run at once, over all streamers
+PIPELINE_NICE = 10
+PIPELINE_IONICE = "idle"  # ionice class for steps: idle, best-effort, or none
+PIPELINE_MAX_BACKLOG = 10  # chunks of a streamer waiting for post-processing before new ones are uploaded without it
+PIPELINE_TEMP_INFIX = ".saproc"  # step outputs are written to <name>.saproc.<ext> and renamed once complete
+FFMPEG_BINARY = "ffmpeg"
+
+# priority classes (saa.priority), nice None or ionice "none" leaves it as SAA was started with.
+# Only post-processing runs with a lower priority unless configured, as its steps always have.
+PRIORITY_CLASSES = {
+    "recording": {"nice": None, "ionice": None},
+    "upload": {"nice": None, "ionice": None},
+    "processing": {"nice": PIPELINE_NICE, "ionice": PIPELINE_IONICE},
+    "plugins": {"nice": None, "ionice": None},
+}
+PRIORITY_CGROUP_MAIN = "main"  # cgroup leaf SAA's processes are moved to, when classes have cgroup settings
+
+# retention of uploaded chunks (saa.retention)
+RETENTION_CHECK_INTERVAL = 60
+
+# in-process HLS downloads (saa.hls)
+HLS_CONCURRENCY = 3  # segments fetched at once, per download
+HLS_PREFETCH = 6  # segments fetched ahead of the one being written
+HLS_LIVE_EDGE = 3  # segments back from the end of the playlist a download starts at (as Streamlink's --hls-live-edge)
+HLS_SEGMENT_ATTEMPTS = 3
+HLS_REQUEST_TIMEOUT = 10  # seconds, for each playlist and segment request
+HLS_STREAM_TIMEOUT = 60  # seconds without new segments before a download gives up
+HLS_RESUME_MAX_AGE = 30  # seconds after a download stopped that the next one carries on from its last segment
+HLS_POOL_HOSTS = 16  # hosts connections are kept alive to, per streamer (each has a process of its own)
+HLS_POOL_CONNECTIONS = 10  # connections kept alive per host, per streamer
+HLS_STOP_TIMEOUT = 5  # seconds to wait for a download to close the chunk when it is stopped
+
+# cluster mode (saa.cluster)
+CLUSTER_LEASE_TTL = 60  # seconds, renewed every StreamWatcher loop
+CLUSTER_BUSY_TIMEOUT = 30
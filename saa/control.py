@@ -0,0 +1,422 @@
+"""
+Local control API, served by the StreamWatcher process.
+
+JSON over HTTP, on a Unix socket (control_socket in config.yml) and/or a loopback TCP port (control_port).
+The socket is only accessible to SAA's user. The TCP port needs a control_token, sent as "Authorization: Bearer <token>"
+(also checked on the socket if set), and only answers requests with a loopback Host, so web pages can not reach it
+through the browser (DNS rebinding). Requests that change anything need "Content-Type: application/json", which a
+browser can not send cross-site without asking first.
+Changes take effect straight away, without editing streamers.yml:
+
+    GET    /streamers                 list streamers, with their live state
+    POST   /streamers                 add a streamer, body: {"key": ..., "config": {<as in streamers.yml>}},
+                                      only the settings in API_STREAMER_KEYS
+    DELETE /streamers/<key>           remove a streamer
+    POST   /streamers/<key>/enable    enable a streamer
+    POST   /streamers/<key>/disable   disable a streamer
+    POST   /streamers/<key>/recheck   check if the streamer is live now, rather than at the next recheck
+    POST   /streamers/<key>/cut       finish the current chunk now and start a new one
+    POST   /streamers/<key>/upload    run rclone for the streamer now
+    POST   /plugins/<name>/stop       stop an async reporting plugin (see ReportingPluginHandler.stop_plugin)
+    POST   /plugins/<name>/restart    restart an async reporting plugin with a new instance
+
+e.g. curl --unix-socket /config/saa.sock -X POST -H "Content-Type: application/json" http://saa/streamers/MyStreamer/cut
+
+Changes made through the API last until SAA is restarted, and take precedence over streamers.yml.
+
+Each archiver process gets an ArchiverControl: a command queue it reads in a thread, and a shared array it
+writes its state to, so listing streamers does not need to ask every process.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+import socketserver
+import hmac
+import multiprocessing
+import threading
+import logging
+import socket
+import json
+import time
+import os
+
+log = logging.getLogger('root')
+
+# Commands an archiver accepts
+COMMAND_RECHECK = "recheck"
+COMMAND_CUT = "cut"
+# from admission control (see saa.admission)
+COMMAND_ADMIT = "admit"
+COMMAND_REFUSE = "refuse"
+COMMAND_PREEMPT = "preempt"
+
+# Streamer settings that can be set through the API. Anything run (streamlink_args, pipeline commands, rclone's binary
+# and arguments) or deciding where files are written can only be set in streamers.yml.
+API_STREAMER_KEYS = {"enabled", "url", "name", "split_time", "quality", "stall_timeout", "resolution_max_age",
+                     "hls_engine", "checksum", "priority", "retention", "rclone"}
+API_RCLONE_KEYS = {"remote_dir", "operation", "transfers"}
+LOOPBACK_HOSTS = {"127.0.0.1", "localhost", "[::1]"}
+
+# Fields of an archiver's shared state
+STATE_FIELDS = ("is_live", "stream_start_time", "chunk_start_time", "chunks", "last_check_time",
+                "admission", "streamlink_pid", "bytes_per_second",
+                # written by the StreamWatcher, from probe plugins (see ProbePluginHandler)
+                "probe_live", "probe_expires")
+
+# Values of the admission state field
+ADMISSION_NONE = 0
+ADMISSION_WAITING = 1
+ADMISSION_ADMITTED = 2
+
+
+class ArchiverControl:
+    """
+    Control channel between the StreamWatcher and one archiver process.
+    """
+
+    def __init__(self, context=None):
+        """
+        :param context: multiprocessing context the archiver is started with (see saa.workers), so it can be pickled
+        """
+        context = context or multiprocessing
+        self.commands = context.Queue()
+        # Each field only has one writer, so no lock is needed
+        self._state = context.Array('d', len(STATE_FIELDS), lock=False)
+
+    def send(self, command):
+        self.commands.put(command)
+
+    def set_state(self, **kwargs):
+        for key, value in kwargs.items():
+            self._state[STATE_FIELDS.index(key)] = float(value or 0)
+
+    def state(self):
+        state = dict(zip(STATE_FIELDS, self._state[:]))
+        state['is_live'] = bool(state['is_live'])
+        state['chunks'] = int(state['chunks'])
+        state['admission'] = int(state['admission'])
+        state['streamlink_pid'] = int(state['streamlink_pid'])
+        state['probe_live'] = bool(state['probe_live'])
+        return state
+
+
+class ControlState:
+    """
+    Changes made through the API, applied over streamers.yml by streamers_watcher.
+    """
+
+    def __init__(self, upload_queue=None):
+        """
+        :param upload_queue: queue to send upload requests to the rclone watcher on, None if rclone is disabled
+        """
+        self.upload_queue = upload_queue
+        self.added = {}  # key: streamer config
+        self.removed = set()
+        self.enabled = {}  # key: enabled override
+        self.processes = {}  # streamers_watcher's current processes, key: {'process', 'config', 'config_hash', 'control'}
+        self.streamers = {}  # effective streamers config (after applying changes), as of the last watcher loop
+        self.plugins = None  # the ReportingPluginHandler, if any reporting plugins are enabled
+        self.version = 0  # incremented on every change, so the streamers are only compiled again after one
+        self.wake = threading.Event()  # set to make streamers_watcher apply changes now
+        self._lock = threading.Lock()
+
+    def apply(self, streamers: dict):
+        """
+        Apply the API changes to the streamers loaded from streamers.yml.
+        :return: new dict of streamers
+        """
+        with self._lock:
+            streamers = {**streamers, **self.added}
+            for key in self.removed:
+                streamers.pop(key, None)
+            for key, enabled in self.enabled.items():
+                if key in streamers:
+                    streamers[key] = {**streamers[key], 'enabled': enabled}
+            self.streamers = streamers
+        return streamers
+
+    def add(self, key, config):
+        with self._lock:
+            self.added[key] = config
+            self.removed.discard(key)
+            self.enabled.pop(key, None)
+            self.version += 1
+        if self.upload_queue is not None:
+            self.upload_queue.put({'action': 'add', 'key': key, 'config': config})
+        self.wake.set()
+
+    def remove(self, key):
+        with self._lock:
+            self.added.pop(key, None)
+            self.removed.add(key)
+            self.version += 1
+        if self.upload_queue is not None:
+            self.upload_queue.put({'action': 'remove', 'key': key})
+        self.wake.set()
+
+    def set_enabled(self, key, enabled):
+        with self._lock:
+            self.enabled[key] = enabled
+            self.version += 1
+        self.wake.set()
+
+    def send(self, key, command):
+        """
+        :return: True if sent, False if the streamer has no running process
+        """
+        proc = self.processes.get(key)
+        if proc is None or not proc['process'].is_alive():
+            return False
+        proc['control'].send(command)
+        return True
+
+    def upload(self, key):
+        if self.upload_queue is None:
+            return False
+        self.upload_queue.put({'action': 'upload', 'key': key, 'config': self.streamers[key]})
+        return True
+
+    def stop_plugin(self, name):
+        """
+        :return: True if stopped, False if there is no such async reporting plugin running
+        """
+        return self.plugins is not None and self.plugins.stop_plugin(name)
+
+    def restart_plugin(self, name):
+        """
+        :return: True if restarted, False if there is no such async reporting plugin
+        """
+        return self.plugins is not None and self.plugins.restart_plugin(name)
+
+    def list(self):
+        now = time.time()
+        result = []
+        for key, config in self.streamers.items():
+            proc = self.processes.get(key)
+            entry = {'key': key,
+                     'name': config.get('name', key),
+                     'enabled': config.get('enabled', True) is not False,
+                     'source': 'api' if key in self.added else 'file',
+                     'running': proc is not None and proc['process'].is_alive(),
+                     'pid': proc['process'].pid if proc is not None else None}
+            if proc is not None:
+                state = proc['control'].state()
+                entry['is_live'] = state['is_live']
+                entry['chunks'] = state['chunks']
+                entry['stream_time_elapsed'] = now - state['stream_start_time'] if state['is_live'] else None
+                entry['chunk_time_elapsed'] = now - state['chunk_start_time'] if state['is_live'] else None
+                entry['last_check'] = state['last_check_time'] or None
+                entry['admission'] = ("none", "waiting", "admitted")[state['admission']]
+            result.append(entry)
+        return result
+
+
+def check_api_config(key: str, config: dict):
+    """
+    Check a streamer config sent to the API only has settings the API allows.
+    :return: error message, None if it is allowed
+    """
+    # The name (or key) is the streamer's directory under the default download directory
+    for name in (key, config.get('name', key)):
+        if not isinstance(name, str) or not name or "/" in name or "\\" in name or name.startswith("."):
+            return "key and name can not contain / or \\, or start with ."
+    for key in config:
+        if key not in API_STREAMER_KEYS:
+            return f"{key} can not be set through the API, allowed are {', '.join(sorted(API_STREAMER_KEYS))}"
+    rclone = config.get('rclone')
+    if rclone is not None:
+        if not isinstance(rclone, dict):
+            return "rclone must be an object"
+        for key in rclone:
+            if key not in API_RCLONE_KEYS:
+                return f"rclone.{key} can not be set through the API, allowed are {', '.join(sorted(API_RCLONE_KEYS))}"
+
+    def values(value):
+        if isinstance(value, dict):
+            for v in value.values():
+                yield from values(v)
+        elif isinstance(value, list):
+            for v in value:
+                yield from values(v)
+        else:
+            yield value
+    # Values end up on Streamlink's and rclone's command lines, where they must not be taken as options
+    if any(isinstance(value, str) and value.startswith("-") for value in values(config)):
+        return "values can not start with -"
+    return None
+
+
+class ControlRequestHandler(BaseHTTPRequestHandler):
+    """
+    Routes requests to the server's ControlState.
+    """
+
+    def _respond(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length == 0:
+            return {}
+        return json.loads(self.rfile.read(length))
+
+    def _allowed(self, changes=False):
+        """
+        Check the request's token, Host and Content-Type, responding with an error if they are not allowed.
+        :param changes: if the request changes anything
+        :return: True if the request is allowed
+        """
+        token = self.server.control_token
+        if token is not None:
+            authorization = self.headers.get("Authorization") or ""
+            if not hmac.compare_digest(authorization.encode("utf-8"), f"Bearer {token}".encode("utf-8")):
+                self._respond(401, {'error': 'unauthorized'})
+                return False
+        if self.server.loopback_only:
+            host = (self.headers.get("Host") or "").lower()
+            if host.rsplit(":", 1)[0] not in LOOPBACK_HOSTS and host not in LOOPBACK_HOSTS:
+                self._respond(403, {'error': 'forbidden host'})
+                return False
+        if changes and (self.headers.get("Content-Type") or "").split(";", 1)[0].strip() != "application/json":
+            self._respond(415, {'error': 'Content-Type must be application/json'})
+            return False
+        return True
+
+    def _route(self):
+        """
+        :return: (collection, key, action), collection is "streamers" or "plugins" (None if neither),
+                 key and action are None if not in the path
+        """
+        parts = [unquote(p) for p in self.path.split("?", 1)[0].strip("/").split("/")]
+        if not parts or parts[0] not in ("streamers", "plugins") or len(parts) > 3:
+            return None, None, None
+        return parts[0], (parts[1] if len(parts) > 1 else None), (parts[2] if len(parts) > 2 else None)
+
+    def do_GET(self):
+        if not self._allowed():
+            return
+        collection, key, action = self._route()
+        if collection != "streamers" or key is not None:
+            return self._respond(404, {'error': 'not found'})
+        self._respond(200, self.server.control_state.list())
+
+    def do_DELETE(self):
+        if not self._allowed(changes=True):
+            return
+        collection, key, action = self._route()
+        if collection != "streamers" or key is None or action is not None:
+            return self._respond(404, {'error': 'not found'})
+        if key not in self.server.control_state.streamers:
+            return self._respond(404, {'error': f'no streamer {key}'})
+        self.server.control_state.remove(key)
+        log.info(f"[Control] Removing {key}")
+        self._respond(200, {'ok': True})
+
+    def do_POST(self):
+        if not self._allowed(changes=True):
+            return
+        state = self.server.control_state
+        collection, key, action = self._route()
+        if collection is None:
+            return self._respond(404, {'error': 'not found'})
+        if collection == "plugins":
+            return self._plugin_action(key, action)
+
+        if key is None:
+            try:
+                body = self._read_json()
+            except ValueError as e:
+                return self._respond(400, {'error': f'invalid json: {e}'})
+            if not isinstance(body.get('key'), str) or not isinstance(body.get('config'), dict):
+                return self._respond(400, {'error': 'key (string) and config (object) are required'})
+            error = check_api_config(body['key'], body['config'])
+            if error is not None:
+                return self._respond(403, {'error': error})
+            state.add(body['key'], body['config'])
+            log.info(f"[Control] Adding {body['key']}")
+            return self._respond(200, {'ok': True})
+
+        if key not in state.streamers:
+            return self._respond(404, {'error': f'no streamer {key}'})
+
+        if action in ("enable", "disable"):
+            state.set_enabled(key, action == "enable")
+            log.info(f"[Control] {action.capitalize()} {key}")
+            return self._respond(200, {'ok': True})
+        if action in (COMMAND_RECHECK, COMMAND_CUT):
+            if not state.send(key, action):
+                return self._respond(409, {'error': f'{key} is not running'})
+            log.info(f"[Control] Sent {action} to {key}")
+            return self._respond(200, {'ok': True})
+        if action == "upload":
+            if not state.upload(key):
+                return self._respond(409, {'error': 'rclone is disabled'})
+            log.info(f"[Control] Requested upload for {key}")
+            return self._respond(200, {'ok': True})
+        self._respond(404, {'error': 'not found'})
+
+    def _plugin_action(self, name, action):
+        state = self.server.control_state
+        if action == "stop":
+            if not state.stop_plugin(name):
+                return self._respond(404, {'error': f'no async plugin {name} running'})
+        elif action == "restart":
+            if not state.restart_plugin(name):
+                return self._respond(404, {'error': f'no async plugin {name}'})
+        else:
+            return self._respond(404, {'error': 'not found'})
+        log.info(f"[Control] {action.capitalize()} plugin {name}")
+        self._respond(200, {'ok': True})
+
+    def log_message(self, format, *args):
+        log.debug(f"[Control] {format % args}")
+
+
+class UnixControlServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        # BaseHTTPRequestHandler expects a (host, port) client address
+        return request, ("local", 0)
+
+
+def start_control_server(control_state: ControlState, socket_path=None, port=None, token=None):
+    """
+    Serve the control API in daemon threads.
+    :param socket_path: path of the Unix socket to listen on
+    :param port: loopback TCP port to listen on, only if there is a token
+    :param token: token requests have to send, required for the TCP port
+    :return: list of servers started
+    """
+    servers = []
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        # Create the socket with no access for others, rather than chmod it after it is already listening
+        umask = os.umask(0o177)
+        try:
+            server = UnixControlServer(socket_path, ControlRequestHandler)
+        finally:
+            os.umask(umask)
+        os.chmod(socket_path, 0o600)
+        server.loopback_only = False
+        servers.append(server)
+    if port and not token:
+        log.error("The control API needs a control_token to listen on control_port, only serving it on control_socket.")
+    elif port:
+        server = ThreadingHTTPServer(("127.0.0.1", int(port)), ControlRequestHandler)
+        server.loopback_only = True
+        servers.append(server)
+    for server in servers:
+        server.control_state = control_state
+        server.control_token = token or None
+        thread = threading.Thread(target=server.serve_forever, name="ControlServer")
+        thread.daemon = True
+        thread.start()
+        log.info(f"Control API listening on {socket_path if server.address_family == socket.AF_UNIX else f'127.0.0.1:{port}'}")
+    return servers
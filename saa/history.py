@@ -0,0 +1,276 @@
+"""
+Local time-series store for streamer history.
+
+Each streamer gets its own file, holding a fixed-size header followed by a ring of fixed-size records.
+Records are appended in time order, and once the ring is full the oldest record is overwritten,
+so the file never grows past its initial size (capacity is derived from the retention period, with room for
+events on top of the periodic status records).
+
+As records are in time order, range queries binary search for the start of the range and only read the records in it.
+Record times come from the wall clock, so if it goes backwards, records are stored with the time of the newest record
+instead, keeping the ring in order.
+"""
+from collections import namedtuple
+from datetime import datetime, timezone
+import argparse
+import struct
+import mmap
+import sys
+import os
+
+import saa.utils as utils
+from saa.const import (
+
+    HISTORY_DEFAULT_DIR,
+    HISTORY_DEFAULT_RETENTION_DAYS,
+    HISTORY_FILE_EXT,
+    HISTORY_EVENT_RECORDS_PER_HOUR,
+    STREAMER_UPDATE_COM_STATUS_SLEEP
+
+)
+
+MAGIC = b"SAAH"
+VERSION = 1
+
+# magic, version, record size, capacity, total records ever written
+HEADER = struct.Struct("<4sHHIQ12x")
+# time_utc, kind, is_live, chunks, chunk_time_elapsed, stream_time_elapsed, value, pid
+RECORD = struct.Struct("<qBBxxIfffI")
+
+Record = namedtuple("Record", ["time_utc", "kind", "is_live", "chunks", "chunk_time_elapsed",
+                               "stream_time_elapsed", "value", "pid"])
+
+# Record kinds. Status is the periodic payload every streamer process sends, the rest are events.
+KIND_STATUS = 0
+EVENT_KINDS = {
+    "status": KIND_STATUS,
+    "stall": 1,  # value: seconds Streamlink went without writing anything
+    "chunk": 2,  # value: bytes per second achieved over the chunk
+    # admission control decisions (saa.admission), value: the streamer's priority
+    "admitted": 3,
+    "queued": 4,
+    "refused": 5,
+    "preempted": 6,
+    "evicted": 7,  # value: bytes of uploaded chunks deleted by retention
+}
+
+# If two live samples are further apart than this, assume SAA was not running in between
+LIVE_MAX_SAMPLE_GAP = STREAMER_UPDATE_COM_STATUS_SLEEP * 3
+
+
+def capacity_for_retention(retention_days):
+    """
+    Number of records needed to hold retention_days worth of status payloads, and the events in between.
+    """
+    status_records = retention_days * 86400 // STREAMER_UPDATE_COM_STATUS_SLEEP
+    return max(1, int(status_records + retention_days * 24 * HISTORY_EVENT_RECORDS_PER_HOUR))
+
+
+class StreamerHistory:
+
+    def __init__(self, path: str, capacity: int = None, readonly=False):
+        """
+        Open (or create) a history file.
+
+        :param path: path to the history file
+        :param capacity: number of records to hold, used when creating the file.
+                         An existing file keeps the capacity it was created with.
+        :param readonly: open an existing file for queries only
+        """
+        self.path = path
+        self.readonly = readonly
+        if not os.path.exists(path):
+            if readonly:
+                raise FileNotFoundError(path)
+            self._create(path, capacity or capacity_for_retention(HISTORY_DEFAULT_RETENTION_DAYS))
+
+        self._fd = os.open(path, os.O_RDONLY if readonly else os.O_RDWR)
+        self._mmap = mmap.mmap(self._fd, 0, access=mmap.ACCESS_READ if readonly else mmap.ACCESS_WRITE)
+        magic, version, record_size, self.capacity, _ = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+            self.close()
+            raise ValueError(f"{path} is not a compatible history file")
+
+    @staticmethod
+    def _create(path, capacity):
+        with open(path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, VERSION, RECORD.size, capacity, 0))
+            f.truncate(HEADER.size + capacity * RECORD.size)
+
+    @property
+    def written(self):
+        return HEADER.unpack_from(self._mmap, 0)[4]
+
+    def __len__(self):
+        return min(self.written, self.capacity)
+
+    def append(self, record: Record):
+        written = self.written
+        if written:
+            # Keep the ring in time order for _bisect, even if the clock has gone backwards
+            newest = RECORD.unpack_from(self._mmap, self._offset(min(written, self.capacity) - 1, written))[0]
+            if record.time_utc < newest:
+                record = record._replace(time_utc=newest)
+        RECORD.pack_into(self._mmap, HEADER.size + (written % self.capacity) * RECORD.size, *record)
+        # Only update the count once the record is in place, so readers never see a half written record
+        HEADER.pack_into(self._mmap, 0, MAGIC, VERSION, RECORD.size, self.capacity, written + 1)
+
+    def _offset(self, index, written):
+        """
+        :param index: logical index, 0 being the oldest record still in the ring
+        """
+        oldest = written - min(written, self.capacity)
+        return HEADER.size + ((oldest + index) % self.capacity) * RECORD.size
+
+    def __getitem__(self, index):
+        written = self.written
+        if not 0 <= index < min(written, self.capacity):
+            raise IndexError(index)
+        return Record(*RECORD.unpack_from(self._mmap, self._offset(index, written)))
+
+    def _bisect(self, time_utc, written):
+        """
+        :return: logical index of the first record at or after time_utc, relying on the records being in time order
+        """
+        low, high = 0, min(written, self.capacity)
+        while low < high:
+            mid = (low + high) // 2
+            if RECORD.unpack_from(self._mmap, self._offset(mid, written))[0] < time_utc:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    def range(self, start=None, end=None):
+        """
+        Yield records with start <= time_utc < end.
+        :param start: epoch time in UTC, None for the oldest record
+        :param end: epoch time in UTC, None for the newest record
+        """
+        written = self.written
+        count = min(written, self.capacity)
+        index = 0 if start is None else self._bisect(start, written)
+        while index < count:
+            record = Record(*RECORD.unpack_from(self._mmap, self._offset(index, written)))
+            if end is not None and record.time_utc >= end:
+                return
+            yield record
+            index += 1
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+def record_from_payload(data: dict):
+    """
+    Convert a reporting payload into a Record.
+    :return: Record, or None if the payload is of an unknown kind
+    """
+    kind = EVENT_KINDS.get(data.get('event', 'status'))
+    if kind is None:
+        return None
+    return Record(time_utc=int(data.get('time_utc') or 0),
+                  kind=kind,
+                  is_live=int(bool(data.get('is_live'))),
+                  chunks=int(data.get('chunks') or 0),
+                  chunk_time_elapsed=float(data.get('chunk_time_elapsed') or 0.0),
+                  stream_time_elapsed=float(data.get('stream_time_elapsed') or 0.0),
+                  value=float(data.get('value') or 0.0),
+                  pid=int(data.get('pid') or 0))
+
+
+def history_path(directory, streamer):
+    return os.path.join(directory, utils.convert_to_basic_string(str(streamer)) + HISTORY_FILE_EXT)
+
+
+def list_streamers(directory):
+    if not os.path.exists(directory):
+        return []
+    return sorted(f[:-len(HISTORY_FILE_EXT)] for f in os.listdir(directory) if f.endswith(HISTORY_FILE_EXT))
+
+
+def live_seconds_per_day(history: StreamerHistory, start=None, end=None, max_gap=LIVE_MAX_SAMPLE_GAP):
+    """
+    Total time a streamer was live for each (UTC) day in the given range.
+
+    The time between two status samples counts as live if the first sample was live,
+    unless they are more than max_gap seconds apart.
+
+    :return: dict of {date: seconds live}
+    """
+    days = {}
+    previous = None
+    for record in history.range(start, end):
+        if record.kind != KIND_STATUS:
+            continue
+        if previous is not None and previous.is_live and 0 < record.time_utc - previous.time_utc <= max_gap:
+            # Split the interval at midnight if needed
+            t = previous.time_utc
+            while t < record.time_utc:
+                day = datetime.fromtimestamp(t, tz=timezone.utc).date()
+                next_midnight = int(datetime(day.year, day.month, day.day, tzinfo=timezone.utc).timestamp()) + 86400
+                segment_end = min(next_midnight, record.time_utc)
+                days[day] = days.get(day, 0) + segment_end - t
+                t = segment_end
+        previous = record
+    return days
+
+
+def _parse_time(value):
+    """
+    Parse an epoch time or a YYYY-MM-DD date (UTC) from the command line.
+    """
+    if value is None:
+        return None
+    if value.isdigit():
+        return int(value)
+    return int(datetime.strptime(value, "%Y-%m-%d").replace(tzinfo=timezone.utc).timestamp())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query streamer history recorded by the history reporting plugin")
+    parser.add_argument("--directory", help="history directory", default=HISTORY_DEFAULT_DIR)
+    parser.add_argument("--start", help="start of the range (epoch time or YYYY-MM-DD, UTC)")
+    parser.add_argument("--end", help="end of the range (epoch time or YYYY-MM-DD, UTC)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    range_parser = subparsers.add_parser("range", help="print records in range for a streamer")
+    range_parser.add_argument("streamer")
+    live_parser = subparsers.add_parser("live-hours", help="hours live per streamer per day")
+    live_parser.add_argument("streamers", nargs="*", help="streamers to include (default all)")
+    args = parser.parse_args()
+
+    start, end = _parse_time(args.start), _parse_time(args.end)
+
+    def open_history(streamer):
+        try:
+            return StreamerHistory(history_path(args.directory, streamer), readonly=True)
+        except FileNotFoundError:
+            sys.exit(f"No history for {streamer} in {args.directory}")
+        except ValueError as e:
+            sys.exit(str(e))
+
+    if args.command == "range":
+        history = open_history(args.streamer)
+        kind_names = {v: k for k, v in EVENT_KINDS.items()}
+        for record in history.range(start, end):
+            print(f"{datetime.fromtimestamp(record.time_utc, tz=timezone.utc).isoformat()} "
+                  f"{kind_names.get(record.kind, record.kind)} live={record.is_live} chunks={record.chunks} "
+                  f"chunk_elapsed={record.chunk_time_elapsed:.0f}s stream_elapsed={record.stream_time_elapsed:.0f}s "
+                  f"value={record.value:g}")
+        history.close()
+
+    elif args.command == "live-hours":
+        for streamer in args.streamers or list_streamers(args.directory):
+            history = open_history(streamer)
+            for day, seconds in sorted(live_seconds_per_day(history, start, end).items()):
+                print(f"{streamer}\t{day.isoformat()}\t{seconds / 3600:.2f}")
+            history.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,380 @@
+"""
+In-process HLS downloader, used in place of Streamlink for streamers with hls_engine.
+
+Streamlink is still used to resolve the stream (the live check's streamlink --json), but the media playlist is then
+downloaded by an HLSDownload rather than a Streamlink process per chunk:
+
+- the playlist is reloaded every target duration (half of it when nothing was added), in its own thread
+- new segments are fetched by a pool of `concurrency` threads, up to `prefetch` segments ahead of the one being
+  written, with a few attempts each, so one slow segment does not hold up fetching the ones after it
+- segments are written to the chunk in order, as soon as each one (and all before it) has been fetched
+- HTTP connections are kept alive in pools per host, for the streamer's downloads (one requests.Session per process),
+  so a chunk starts without new TCP/TLS handshakes to the CDN the last one was downloaded from. Each streamer has a
+  process of its own (see saa.workers), so streamers on the same CDN do not share connections.
+
+HLSDownload stands in for the Streamlink Popen (poll, kill, stdout/stderr pipes, ...), and logs in Streamlink's
+format ([saa.hls][error] Failed to fetch segment ...), so the stream watchdog and saa.streamlinklog handle it as they
+would Streamlink. Only plain media playlists are supported (no encryption, byte ranges or master playlists), others
+raise UnsupportedPlaylist when the download starts, for the archiver to fall back to Streamlink.
+"""
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from collections import namedtuple, deque
+from urllib.parse import urljoin
+import subprocess
+import threading
+import logging
+import signal
+import time
+import re
+import os
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import saa.instrumentation as instrumentation
+from saa.const import (HLS_CONCURRENCY, HLS_PREFETCH, HLS_LIVE_EDGE, HLS_SEGMENT_ATTEMPTS, HLS_REQUEST_TIMEOUT,
+                       HLS_STREAM_TIMEOUT, HLS_POOL_HOSTS, HLS_POOL_CONNECTIONS, HLS_STOP_TIMEOUT)
+
+log = logging.getLogger('root')
+# urllib3 logs every request at debug, which would be every segment of every stream
+logging.getLogger("urllib3").setLevel(logging.INFO)
+
+Segment = namedtuple("Segment", ("sequence", "url", "duration", "map_url"))
+MediaPlaylist = namedtuple("MediaPlaylist", ("target_duration", "segments", "ended"))
+
+ATTRIBUTE_RE = re.compile(r'([A-Z0-9\-]+)=("[^"]*"|[^,]*)')
+# how long the writer waits on a segment (or for new ones) before checking if it has been stopped
+WAIT_INTERVAL = 0.5
+
+_session = None
+_session_lock = threading.Lock()
+
+
+class UnsupportedPlaylist(ValueError):
+    pass
+
+
+def streamer_session():
+    """
+    :return: the requests.Session the streamer's downloads fetch with, keeping connections alive per host.
+             Each streamer has a process of its own, so it is not shared with other streamers.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=HLS_POOL_HOSTS, pool_maxsize=HLS_POOL_CONNECTIONS, max_retries=0)
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+        return _session
+
+
+def _attributes(value):
+    return {k: v.strip('"') for k, v in ATTRIBUTE_RE.findall(value)}
+
+
+def parse_media_playlist(text, url):
+    """
+    :param text: the playlist
+    :param url: url it was fetched from, segment urls are relative to it
+    :return: MediaPlaylist
+    :raises UnsupportedPlaylist: if it is a master playlist, or uses encryption or byte ranges
+    :raises ValueError: if it is not an M3U8 playlist
+    """
+    lines = text.splitlines()
+    if not lines or lines[0].strip() != "#EXTM3U":
+        raise ValueError("not an M3U8 playlist")
+    target_duration = None
+    sequence = 0
+    duration = 0.0
+    map_url = None
+    ended = False
+    segments = []
+    for line in lines[1:]:
+        line = line.strip()
+        if not line:
+            continue
+        if not line.startswith("#"):
+            segments.append(Segment(sequence, urljoin(url, line), duration, map_url))
+            sequence += 1
+            duration = 0.0
+            continue
+        tag, _, value = line.partition(":")
+        if tag == "#EXTINF":
+            duration = float(value.split(",", 1)[0] or 0)
+        elif tag == "#EXT-X-TARGETDURATION":
+            target_duration = float(value)
+        elif tag == "#EXT-X-MEDIA-SEQUENCE":
+            sequence = int(value)
+        elif tag == "#EXT-X-ENDLIST":
+            ended = True
+        elif tag == "#EXT-X-MAP":
+            attributes = _attributes(value)
+            if "BYTERANGE" in attributes:
+                raise UnsupportedPlaylist("byte range initialization sections are not supported")
+            map_url = urljoin(url, attributes.get("URI", ""))
+        elif tag == "#EXT-X-KEY" and _attributes(value).get("METHOD", "NONE") != "NONE":
+            raise UnsupportedPlaylist("encrypted streams are not supported")
+        elif tag == "#EXT-X-BYTERANGE":
+            raise UnsupportedPlaylist("byte range segments are not supported")
+        elif tag == "#EXT-X-STREAM-INF":
+            raise UnsupportedPlaylist("master playlists are not supported")
+    return MediaPlaylist(target_duration or 6.0, segments, ended)
+
+
+class HLSDownload:
+    """
+    Downloads an HLS media playlist to a file (or a pipe), in place of a Streamlink Popen.
+    """
+
+    def __init__(self, url, file=None, headers=None, concurrency=HLS_CONCURRENCY, prefetch=HLS_PREFETCH,
+                 start_after=None, to_stdout=False):
+        """
+        :param url: url of the media playlist
+        :param file: file to download to
+        :param headers: HTTP headers to send with every request (e.g. from streamlink --json)
+        :param concurrency: segments fetched at once
+        :param prefetch: segments fetched ahead of the one being written, at least concurrency
+        :param start_after: media sequence number of the last segment downloaded (by the previous chunk's download),
+                            to carry on from the segment after it rather than from the live edge
+        :param to_stdout: write the stream to stdout instead of file (and log to stderr), as Streamlink's --stdout
+        """
+        self.url = url
+        self.file = file
+        self.headers = dict(headers or {})
+        self.concurrency = max(int(concurrency), 1)
+        self.prefetch = max(int(prefetch), self.concurrency)
+        self.start_after = start_after
+        self.to_stdout = to_stdout
+        self.pid = os.getpid()
+        self.returncode = None
+        self.last_sequence = None  # media sequence number of the last segment written
+        self.stdout = None
+        self.stderr = None
+
+        self._session = streamer_session()
+        self._executor = None
+        self._output = None
+        self._log = None
+        self._stop = threading.Event()
+        self._new_segments = threading.Condition()
+        self._pending = deque()  # segments from the playlist, not yet being fetched
+        self._last_queued = None  # media sequence number of the last segment added to _pending
+        self._playlist_done = None  # return code once the playlist has ended (or could not be reloaded any more)
+        self._target_duration = None
+        self._writer = None
+        self._poller = None
+
+    def start(self):
+        """
+        Fetch the playlist and start downloading it.
+        :return: self
+        :raises UnsupportedPlaylist: if the playlist is not supported (see parse_media_playlist)
+        :raises ValueError, requests.RequestException: if the playlist could not be fetched
+        """
+        playlist = self._reload()
+
+        log_r, log_w = os.pipe()
+        if self.to_stdout:
+            data_r, data_w = os.pipe()
+            self._output = os.fdopen(data_w, "wb", buffering=0)
+            self.stdout = os.fdopen(data_r, "rb")
+            self.stderr = os.fdopen(log_r, "rb")
+        else:
+            self._output = open(self.file, "wb", buffering=0)
+            # Streamlink logs to stdout when writing to a file, with nothing on stderr
+            err_r, err_w = os.pipe()
+            os.close(err_w)
+            self.stdout = os.fdopen(log_r, "rb")
+            self.stderr = os.fdopen(err_r, "rb")
+        self._log = os.fdopen(log_w, "w", buffering=1, errors="replace")
+        self._log_line("info", f"Downloading {self.url} in process "
+                               f"({self.concurrency} segments at once, {self.prefetch} ahead)")
+        if not self.to_stdout:
+            self._log_line("info", f"Writing output to\n{self.file}")
+        # Once the log is open, as it can warn about missed segments
+        self._queue_segments(playlist, first=True)
+        if playlist.ended:
+            self._playlist_done = 0
+
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="hls")
+        self._poller = threading.Thread(target=self._poll_playlist, daemon=True)
+        self._writer = threading.Thread(target=self._write_segments, daemon=True)
+        if self._playlist_done is None:
+            self._poller.start()
+        self._writer.start()
+        return self
+
+    def _log_line(self, level, message):
+        if level == "debug" and not log.isEnabledFor(logging.DEBUG):
+            return
+        try:
+            self._log.write(f"[saa.hls][{level}] {message}\n")
+        except (OSError, ValueError):
+            pass
+
+    @instrumentation.timed("hls_reload_playlist")
+    def _reload(self):
+        response = self._session.get(self.url, headers=self.headers, timeout=HLS_REQUEST_TIMEOUT)
+        response.raise_for_status()
+        playlist = parse_media_playlist(response.text, response.url)
+        self._target_duration = playlist.target_duration
+        return playlist
+
+    def _queue_segments(self, playlist, first=False):
+        """
+        Add the playlist's new segments to the pending segments.
+        :return: how many were added
+        """
+        segments = playlist.segments
+        if not segments:
+            return 0
+        if first:
+            after = self.start_after
+            if after is None or not segments[0].sequence - 1 <= after <= segments[-1].sequence:
+                if after is not None and after < segments[0].sequence:
+                    self._log_line("warning", f"Missed {segments[0].sequence - after - 1} segments since the last "
+                                              f"download, carrying on from the oldest in the playlist")
+                else:
+                    after = segments[max(len(segments) - HLS_LIVE_EDGE, 0)].sequence - 1
+        elif segments[-1].sequence < self._last_queued:
+            self._log_line("warning", "The playlist's media sequence went back, carrying on from its live edge")
+            after = segments[max(len(segments) - HLS_LIVE_EDGE, 0)].sequence - 1
+        else:
+            after = self._last_queued
+        new = [segment for segment in segments if segment.sequence > after]
+        with self._new_segments:
+            self._pending.extend(new)
+            if new:
+                self._last_queued = new[-1].sequence
+            elif self._last_queued is None:
+                self._last_queued = after
+            self._new_segments.notify()
+        return len(new)
+
+    def _poll_playlist(self):
+        """
+        Reload the playlist until it ends, or until there have been no new segments for HLS_STREAM_TIMEOUT seconds.
+        """
+        last_new = time.time()
+        returncode = 0
+        added = True
+        while True:
+            interval = self._target_duration if added else self._target_duration / 2
+            if self._stop.wait(interval):
+                return
+            try:
+                playlist = self._reload()
+            except (requests.RequestException, ValueError) as e:
+                self._log_line("error", f"Failed to reload playlist: {e}")
+                playlist = None
+            added = playlist is not None and self._queue_segments(playlist) > 0
+            if added:
+                last_new = time.time()
+            elif time.time() - last_new > HLS_STREAM_TIMEOUT:
+                self._log_line("error", f"No new segments for {HLS_STREAM_TIMEOUT}s, giving up")
+                returncode = 1
+                break
+            if playlist is not None and playlist.ended:
+                break
+        with self._new_segments:
+            self._playlist_done = returncode
+            self._new_segments.notify()
+
+    @instrumentation.timed("hls_fetch_segment")
+    def _fetch(self, url):
+        error = None
+        for attempt in range(HLS_SEGMENT_ATTEMPTS):
+            if self._stop.is_set():
+                break
+            try:
+                response = self._session.get(url, headers=self.headers, timeout=HLS_REQUEST_TIMEOUT)
+                response.raise_for_status()
+                return response.content
+            except requests.RequestException as e:
+                error = e
+        raise error or requests.RequestException("stopped")
+
+    def _write_segments(self):
+        in_flight = deque()  # (segment, future), in order
+        current_map = None
+        returncode = -signal.SIGKILL
+        try:
+            while not self._stop.is_set():
+                with self._new_segments:
+                    while self._pending and len(in_flight) < self.prefetch:
+                        segment = self._pending.popleft()
+                        in_flight.append((segment, self._executor.submit(self._fetch, segment.url)))
+                    if not in_flight:
+                        if self._playlist_done is not None:
+                            returncode = self._playlist_done
+                            if returncode == 0:
+                                self._log_line("info", "Stream ended")
+                            break
+                        self._new_segments.wait(WAIT_INTERVAL)
+                        continue
+
+                segment, future = in_flight[0]
+                try:
+                    data = future.result(timeout=WAIT_INTERVAL)
+                except FutureTimeoutError:
+                    continue
+                except requests.RequestException as e:
+                    in_flight.popleft()
+                    self._log_line("error", f"Failed to fetch segment {segment.sequence}: {e}")
+                    continue
+                in_flight.popleft()
+                if segment.map_url is not None and segment.map_url != current_map:
+                    try:
+                        self._output.write(self._fetch(segment.map_url))
+                        current_map = segment.map_url
+                    except requests.RequestException as e:
+                        self._log_line("error", f"Failed to fetch segment {segment.sequence} map: {e}")
+                        continue
+                self._output.write(data)
+                self.last_sequence = segment.sequence
+                self._log_line("debug", f"Segment {segment.sequence} complete")
+        except OSError as e:
+            # e.g. the chunk writer has stopped reading
+            self._log_line("error", f"Failed to write segment: {e}")
+            returncode = 1
+        finally:
+            self._stop.set()
+            for _, future in in_flight:
+                future.cancel()
+            self._executor.shutdown(wait=False)
+            for f in (self._output, self._log):
+                try:
+                    f.close()
+                except OSError:
+                    pass
+            self.returncode = returncode
+
+    def poll(self):
+        return self.returncode
+
+    def wait(self, timeout=None):
+        self._writer.join(timeout)
+        if self._writer.is_alive():
+            raise subprocess.TimeoutExpired(self.url, timeout)
+        return self.returncode
+
+    def send_signal(self, sig):
+        """
+        Any signal stops the download, waiting for the segment being written to finish (and the chunk to be closed).
+        """
+        if self._writer is None or not self._writer.is_alive():
+            return
+        self._stop.set()
+        with self._new_segments:
+            self._new_segments.notify()
+        self._writer.join(HLS_STOP_TIMEOUT)
+        if self._writer.is_alive():
+            # Still waiting on a request, close the log so whatever is reading it is not held up
+            self._log.close()
+
+    def terminate(self):
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self):
+        self.send_signal(signal.SIGKILL)
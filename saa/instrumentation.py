@@ -0,0 +1,149 @@
+"""
+Lightweight timing spans for hot paths.
+
+Span durations are aggregated in process into fixed-bucket histograms, keyed by span name.
+Instrumentation is disabled by default, in which case timed() and span() do nothing but check a flag.
+
+    @instrumentation.timed("is_live")
+    def _is_live(self): ...
+
+    with instrumentation.span("finalize_chunk"):
+        ...
+
+Histograms can be read with snapshot() (e.g. to put in a reporting payload) or written to a file with dump().
+"""
+from time import perf_counter
+import functools
+import bisect
+import json
+
+from saa.const import SPAN_HISTOGRAM_BUCKETS
+
+_enabled = False
+_histograms = {}
+
+
+class Histogram:
+    __slots__ = ("count", "total", "min", "max", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        # One extra bucket for anything over the largest bound
+        self.buckets = [0] * (len(SPAN_HISTOGRAM_BUCKETS) + 1)
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        self.buckets[bisect.bisect_left(SPAN_HISTOGRAM_BUCKETS, value)] += 1
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "total": self.total,
+            "min": self.min,
+            "max": self.max,
+            # {upper bound (seconds): count}, only non-empty buckets. "inf" is anything over the largest bound.
+            "buckets": {str(bound): count for bound, count in zip(SPAN_HISTOGRAM_BUCKETS + ("inf",), self.buckets)
+                        if count}
+        }
+
+
+class _Span:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        record(self.name, perf_counter() - self.start)
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def enable(enabled=True):
+    global _enabled
+    _enabled = bool(enabled)
+
+
+def is_enabled():
+    return _enabled
+
+
+def record(name, duration):
+    """
+    Add a duration (in seconds) to the named histogram.
+    """
+    histogram = _histograms.get(name)
+    if histogram is None:
+        histogram = _histograms[name] = Histogram()
+    histogram.add(duration)
+
+
+def span(name):
+    """
+    Context manager that times the enclosed block as the named span.
+    """
+    if not _enabled:
+        return _NULL_SPAN
+    return _Span(name)
+
+
+def timed(name):
+    """
+    Decorator that times each call of a function as the named span.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def inner(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(name, perf_counter() - start)
+        return inner
+    return decorator
+
+
+def snapshot():
+    """
+    :return: dict of {span name: histogram dict}
+    """
+    return {name: histogram.to_dict() for name, histogram in _histograms.copy().items()}
+
+
+def reset():
+    _histograms.clear()
+
+
+def dump(path):
+    """
+    Write the current histograms to a json file.
+    """
+    with open(path, "w") as f:
+        json.dump(snapshot(), f, indent=2)
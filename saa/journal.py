@@ -0,0 +1,247 @@
+"""
+Crash-safe chunk journal.
+
+Each streamer has an SQLite database (in WAL mode) in its download directory, recording every chunk's
+temporary name, final name, start/end time, size and state:
+
+    open       - being recorded, the file still has the temporary extension
+    processing - renamed to its final name, waiting for (or going through) post-processing (see saa.pipeline)
+    finalized  - renamed to its final name (and post-processed), ready to be uploaded
+    uploaded   - handed to rclone successfully
+    evicted    - uploaded, and deleted locally by retention (see saa.retention)
+    discarded  - streamlink never created the file
+
+Post-processing records how many of its steps a chunk has been through, so it carries on from there after a restart,
+and the files the steps made, which are uploaded along with the chunk.
+
+On startup, only the chunks left open get recovered, rather than scanning the whole download directory,
+and the uploader gets the chunks to transfer from the journal rather than listing the directory.
+
+In handoff mode, an open chunk whose Streamlink process was left running for the next SAA to adopt
+has a row in the handoffs table, and is left alone by recovery until it is adopted.
+"""
+import sqlite3
+import time
+import os
+import saa.utils as utils
+
+from saa.const import JOURNAL_FILE_EXT, JOURNAL_BUSY_TIMEOUT
+
+STATE_OPEN = "open"
+STATE_PROCESSING = "processing"
+STATE_FINALIZED = "finalized"
+STATE_UPLOADED = "uploaded"
+STATE_EVICTED = "evicted"
+STATE_DISCARDED = "discarded"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    id INTEGER PRIMARY KEY,
+    temp_name TEXT NOT NULL,
+    final_name TEXT,
+    start_time REAL NOT NULL,
+    end_time REAL,
+    bytes INTEGER,
+    state TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS chunks_state ON chunks (state);
+CREATE INDEX IF NOT EXISTS chunks_final_name ON chunks (final_name);
+CREATE INDEX IF NOT EXISTS chunks_state_end_time ON chunks (state, end_time);
+CREATE TABLE IF NOT EXISTS handoffs (
+    chunk_id INTEGER PRIMARY KEY REFERENCES chunks (id),
+    pid INTEGER NOT NULL,
+    pid_start_time INTEGER
+);
+CREATE TABLE IF NOT EXISTS processing (
+    chunk_id INTEGER PRIMARY KEY REFERENCES chunks (id),
+    step INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS outputs (
+    chunk_id INTEGER NOT NULL REFERENCES chunks (id),
+    name TEXT NOT NULL,
+    PRIMARY KEY (chunk_id, name)
+);
+"""
+
+
+def journal_path(directory, streamer_name):
+    return os.path.join(directory, "." + utils.convert_to_basic_string(streamer_name) + JOURNAL_FILE_EXT)
+
+
+def is_journal_file(filename):
+    """
+    True for the journal and its WAL/shared memory files, which should never be uploaded.
+    """
+    return JOURNAL_FILE_EXT in filename
+
+
+class ChunkJournal:
+
+    def __init__(self, directory, streamer_name):
+        self.path = journal_path(directory, streamer_name)
+        self.created = not os.path.exists(self.path)
+        self._conn = sqlite3.connect(self.path, timeout=JOURNAL_BUSY_TIMEOUT, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # WAL + NORMAL only risks losing the last transactions on power loss, never corrupting the journal
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    @classmethod
+    def open_existing(cls, directory, streamer_name):
+        """
+        :return: ChunkJournal, or None if the streamer has no journal
+        """
+        if not os.path.exists(journal_path(directory, streamer_name)):
+            return None
+        return cls(directory, streamer_name)
+
+    def open_chunk(self, temp_name, start_time=None):
+        """
+        Record a chunk that is about to start recording.
+        :return: id of the chunk
+        """
+        cursor = self._conn.execute("INSERT INTO chunks (temp_name, start_time, state) VALUES (?, ?, ?)",
+                                    (temp_name, start_time or time.time(), STATE_OPEN))
+        return cursor.lastrowid
+
+    def begin_finalize(self, chunk_id, final_name, end_time=None, size=None):
+        """
+        Record the final name of a chunk before it is renamed, so recovery can find it if we crash mid-rename.
+        """
+        self._conn.execute("UPDATE chunks SET final_name = ?, end_time = ?, bytes = ? WHERE id = ?",
+                           (final_name, end_time or time.time(), size, chunk_id))
+
+    def finalize_chunk(self, chunk_id, process=False):
+        """
+        :param process: if the chunk is to be post-processed before it is uploaded
+        """
+        if not process:
+            self._conn.execute("UPDATE chunks SET state = ? WHERE id = ?", (STATE_FINALIZED, chunk_id))
+            return
+        with self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.execute("UPDATE chunks SET state = ? WHERE id = ?", (STATE_PROCESSING, chunk_id))
+            self._conn.execute("INSERT OR REPLACE INTO processing (chunk_id, step) VALUES (?, 0)", (chunk_id,))
+
+    def discard_chunk(self, chunk_id):
+        self._conn.execute("UPDATE chunks SET end_time = ?, state = ? WHERE id = ?",
+                           (time.time(), STATE_DISCARDED, chunk_id))
+
+    def add_finalized(self, final_name, start_time, end_time, size):
+        """
+        Record a chunk that was already finalized (e.g. recorded before the journal existed).
+        """
+        self._conn.execute("INSERT INTO chunks (temp_name, final_name, start_time, end_time, bytes, state) "
+                           "VALUES (?, ?, ?, ?, ?, ?)",
+                           (final_name, final_name, start_time, end_time, size, STATE_FINALIZED))
+
+    def open_chunks(self):
+        """
+        :return: chunks left open, not including those handed off
+        """
+        return self._conn.execute("SELECT * FROM chunks WHERE state = ? AND id NOT IN (SELECT chunk_id FROM handoffs) "
+                                  "ORDER BY id", (STATE_OPEN,)).fetchall()
+
+    def add_handoff(self, chunk_id, pid, pid_start_time):
+        """
+        Record that a chunk's Streamlink process has been left running for the next SAA to adopt.
+        """
+        self._conn.execute("INSERT OR REPLACE INTO handoffs (chunk_id, pid, pid_start_time) VALUES (?, ?, ?)",
+                           (chunk_id, pid, pid_start_time))
+
+    def handoffs(self):
+        return self._conn.execute("SELECT handoffs.*, chunks.temp_name, chunks.start_time FROM handoffs "
+                                  "JOIN chunks ON chunks.id = handoffs.chunk_id ORDER BY chunk_id").fetchall()
+
+    def remove_handoff(self, chunk_id):
+        self._conn.execute("DELETE FROM handoffs WHERE chunk_id = ?", (chunk_id,))
+
+    def side_file_path(self, chunk_id, ext):
+        """
+        Path for a file belonging to a chunk (e.g. the Streamlink log in handoff mode).
+        Named after the journal, so it is never uploaded.
+        """
+        return f"{self.path}-{chunk_id}{ext}"
+
+    def processing_chunks(self, limit=None):
+        """
+        :return: chunks waiting for post-processing, oldest first, with the index of the next step to run as step
+        """
+        return self._conn.execute("SELECT chunks.*, processing.step FROM chunks "
+                                  "JOIN processing ON processing.chunk_id = chunks.id WHERE chunks.state = ? "
+                                  "ORDER BY chunks.id LIMIT ?", (STATE_PROCESSING, -1 if limit is None else limit)
+                                  ).fetchall()
+
+    def processing_count(self):
+        return self._conn.execute("SELECT COUNT(*) FROM chunks WHERE state = ?", (STATE_PROCESSING,)).fetchone()[0]
+
+    def complete_step(self, chunk_id, step, final_name=None, size=None, output=None):
+        """
+        Record that a post-processing step has finished.
+        :param final_name: the step replaced the chunk with this file
+        :param output: the step made this file, to be uploaded along with the chunk
+        """
+        with self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.execute("UPDATE processing SET step = ? WHERE chunk_id = ?", (step + 1, chunk_id))
+            if final_name is not None:
+                self._conn.execute("UPDATE chunks SET final_name = ?, bytes = ? WHERE id = ?",
+                                   (final_name, size, chunk_id))
+            if output is not None:
+                self._conn.execute("INSERT OR IGNORE INTO outputs (chunk_id, name) VALUES (?, ?)", (chunk_id, output))
+
+    def finish_processing(self, chunk_id=None):
+        """
+        Mark a post-processed chunk as ready to be uploaded.
+        :param chunk_id: None for all the chunks waiting for post-processing (e.g. it has been turned off)
+        :return: how many chunks were marked
+        """
+        where, args = ("", ()) if chunk_id is None else (" AND id = ?", (chunk_id,))
+        with self._conn:
+            self._conn.execute("BEGIN")
+            count = self._conn.execute("UPDATE chunks SET state = ? WHERE state = ?" + where,
+                                       (STATE_FINALIZED, STATE_PROCESSING) + args).rowcount
+            self._conn.execute("DELETE FROM processing" + ("" if chunk_id is None else " WHERE chunk_id = ?"), args)
+        return count
+
+    def outputs(self, chunk_id):
+        """
+        :return: names of the files post-processing made from a chunk
+        """
+        return [row['name'] for row in
+                self._conn.execute("SELECT name FROM outputs WHERE chunk_id = ? ORDER BY name", (chunk_id,))]
+
+    def finalized_chunks(self):
+        return self._conn.execute("SELECT * FROM chunks WHERE state = ? ORDER BY id", (STATE_FINALIZED,)).fetchall()
+
+    def mark_uploaded(self, final_names):
+        with self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.executemany("UPDATE chunks SET state = ? WHERE final_name = ? AND state = ?",
+                                   [(STATE_UPLOADED, name, STATE_FINALIZED) for name in final_names])
+
+    def uploaded_chunks(self):
+        """
+        :return: uploaded chunks still kept locally, oldest first
+        """
+        return self._conn.execute("SELECT * FROM chunks WHERE state = ? ORDER BY end_time, id",
+                                  (STATE_UPLOADED,)).fetchall()
+
+    def local_bytes(self):
+        """
+        :return: bytes of the finished chunks kept locally (uploaded or not)
+        """
+        return self._conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM chunks WHERE state IN (?, ?, ?)",
+                                  (STATE_PROCESSING, STATE_FINALIZED, STATE_UPLOADED)).fetchone()[0]
+
+    def mark_evicted(self, chunk_ids):
+        with self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.executemany("UPDATE chunks SET state = ? WHERE id = ? AND state = ?",
+                                   [(STATE_EVICTED, chunk_id, STATE_UPLOADED) for chunk_id in chunk_ids])
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
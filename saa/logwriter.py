@@ -0,0 +1,193 @@
+"""
+Multi-process logging through a single writer process.
+
+Every SAA process logs through a QueueHandler, which only puts the record on a multiprocessing queue.
+The log writer process takes records off the queue and is the only process that formats and writes them
+(to stderr, and optionally a rotating log file).
+
+The writer can also (both are off unless set in config.yml):
+- Deduplicate repetitive debug messages. Debug messages from the same process that are the same apart from numbers
+  (e.g. Streamlink segment lines) are only written once per dedupe window, followed by a count of how many were suppressed.
+- Rate limit each process to a number of messages per second. Warnings and above are never rate limited.
+"""
+from logging.handlers import QueueHandler, RotatingFileHandler
+from queue import Empty
+import multiprocessing
+import logging
+import time
+import re
+import saa.utils as utils
+
+from saa.const import (
+
+    LOG_FILE_MAX_BYTES,
+    LOG_FILE_BACKUP_COUNT,
+    LOG_RATE_LIMIT,
+    LOG_DEDUPE_WINDOW,
+    LOG_WRITER_FLUSH_INTERVAL
+
+)
+
+NUMBERS_RE = re.compile(r"\d+")
+
+_queue = None  # queue of the running log writer, inherited by forked processes
+
+
+class LogWriter:
+
+    def __init__(self, queue, log_file=None, max_bytes=LOG_FILE_MAX_BYTES, backup_count=LOG_FILE_BACKUP_COUNT,
+                 rate_limit=LOG_RATE_LIMIT, dedupe_window=LOG_DEDUPE_WINDOW):
+        """
+        :param queue: multiprocessing queue records are put on
+        :param log_file: path of a log file to write to as well as stderr (optional)
+        :param rate_limit: messages per second allowed per process, 0 to disable
+        :param dedupe_window: seconds to suppress similar debug messages for, 0 to disable
+        """
+        self.queue = queue
+        self.log_file = log_file
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.rate_limit = rate_limit
+        self.dedupe_window = dedupe_window
+
+        self._handlers = []
+        self._seen = {}  # dedupe key: [window start, suppressed count]
+        self._buckets = {}  # process name: [tokens, last refill]
+        self._dropped = {}  # process name: dropped count
+
+    def _setup_handlers(self):
+        stream_handler = utils.LoggingHandler()
+        self._handlers.append(stream_handler)
+        if self.log_file:
+            file_handler = RotatingFileHandler(self.log_file, maxBytes=self.max_bytes, backupCount=self.backup_count)
+            file_handler.setFormatter(stream_handler.formatter)
+            self._handlers.append(file_handler)
+
+    def _write(self, record):
+        for handler in self._handlers:
+            handler.handle(record)
+
+    def _write_note(self, process_name, message):
+        self._write(logging.makeLogRecord({"name": "root", "levelno": logging.INFO, "levelname": "INFO",
+                                           "processName": process_name, "filename": "logwriter.py",
+                                           "msg": message}))
+
+    def _allow_rate(self, record, now):
+        """
+        Token bucket per process, refilled at rate_limit tokens per second (burst of rate_limit).
+        """
+        if not self.rate_limit or record.levelno >= logging.WARNING:
+            return True
+        tokens, last = self._buckets.get(record.processName, (self.rate_limit, now))
+        tokens = min(self.rate_limit, tokens + (now - last) * self.rate_limit)
+        if tokens < 1:
+            self._buckets[record.processName] = [tokens, now]
+            self._dropped[record.processName] = self._dropped.get(record.processName, 0) + 1
+            return False
+        self._buckets[record.processName] = [tokens - 1, now]
+        return True
+
+    def _write_suppressed(self, key, suppressed):
+        self._write_note(key[0], f"(suppressed {suppressed} similar messages like: {key[2]})")
+
+    def _allow_dedupe(self, record, now):
+        if not self.dedupe_window or record.levelno >= logging.INFO:
+            return True
+        key = (record.processName, record.levelno, NUMBERS_RE.sub("#", str(record.msg)))
+        seen = self._seen.get(key)
+        if seen is not None and now - seen[0] < self.dedupe_window:
+            seen[1] += 1
+            return False
+        if seen is not None and seen[1] > 0:
+            self._write_suppressed(key, seen[1])
+        self._seen[key] = [now, 0]
+        return True
+
+    def _flush(self, now):
+        """
+        Report suppressed/dropped messages and forget expired dedupe entries.
+        """
+        for key, (start, suppressed) in list(self._seen.items()):
+            if now - start < self.dedupe_window:
+                continue
+            if suppressed > 0:
+                self._write_suppressed(key, suppressed)
+            del self._seen[key]
+        for process_name, dropped in self._dropped.items():
+            self._write_note(process_name, f"(rate limited, dropped {dropped} messages)")
+        self._dropped.clear()
+
+    def handle(self, record):
+        now = time.monotonic()
+        if self._allow_dedupe(record, now) and self._allow_rate(record, now):
+            self._write(record)
+
+    def run(self):
+        self._setup_handlers()
+        last_flush = time.monotonic()
+        while True:
+            try:
+                record = self.queue.get(timeout=LOG_WRITER_FLUSH_INTERVAL)
+            except Empty:
+                record = None
+            except (EOFError, OSError):
+                # The queue has gone, so everything else has
+                return
+            if record is not None:
+                self.handle(record)
+            now = time.monotonic()
+            if now - last_flush >= LOG_WRITER_FLUSH_INTERVAL:
+                self._flush(now)
+                last_flush = now
+
+
+def _run_log_writer(queue, kwargs):
+    LogWriter(queue, **kwargs).run()
+
+
+def log_queue():
+    """
+    :return: the log writer's queue, to pass to processes that are not forked (see saa.workers), None if not started
+    """
+    return _queue
+
+
+def install_queue_handler(logger: logging.Logger, queue):
+    """
+    Make the logger log through the log writer's queue, replacing its handlers.
+    """
+    global _queue
+    _queue = queue
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(QueueHandler(queue))
+
+
+def start_log_writer(config_conf: dict, logger: logging.Logger, context=None):
+    """
+    Start the log writer process, and make the given logger (and any process forked after this) log through it.
+
+    :param config_conf: dictionary containing the contents of the config section of config.yml
+    :param logger: logger to replace the handlers of
+    :param context: multiprocessing context to create the queue with, that of any processes it is passed to
+    :return: the log writer process
+    """
+    queue = (context or multiprocessing).Queue()
+    writer_kwargs = {
+        "log_file": utils.try_get(config_conf, lambda x: x['log_file'], str),
+        "max_bytes": utils.try_get(config_conf, lambda x: x['log_file_max_bytes'], int) or LOG_FILE_MAX_BYTES,
+        "backup_count": utils.try_get(config_conf, lambda x: x['log_file_backups'], int) or LOG_FILE_BACKUP_COUNT,
+        "rate_limit": utils.try_get(config_conf, lambda x: x['log_rate_limit'], (int, float)),
+        "dedupe_window": utils.try_get(config_conf, lambda x: x['log_dedupe_window'], (int, float)),
+    }
+    if writer_kwargs["rate_limit"] is None:
+        writer_kwargs["rate_limit"] = LOG_RATE_LIMIT
+    if writer_kwargs["dedupe_window"] is None:
+        writer_kwargs["dedupe_window"] = LOG_DEDUPE_WINDOW
+
+    process = multiprocessing.Process(target=_run_log_writer, args=(queue, writer_kwargs), name="LogWriter")
+    process.daemon = True
+    process.start()
+
+    install_queue_handler(logger, queue)
+    return process
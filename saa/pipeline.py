@@ -0,0 +1,262 @@
+"""
+Post-processing pipeline, run on finished chunks before they are uploaded.
+
+A streamer's pipeline is a list of steps in streamers.yml, each a command run on the chunk:
+
+    pipeline:
+      - remux: mp4                  # ffmpeg -c copy into <chunk>.mp4, which replaces the .ts
+      - thumbnail: 10               # <chunk>.jpg, a frame from 10 seconds in
+      - command: ["my-tool", "{input}", "{output}"]
+        output: "{stem}.json"       # {stem} is the chunk's name without its extension
+        replace: false              # true if the output replaces the chunk
+
+When a chunk is finalized, the archiver records it in its journal as waiting for post-processing (rather than as ready
+to be uploaded), and tells the pipeline process. The pipeline process runs the steps, on a pool of `workers` threads
+over all the streamers, each running one step at a time, so at most `workers` steps run at once. The pipeline process runs
+with the processing priority class (see saa.priority), which the steps inherit, so they do not get in the way of
+recording. A step writes to a temporary name
+(<name>.saproc.<ext>), which is renamed once the step has succeeded, and the journal records each finished step and
+what it made. Only then is the chunk (with the step outputs) marked as ready, so the uploader never sees half
+processed chunks. After a restart, a chunk carries on from the step it had got to.
+
+If a step fails, the rest are skipped and the chunk is uploaded as it is. If a streamer has more than
+`max_backlog` chunks waiting, new chunks are uploaded without post-processing, rather than filling the disk.
+Post-processing needs the chunk journal.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from collections import namedtuple
+import subprocess
+import threading
+import logging
+import signal
+import time
+import sys
+import os
+
+import saa.profiling as profiling
+import saa.instrumentation as instrumentation
+import saa.priority as priority_module
+from saa.checksum import manifest_name, HASHLIB_ALGORITHMS, XXHASH_ALGORITHMS
+from saa.journal import ChunkJournal
+from saa.const import PIPELINE_WORKERS, PIPELINE_TEMP_INFIX, FFMPEG_BINARY
+
+log = logging.getLogger('root')
+
+Step = namedtuple("Step", ("name", "command", "output", "replace"))
+
+# how much of a failed step's stderr is logged
+STEP_ERROR_TAIL = 2000
+
+
+def _remux_step(container):
+    return Step("remux", [FFMPEG_BINARY, "-nostdin", "-hide_banner", "-loglevel", "error", "-y", "-i", "{input}",
+                          "-c", "copy", "{output}"], "{stem}." + str(container).lstrip("."), True)
+
+
+def _thumbnail_step(seconds):
+    return Step("thumbnail", [FFMPEG_BINARY, "-nostdin", "-hide_banner", "-loglevel", "error", "-y",
+                              "-ss", str(float(seconds)), "-i", "{input}", "-frames:v", "1", "{output}"],
+                "{stem}.jpg", False)
+
+
+def build_steps(conf):
+    """
+    :param conf: the pipeline list of a streamer in streamers.yml
+    :return: tuple of Steps
+    :raises ValueError: if a step is not valid
+    """
+    if conf is None:
+        return ()
+    if not isinstance(conf, list):
+        raise ValueError("pipeline needs to be a list of steps")
+    steps = []
+    for i, step in enumerate(conf):
+        if not isinstance(step, dict):
+            raise ValueError(f"pipeline step {i + 1} needs to be a dict")
+        if 'remux' in step:
+            steps.append(_remux_step(step['remux']))
+        elif 'thumbnail' in step:
+            steps.append(_thumbnail_step(step['thumbnail']))
+        elif 'command' in step:
+            if not isinstance(step['command'], list) or not step['command'] or not step.get('output'):
+                raise ValueError(f"pipeline step {i + 1} needs a command (as a list) and an output")
+            steps.append(Step(str(step.get('name') or os.path.basename(str(step['command'][0]))),
+                              [str(arg) for arg in step['command']], str(step['output']), bool(step.get('replace'))))
+        else:
+            raise ValueError(f"pipeline step {i + 1} needs to be one of remux, thumbnail or command")
+    return tuple(steps)
+
+
+def temp_name(name):
+    base, ext = os.path.splitext(name)
+    return base + PIPELINE_TEMP_INFIX + ext
+
+
+def is_temp_file(filename):
+    return PIPELINE_TEMP_INFIX in filename
+
+
+class PostProcessor:
+
+    def __init__(self, workers=PIPELINE_WORKERS):
+        """
+        :param workers: how many steps can run at once
+        """
+        self._executor = ThreadPoolExecutor(max_workers=max(int(workers), 1), thread_name_prefix="pipeline")
+        self._lock = threading.Lock()
+        self._steps = {}  # (streamer, directory): steps, of the journals with a task queued or running
+        self._again = set()  # journals told about more chunks while their task was running
+        self._running = set()  # step processes
+        self._stopping = False
+
+    def submit(self, streamer, directory, steps):
+        """
+        Post-process the chunks of a streamer's journal waiting for it, one at a time.
+        Journals take turns, so a streamer with a backlog does not hold up the others.
+        """
+        key = (streamer, directory)
+        with self._lock:
+            queued = key in self._steps
+            self._steps[key] = tuple(steps)
+            self._again.add(key)
+        if not queued:
+            self._executor.submit(self._process_next, key)
+
+    def _process_next(self, key):
+        with self._lock:
+            if self._stopping:
+                return
+            self._again.discard(key)
+            steps = self._steps[key]
+        try:
+            more = self._process_one(key[0], key[1], steps)
+        except Exception as e:
+            log.error(f"[{key[0]}] Post-processing failed in {key[1]}: {e}")
+            more = False
+        with self._lock:
+            if self._stopping or (not more and key not in self._again):
+                del self._steps[key]
+                return
+        self._executor.submit(self._process_next, key)
+
+    def _process_one(self, streamer, directory, steps):
+        """
+        :return: True if a chunk was processed (there may be more)
+        """
+        journal = ChunkJournal.open_existing(directory, streamer)
+        if journal is None:
+            return False
+        try:
+            chunks = journal.processing_chunks(limit=1)
+            if not chunks:
+                return False
+            self._process_chunk(journal, streamer, directory, chunks[0], steps)
+            return True
+        finally:
+            journal.close()
+
+    @instrumentation.timed("pipeline_chunk")
+    def _process_chunk(self, journal, streamer, directory, chunk, steps):
+        name = chunk['final_name']
+        started = time.time()
+        for index in range(chunk['step'], len(steps)):
+            step = steps[index]
+            output = self._run_step(streamer, directory, name, step)
+            if self._stopping:
+                # Carries on from this step next time
+                return
+            if output is None:
+                log.error(f"[{streamer}] Skipping the rest of the steps for {name}, uploading it as it is.")
+                break
+            if step.replace:
+                journal.complete_step(chunk['id'], index, final_name=output,
+                                      size=os.path.getsize(os.path.join(directory, output)))
+                if output != name:
+                    self._remove_chunk(directory, name)
+                name = output
+            else:
+                journal.complete_step(chunk['id'], index, output=output)
+        journal.finish_processing(chunk['id'])
+        log.info(f"[{streamer}] Processed {name} ({time.time() - started:.1f}s)")
+
+    def _run_step(self, streamer, directory, name, step):
+        """
+        :return: name of the step's output, None if it failed
+        """
+        output = step.output.replace("{stem}", os.path.splitext(name)[0])
+        temp_path = os.path.join(directory, temp_name(output))
+        command = [arg.replace("{input}", os.path.join(directory, name)).replace("{output}", temp_path)
+                   .replace("{stem}", os.path.splitext(name)[0]) for arg in step.command]
+        log.debug(f"[{streamer}] {step.name}: {command}")
+        try:
+            # In its own process group, so anything it starts is killed along with it
+            process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                       stderr=subprocess.PIPE, start_new_session=True)
+        except OSError as e:
+            log.error(f"[{streamer}] Could not run {step.name} on {name}: {e}")
+            return None
+        with self._lock:
+            self._running.add(process)
+        try:
+            _, stderr = process.communicate()
+        finally:
+            with self._lock:
+                self._running.discard(process)
+        if process.returncode != 0 or not os.path.exists(temp_path):
+            if not self._stopping:
+                log.error(f"[{streamer}] {step.name} failed on {name} (exit code {process.returncode}): "
+                          f"{stderr.decode('utf-8', errors='replace')[-STEP_ERROR_TAIL:].strip()}")
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            return None
+        os.rename(temp_path, os.path.join(directory, output))
+        return output
+
+    @staticmethod
+    def _remove_chunk(directory, name):
+        """
+        Remove a chunk a step has replaced, along with its checksum manifest (which was for the chunk as recorded).
+        """
+        for file in [name] + [manifest_name(name, a) for a in HASHLIB_ALGORITHMS + XXHASH_ALGORITHMS]:
+            try:
+                os.unlink(os.path.join(directory, file))
+            except FileNotFoundError:
+                pass
+
+    def stop(self):
+        """
+        Kill the running steps, the chunks carry on from them next time.
+        """
+        with self._lock:
+            self._stopping = True
+            for process in self._running:
+                try:
+                    os.killpg(process.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+
+
+def pipeline_worker(request_queue, workers=PIPELINE_WORKERS, priority=None, profile_directory=None,
+                    enable_instrumentation=False):
+    """
+    Runs the post-processing pipeline, started by the StreamWatcher.
+
+    :param request_queue: queue the archivers send {'streamer', 'directory', 'steps'} on when they have a chunk
+                          waiting for post-processing
+    :param priority: PriorityClass to run with (see saa.priority), None to leave it
+    """
+    priority_module.apply_and_log(priority)
+    profiling.install_profiling_handlers(profile_directory)
+    instrumentation.enable(enable_instrumentation)
+    processor = PostProcessor(workers)
+
+    def stop_handler(sig, frame):
+        processor.stop()
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, stop_handler)
+    signal.signal(signal.SIGINT, stop_handler)
+    log.info(f"Running up to {workers} post-processing steps at once.")
+    while True:
+        request = request_queue.get()
+        processor.submit(request['streamer'], request['directory'], request['steps'])
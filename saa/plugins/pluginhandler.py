@@ -1,13 +1,17 @@
-from saa.plugins.plugins import PluginBase, ReportingPluginBase
+from saa.plugins.plugins import PluginBase, ReportingPluginBase, AsyncReportingPluginBase, ProbePluginBase
+from saa.const import REPORTING_PLUGIN_HANDLER_SLEEP
 from queue import Queue
-from time import sleep
+from time import sleep, time
 import saa.plugins.reporting
+import saa.plugins.probes
 import saa.utils as utils
+import saa.priority as priority_module
 import multiprocessing
 import threading
+import traceback
+import asyncio
 import importlib
 import logging
-import pkgutil
 import inspect
 
 log = logging.getLogger("root")
@@ -20,42 +24,65 @@ class PluginHandlerBase:
         self.__plugin_pkg = plugin_pkg  # Required
         self._plugins = {}
 
-    def find_plugins(self, package):
+    def find_plugin(self, package, plugin_name):
         """
-        Automatically discover plugins for a given package.
-        For each class in each module in such package if the class is a subclass of the base plugin and not the base plugin,
-        then we found plugin.
-        Appends found plugins to self._plugins - format {plugin.name: plugin class}
+        Import a single plugin from a given package.
+        The package's PLUGINS manifest maps plugin names to "<module>:<class>".
+        If the plugin is not in the manifest, fall back to a module with the same name as the plugin
+        and look for a subclass of the base plugin with a matching name.
+        Only the module for the requested plugin gets imported.
+        :return: plugin class, or None if not found or it failed to import
         """
-        for _, plugin_name, ispkg in pkgutil.iter_modules(package.__path__, package.__name__ + "."):
-            if ispkg:
-                continue
-            plugin_module = importlib.import_module(plugin_name)
-            for _, class_ in inspect.getmembers(plugin_module, inspect.isclass):
-                if issubclass(class_, self.__plugin_subclass) and class_ is not self.__plugin_subclass:
-                    log.debug(f"Discovered Plugin: {class_.__module__}.{class_.__name__}")
-                    if class_.name not in self._plugins:
-                        self._plugins[class_.name] = class_
+        manifest = getattr(package, "PLUGINS", {})
+        module_name, _, class_name = manifest.get(plugin_name, plugin_name).partition(":")
+        try:
+            plugin_module = importlib.import_module(f"{package.__name__}.{module_name}")
+        except ModuleNotFoundError as e:
+            if e.name != f"{package.__name__}.{module_name}":
+                # The plugin exists, but one of its dependencies does not
+                log.error(f"Failed to load plugin '{plugin_name}', missing dependency: {e.name}")
+            return None
+        except Exception as e:
+            log.error(f"Failed to load plugin '{plugin_name}': {e}")
+            return None
+
+        for _, class_ in inspect.getmembers(plugin_module, inspect.isclass):
+            if class_name:
+                matches = class_.__name__ == class_name
+            else:
+                matches = getattr(class_, "name", None) == plugin_name
+            if matches and issubclass(class_, self.__plugin_subclass) and class_ is not self.__plugin_subclass:
+                log.debug(f"Discovered Plugin: {class_.__module__}.{class_.__name__}")
+                return class_
+        return None
 
-    def load_plugins(self):
+    def load_plugins(self, plugin_names):
         """
-        Finds and loads plugins.
+        Finds and loads the given plugins.
         Clears the current list of plugins if applicable.
+        Appends found plugins to self._plugins - format {plugin.name: plugin class}
         """
         self._plugins.clear()
-        log.debug(f"Finding plugins in {self.__plugin_pkg}")
-        self.find_plugins(self.__plugin_pkg)
+        log.debug(f"Finding plugins {list(plugin_names)} in {self.__plugin_pkg.__name__}")
+        for plugin_name in plugin_names:
+            class_ = self.find_plugin(self.__plugin_pkg, plugin_name)
+            if class_ is not None:
+                self._plugins[plugin_name] = class_
 
 
 class ReportingPluginHandler(PluginHandlerBase):
     def __init__(self, master_reporting_queue, enabled_plugin_configs: dict):
         self._plugin_threads = {}
-        self._plugin_data_queues = []
+        self._async_plugin_tasks = {}
+        self._stopped_plugins = set()  # async plugins stopped with stop_plugin(), not to be relaunched
+        self._plugin_data_queues = {}
         self._plugin_configs = enabled_plugin_configs
         self._incoming_data_queue = master_reporting_queue
         self._queue_splitter_thread = None
+        self._loop = None
+        self._loop_thread = None
         super().__init__(plugin_subclass=ReportingPluginBase, plugin_pkg=saa.plugins.reporting)
-        self.load_plugins()
+        self.load_plugins(self._plugin_configs)
 
     def start(self):
         self._launch_queue_splitter()  # This shouldn't crash...
@@ -65,6 +92,13 @@ class ReportingPluginHandler(PluginHandlerBase):
                 if plugin_c_name not in self._plugins:
                     log.debug(f"Plugin '{plugin_c_name}' does not exist. Ignoring.")
                     continue
+
+                # Async plugins restart themselves on the event loop, so only need launching once
+                if issubclass(self._plugins[plugin_c_name], AsyncReportingPluginBase):
+                    if plugin_c_name not in self._async_plugin_tasks and plugin_c_name not in self._stopped_plugins:
+                        self.launch_async_plugin(plugin_c_name)
+                    continue
+
                 # Launch plugin if not already launched
                 if plugin_c_name not in self._plugin_threads:
                     plugin_configured = self.configure_plugin(plugin_c_name, self._plugin_configs[plugin_c_name])
@@ -77,20 +111,27 @@ class ReportingPluginHandler(PluginHandlerBase):
                     plugin_configured = self.configure_plugin(plugin_c_name, self._plugin_configs[plugin_c_name])
                     self.launch_plugin(plugin_configured)
                     continue
-            sleep(2)
+            sleep(REPORTING_PLUGIN_HANDLER_SLEEP)
 
     def configure_plugin(self, plugin_name, plugin_config):
         """
         Configure a given plugin with a queue and config.
         Assumes plugin_name represents a valid plugin.
+        Async plugins get an asyncio.Queue, so this must be called from the event loop for them.
         :return: plugin object
         """
-        q = Queue()
-        plug_c = self._plugins[plugin_name](q)
+        plugin_class = self._plugins[plugin_name]
+        # Reuse the queue of a previous (crashed) instance of this plugin, so no data is lost on restart
+        q = self._plugin_data_queues.get(plugin_name)
+        if q is None:
+            q = asyncio.Queue() if issubclass(plugin_class, AsyncReportingPluginBase) else Queue()
+        plug_c = plugin_class(q)
         if plugin_config is None:
             plugin_config = {}
+        if isinstance(plug_c, AsyncReportingPluginBase):
+            plug_c.timeout = plugin_config.get('timeout', plug_c.timeout)
         plug_c.set_config(**plugin_config)
-        self._plugin_data_queues.append(q)
+        self._plugin_data_queues[plugin_name] = q
         return plug_c
 
     def _launch_queue_splitter(self):
@@ -106,8 +147,11 @@ class ReportingPluginHandler(PluginHandlerBase):
         while True:
             next_data = self._incoming_data_queue.get()
             # Push to all queues
-            for q in self._plugin_data_queues:
-                q.put(next_data)
+            for q in self._plugin_data_queues.copy().values():
+                if isinstance(q, asyncio.Queue):
+                    self._loop.call_soon_threadsafe(q.put_nowait, next_data)
+                else:
+                    q.put(next_data)
 
     def launch_plugin(self, plugin):
         thread = threading.Thread(target=plugin.main)
@@ -117,12 +161,157 @@ class ReportingPluginHandler(PluginHandlerBase):
         self._plugin_threads[thread.name] = thread
         return thread
 
+    def _launch_event_loop(self):
+        """
+        Start the event loop all async plugins run on, in a separate thread.
+        """
+        self._loop = asyncio.new_event_loop()
+        self._loop_thread = threading.Thread(target=self._loop.run_forever, name="ReportingPluginLoop")
+        self._loop_thread.daemon = True
+        self._loop_thread.start()
+
+    def launch_async_plugin(self, plugin_name):
+        """
+        Schedule an async plugin on the event loop, starting the loop if it is not running yet.
+        :return: concurrent.futures.Future for the plugin task
+        """
+        if self._loop is None:
+            self._launch_event_loop()
+        task = asyncio.run_coroutine_threadsafe(self._run_async_plugin(plugin_name), self._loop)
+        self._async_plugin_tasks[plugin_name] = task
+        self._stopped_plugins.discard(plugin_name)
+        return task
+
+    def stop_plugin(self, plugin_name):
+        """
+        Cancel a running async plugin. It will not be relaunched until restart_plugin() is called.
+        Thread based plugins cannot be stopped.
+        :return: True if the plugin was stopped
+        """
+        if plugin_name not in self._async_plugin_tasks:
+            return False
+        # Before the task is gone, so start() does not launch it again
+        self._stopped_plugins.add(plugin_name)
+        task = self._async_plugin_tasks.pop(plugin_name)
+        task.cancel()
+        self._plugin_data_queues.pop(plugin_name, None)
+        log.info(f"[ReportingPluginHandler] Stopped {plugin_name}.")
+        return True
+
+    def restart_plugin(self, plugin_name):
+        """
+        Cancel (if running) and relaunch an async plugin with a fresh instance.
+        :return: True if the plugin was relaunched
+        """
+        if plugin_name not in self._plugins or not issubclass(self._plugins[plugin_name], AsyncReportingPluginBase):
+            return False
+        self.stop_plugin(plugin_name)
+        self.launch_async_plugin(plugin_name)
+        log.info(f"[ReportingPluginHandler] Restarted {plugin_name}.")
+        return True
+
+    async def _run_async_plugin(self, plugin_name):
+        """
+        Run an async plugin, restarting it if it crashes or exits. Runs until cancelled.
+        """
+        while True:
+            try:
+                plugin = self.configure_plugin(plugin_name, self._plugin_configs[plugin_name])
+                await plugin.main()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.error(f"[ReportingPluginHandler] {plugin_name} has crashed! Restarting plugin..."
+                          f"\n{traceback.format_exc()}")
+            else:
+                log.error(f"[ReportingPluginHandler] {plugin_name} has exited! Restarting plugin...")
+            await asyncio.sleep(REPORTING_PLUGIN_HANDLER_SLEEP)
+
 
-def launch_reporting_plugins(queue: multiprocessing.Queue, plugin_configs: dict):
+def _start_with_priority(start, priority):
+    # Threads started from here on (the plugins' own) inherit the priority
+    priority_module.apply_and_log(priority)
+    start()
+
+
+def launch_reporting_plugins(queue: multiprocessing.Queue, plugin_configs: dict, priority=None):
     """
     Launches the Reporting Plugin Handler which will launch all the enabled reporting plugins.
+    :param priority: PriorityClass to run the plugins with (see saa.priority), None to leave it
+    :return: the ReportingPluginHandler
     """
     status_plugins = ReportingPluginHandler(master_reporting_queue=queue, enabled_plugin_configs=plugin_configs)
-    status_plugins_thread = threading.Thread(target=status_plugins.start)
+    status_plugins_thread = threading.Thread(target=_start_with_priority, args=(status_plugins.start, priority))
     status_plugins_thread.daemon = True
     status_plugins_thread.start()
+    return status_plugins
+
+
+class ProbePluginHandler(PluginHandlerBase):
+    """
+    Runs the enabled probe plugins, checking all the streamers they handle in batches, and passes the verdicts to
+    the archivers through their ArchiverControl (see saa.control). Streamers with the same url share a verdict.
+    """
+
+    def __init__(self, enabled_plugin_configs: dict, processes: dict):
+        """
+        :param processes: streamers_watcher's current processes, key: {'process', 'config', 'control', ...}
+        """
+        self._plugin_configs = enabled_plugin_configs
+        self._processes = processes
+        self._probes = []
+        super().__init__(plugin_subclass=ProbePluginBase, plugin_pkg=saa.plugins.probes)
+        self.load_plugins(self._plugin_configs)
+        for plugin_name, plugin_class in self._plugins.items():
+            probe = plugin_class()
+            probe.set_config(**(self._plugin_configs[plugin_name] or {}))
+            self._probes.append(probe)
+
+    def start(self):
+        interval = min(probe.ttl for probe in self._probes) / 2
+        while True:
+            try:
+                self.run_probes()
+            except Exception:
+                log.error(f"[ProbePluginHandler] Probing failed:\n{traceback.format_exc()}")
+            sleep(interval)
+
+    def run_probes(self):
+        """
+        Probe every streamer url a probe handles, once each.
+        """
+        controls = {}  # url: controls of the streamers with that url
+        for proc in list(self._processes.values()):
+            controls.setdefault(proc['config']['url'], []).append(proc['control'])
+
+        for probe in self._probes:
+            channels = {}  # channel: urls
+            for url in list(controls):
+                channel = probe.match(url)
+                if channel is not None:
+                    channels.setdefault(channel, []).append(controls.pop(url))
+            names = sorted(channels)
+            for i in range(0, len(names), probe.batch_size):
+                checked = time()
+                verdicts = probe.probe(names[i:i + probe.batch_size])
+                log.debug(f"[ProbePluginHandler] {probe.name}: {verdicts}")
+                for channel, live in verdicts.items():
+                    for url_controls in channels.get(channel, []):
+                        for control in url_controls:
+                            control.set_state(probe_live=live, probe_expires=checked + probe.ttl)
+
+
+def launch_probe_plugins(plugin_configs: dict, processes: dict, priority=None):
+    """
+    Launches the Probe Plugin Handler, if any of the enabled probes could be loaded.
+    :param priority: PriorityClass to run the probes with (see saa.priority), None to leave it
+    :return: the handler, None if there are no probes
+    """
+    probe_plugins = ProbePluginHandler(enabled_plugin_configs=plugin_configs, processes=processes)
+    if not probe_plugins._probes:
+        return None
+    probe_plugins_thread = threading.Thread(target=_start_with_priority, args=(probe_plugins.start, priority),
+                                            name="ProbePluginHandler")
+    probe_plugins_thread.daemon = True
+    probe_plugins_thread.start()
+    return probe_plugins
@@ -1,4 +1,11 @@
 from queue import Queue
+import asyncio
+import logging
+import re
+
+from saa.const import PROBE_DEFAULT_TTL
+
+log = logging.getLogger("root")
 
 
 class PluginBase:
@@ -24,3 +31,74 @@ class ReportingPluginBase(PluginBase):
         self._thread = None
         super().__init__()
 
+
+class AsyncReportingPluginBase(ReportingPluginBase):
+    """
+    Reporting plugin that runs as a task on the reporting plugin handler's event loop, rather than in its own thread.
+    The data queue is an asyncio.Queue.
+
+    By default main() takes each payload off the data queue and passes it to process(),
+    cancelling process() if it takes longer than timeout seconds (None = no timeout).
+    Override main() instead if the plugin needs to manage the queue itself.
+    """
+    name = "AsyncReportingPluginBase"
+    timeout = None
+
+    def __init__(self, data_queue: asyncio.Queue):
+        super().__init__(data_queue)
+
+    async def main(self):
+        while True:
+            data = await self._data_queue.get()
+            try:
+                await asyncio.wait_for(self.process(data), self.timeout)
+            except asyncio.TimeoutError:
+                log.error(f"[{self.__class__.__name__}] Processing data took longer than {self.timeout}s, skipping.")
+
+    async def process(self, data: dict):
+        # Code goes here to process each payload
+        pass
+
+
+class ProbePluginBase(PluginBase):
+    """
+    Checks if streamers are live through a platform's API, many channels per request,
+    so streamers found to be offline don't need a full Streamlink check (see ProbePluginHandler).
+
+    url_pattern is a regex for the streamer urls the probe handles, with a "channel" group.
+    """
+    name = "ProbePluginBase"
+    url_pattern = None
+    batch_size = 100  # channels per probe() call
+    ttl = PROBE_DEFAULT_TTL  # seconds a verdict is used for
+
+    def __init__(self):
+        super().__init__()
+        self._url_re = re.compile(self.url_pattern) if self.url_pattern else None
+
+    def set_config(self, **kwargs):
+        ttl = kwargs.get('ttl', self.ttl)
+        try:
+            ttl = float(ttl)
+        except (TypeError, ValueError):
+            ttl = 0
+        if ttl > 0:
+            self.ttl = ttl
+        else:
+            log.warning(f"[{self.name}] ttl must be a number of seconds above 0, using {self.ttl}.")
+
+    def match(self, url: str):
+        """
+        :return: the channel the url is for, None if the probe does not handle it
+        """
+        if self._url_re is None:
+            return None
+        m = self._url_re.match(url)
+        return m.group("channel").lower() if m else None
+
+    def probe(self, channels: list):
+        """
+        Check up to batch_size channels.
+        :return: dict of {channel: True if live, False if not}, channels left out are unknown
+        """
+        return {}
@@ -0,0 +1,10 @@
+"""
+Probe plugin manifest.
+
+Maps the probe name used in config.yml to "<module>:<class>" within this package.
+Probe modules are only imported when they are enabled in config.yml.
+"""
+
+PLUGINS = {
+    "twitch": "twitch:TwitchProbe",
+}
@@ -0,0 +1,73 @@
+from saa.plugins.plugins import ProbePluginBase
+from saa.const import PROBE_HTTP_TIMEOUT
+from urllib.parse import urlencode
+import urllib.request
+import urllib.error
+import logging
+import json
+
+log = logging.getLogger('root')
+
+TWITCH_API_URL = "https://api.twitch.tv/helix"
+TWITCH_TOKEN_URL = "https://id.twitch.tv/oauth2/token"
+
+
+class TwitchProbe(ProbePluginBase):
+    """
+    Checks up to 100 Twitch channels per request, with the Helix Get Streams endpoint.
+    Needs a Twitch application's client_id and client_secret (for an app access token), or client_id and a token.
+    """
+    name = "twitch"
+    url_pattern = r"^https?://(?:www\.|m\.)?twitch\.tv/(?P<channel>\w{2,25})/?$"
+    batch_size = 100
+
+    def __init__(self):
+        self.__client_id = None
+        self.__client_secret = None
+        self.__token = None
+        self.__api_url = TWITCH_API_URL
+        self.__token_url = TWITCH_TOKEN_URL
+        super().__init__()
+
+    def set_config(self, **kwargs):
+        super().set_config(**kwargs)
+        self.__client_id = kwargs.get('client_id')
+        self.__client_secret = kwargs.get('client_secret')
+        self.__token = kwargs.get('token')
+        self.__api_url = kwargs.get('api_url', self.__api_url).rstrip("/")
+        self.__token_url = kwargs.get('token_url', self.__token_url)
+
+    def __get_token(self):
+        data = urlencode({'client_id': self.__client_id, 'client_secret': self.__client_secret,
+                          'grant_type': 'client_credentials'}).encode()
+        with urllib.request.urlopen(self.__token_url, data=data, timeout=PROBE_HTTP_TIMEOUT) as response:
+            self.__token = json.load(response)['access_token']
+
+    def __get_streams(self, channels):
+        query = urlencode([('user_login', c) for c in channels] + [('first', len(channels))])
+        request = urllib.request.Request(f"{self.__api_url}/streams?{query}",
+                                         headers={'Client-Id': self.__client_id,
+                                                  'Authorization': f"Bearer {self.__token}"})
+        with urllib.request.urlopen(request, timeout=PROBE_HTTP_TIMEOUT) as response:
+            return json.load(response)['data']
+
+    def probe(self, channels: list):
+        if not self.__client_id or not (self.__token or self.__client_secret):
+            log.error(f"[{self.__class__.__name__}] client_id, and client_secret or token, are required.")
+            return {}
+        try:
+            if self.__token is None:
+                self.__get_token()
+            try:
+                streams = self.__get_streams(channels)
+            except urllib.error.HTTPError as e:
+                if e.code != 401 or not self.__client_secret:
+                    raise
+                # The app access token has expired
+                self.__get_token()
+                streams = self.__get_streams(channels)
+        except (OSError, ValueError, KeyError) as e:
+            log.warning(f"[{self.__class__.__name__}] Could not check channels: {e}")
+            return {}
+        live = {s['user_login'].lower() for s in streams if s.get('type') == 'live'}
+        return {channel: channel in live for channel in channels}
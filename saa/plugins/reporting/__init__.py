@@ -0,0 +1,12 @@
+"""
+Reporting plugin manifest.
+
+Maps the plugin name used in config.yml to "<module>:<class>" within this package.
+Plugin modules are only imported when they are enabled in config.yml, so a plugin with missing
+optional dependencies does not affect anyone who has not enabled it.
+"""
+
+PLUGINS = {
+    "influxdb": "influxdb:InfluxDBPlugin",
+    "history": "history:HistoryPlugin",
+}
@@ -0,0 +1,53 @@
+from saa.plugins.plugins import ReportingPluginBase
+from saa.history import StreamerHistory, capacity_for_retention, record_from_payload, history_path
+from saa.const import HISTORY_DEFAULT_DIR, HISTORY_DEFAULT_RETENTION_DAYS
+import saa.utils as utils
+import logging
+import os
+
+log = logging.getLogger('root')
+
+
+class HistoryPlugin(ReportingPluginBase):
+    name = "history"
+
+    def __init__(self, data_queue):
+        self.__directory = HISTORY_DEFAULT_DIR
+        self.__retention_days = HISTORY_DEFAULT_RETENTION_DAYS
+        self.__histories = {}
+        super().__init__(data_queue)
+
+    def main(self):
+        log.info(f"[{self.__class__.__name__}] Starting History Plugin...")
+        log.info("\n----------"
+                 "\nHistory Config:"
+                 f"\nDirectory: {self.__directory}"
+                 f"\nRetention: {self.__retention_days} days"
+                 "\n----------")
+        os.makedirs(self.__directory, exist_ok=True)
+        try:
+            self.__loop()
+        finally:
+            for history in self.__histories.values():
+                history.close()
+
+    def __loop(self):
+        """Main loop that writes payloads to each streamer's history file"""
+        while True:
+            data = self._data_queue.get()
+            record = record_from_payload(data)
+            if record is None:
+                log.debug(f"[{self.__class__.__name__}] Ignoring unknown payload: {data}")
+                continue
+            self.__get_history(data.get('streamer')).append(record)
+
+    def __get_history(self, streamer):
+        streamer = utils.convert_to_basic_string(str(streamer))
+        if streamer not in self.__histories:
+            self.__histories[streamer] = StreamerHistory(history_path(self.__directory, streamer),
+                                                         capacity=capacity_for_retention(self.__retention_days))
+        return self.__histories[streamer]
+
+    def set_config(self, **kwargs):
+        self.__directory = kwargs.get('directory', self.__directory)
+        self.__retention_days = float(kwargs.get('retention_days', self.__retention_days))
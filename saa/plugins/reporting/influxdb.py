@@ -52,23 +52,38 @@ class InfluxDBPlugin(ReportingPluginBase):
             self.__send_payload(data)
 
     def __send_payload(self, data):
-        if data.get('is_live'):
+        tags = {"streamer": f"{utils.convert_to_basic_string(data.get('streamer'))}"}
+        if data.get('event') is not None:
+            # Events (e.g. stalls) go to their own measurement, tagged with the event
+            measurement = "streamer_events"
+            tags["event"] = data.get('event')
+            fields = {"value": float(data.get('value') or 0.0)}
+        elif data.get('is_live'):
+            measurement = "streamers"
             fields = {
                     "is_live": int(data.get('is_live')),
                     "chunk_time_elapsed": data.get('chunk_time_elapsed') or 0.0,
                     "stream_time_elapsed": data.get('stream_time_elapsed') or 0.0,
-                    "chunks": data.get('chunks') or 0
+                    "chunks": data.get('chunks') or 0,
+                    "chunk_bytes": data.get('chunk_bytes') or 0,
+                    "chunk_bytes_per_second": float(data.get('chunk_bytes_per_second') or 0.0),
+                    "stalls": data.get('stalls') or 0
                 }
         else:
-            fields = {"is_live": int(data.get('is_live'))}
+            measurement = "streamers"
+            fields = {"is_live": int(data.get('is_live')), "stalls": data.get('stalls') or 0}
+        if data.get('event') is None:
+            # e.g. streamlink_segment_error
+            fields.update({f"streamlink_{event}": count
+                           for event, count in (data.get('streamlink_events') or {}).items()})
+            # e.g. evicted_bytes, cumulative, the rate of eviction is its derivative
+            fields.update({f"evicted_{key}": count for key, count in (data.get('evicted') or {}).items()})
 
         payload = [
             {
-                "measurement": "streamers",
+                "measurement": measurement,
                 "time": data.get('time_utc'),
-                "tags": {
-                    "streamer": f"{utils.convert_to_basic_string(data.get('streamer'))}"
-                },
+                "tags": tags,
                 "fields": fields
             }
         ]
@@ -0,0 +1,316 @@
+"""
+CPU and IO priority classes for the kinds of work SAA does, so uploads, post-processing and plugins do not starve
+the recordings:
+
+    recording  - the archiver processes, and so Streamlink (and the in-process HLS downloads and chunk writers)
+    upload     - the rcloneWatcher process, and so rclone
+    processing - the post-processing pipeline process, and so the steps it runs (see saa.pipeline)
+    plugins    - the reporting and probe plugin threads in the StreamWatcher
+
+Each class has a nice value, an ionice class (idle or best-effort, with the best-effort level following nice as the
+kernel does by default), and optionally cgroup v2 settings (e.g. cpu.weight, io.weight, cpu.max, memory.high).
+Unless configured, only processing has one (the pipeline's nice and ionice), the rest run as SAA was started.
+A process applies its class to itself when it starts, so everything it starts from then on inherits it. Nice and IO
+priority are per thread on Linux, which is how the plugins class applies to just the plugin threads.
+
+Recordings always have the highest priority: any other class set to a lower nice (or a better ionice class) than the
+recordings is raised to theirs. Lowering nice below the one SAA was started with needs CAP_SYS_NICE.
+
+cgroup settings need SAA to be started in a cgroup v2 it can write to (e.g. systemd's Delegate=yes). cgroup v2 only
+allows processes in leaf cgroups, so at startup the processes in SAA's cgroup are moved to a "main" leaf under it, and
+each class with cgroup settings gets a leaf next to it, which its processes move to when they start.
+
+What was applied is read back and logged when each process starts, with a warning for anything that did not take.
+ionice and cgroups are Linux only.
+"""
+import ctypes.util
+import platform
+import logging
+import ctypes
+import os
+import re
+
+import saa.utils as utils
+from saa.const import PRIORITY_CLASSES, PRIORITY_CGROUP_MAIN
+
+log = logging.getLogger('root')
+
+CLASS_RECORDING = "recording"
+CLASS_UPLOAD = "upload"
+CLASS_PROCESSING = "processing"
+CLASS_PLUGINS = "plugins"
+
+IONICE_CLASSES = {"best-effort": 2, "idle": 3}
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_WHO_PROCESS = 1  # with who = 0, the calling thread
+# (ioprio_set, ioprio_get) syscall numbers
+IOPRIO_SYSCALLS = {"x86_64": (251, 252), "aarch64": (30, 31), "i386": (289, 290), "i686": (289, 290),
+                   "armv7l": (314, 315), "ppc64le": (273, 274), "s390x": (282, 283)}
+CGROUP_SETTING_RE = re.compile(r"(cpu|io|memory|pids)\.[a-z_.]+")
+
+_syscall = None
+
+
+class PriorityClass:
+
+    def __init__(self, name, nice=None, ionice=None, cgroup=None):
+        """
+        :param nice: niceness, None to leave it
+        :param ionice: ionice class, idle or best-effort, None (or "none") to leave it
+        :param cgroup: {cgroup v2 setting file: value}, e.g. {"cpu.weight": 50}
+        """
+        self.name = name
+        self.nice = None
+        if nice is not None:
+            try:
+                self.nice = min(max(int(nice), -20), 19)
+            except (TypeError, ValueError):
+                log.warning(f"Invalid nice {nice} for {name}, leaving it.")
+        self.ionice = None
+        if ionice is not None and str(ionice).lower() != "none":
+            if str(ionice).lower() in IONICE_CLASSES:
+                self.ionice = str(ionice).lower()
+            else:
+                log.warning(f"Unknown ionice class {ionice} for {name}, valid are {', '.join(IONICE_CLASSES)}.")
+        self.cgroup = {}
+        for setting, value in (cgroup or {}).items():
+            if CGROUP_SETTING_RE.fullmatch(str(setting)):
+                self.cgroup[str(setting)] = str(value)
+            else:
+                log.warning(f"Unknown cgroup setting {setting} for {name}, skipping it.")
+        self.cgroup_path = None  # set by setup_cgroups
+
+    def __repr__(self):
+        settings = [f"nice {self.nice if self.nice is not None else 'unchanged'}",
+                    f"ionice {self.ionice or 'unchanged'}"]
+        if self.cgroup:
+            settings.append("cgroup " + ", ".join(f"{k}={v}" for k, v in self.cgroup.items()))
+        return f"{self.name}: " + ", ".join(settings)
+
+
+def load_classes(config_conf):
+    """
+    :param config_conf: the config section of config.yml, its priorities section overrides PRIORITY_CLASSES
+    :return: {class name: PriorityClass}
+    """
+    conf = utils.try_get(config_conf, lambda x: x['priorities'], dict) or {}
+    for name in conf:
+        if name not in PRIORITY_CLASSES:
+            log.warning(f"Unknown priority class {name}, valid are {', '.join(PRIORITY_CLASSES)}.")
+    # The pipeline's nice and ionice settings are the defaults for its class
+    pipeline_conf = utils.try_get(config_conf, lambda x: x['pipeline'], dict) or {}
+    classes = {}
+    for name, default in PRIORITY_CLASSES.items():
+        default = dict(default)
+        if name == CLASS_PROCESSING:
+            default.update({k: pipeline_conf[k] for k in ('nice', 'ionice') if k in pipeline_conf})
+        class_conf = {**default, **(utils.try_get(conf, lambda x: x[name], dict) or {})}
+        classes[name] = PriorityClass(name, class_conf.get('nice'), class_conf.get('ionice'), class_conf.get('cgroup'))
+
+    # Recordings always have the highest priority
+    recording = classes[CLASS_RECORDING]
+    recording_nice = recording.nice if recording.nice is not None else os.getpriority(os.PRIO_PROCESS, 0)
+    for priority_class in classes.values():
+        if priority_class is recording:
+            continue
+        if priority_class.nice is not None and priority_class.nice < recording_nice:
+            log.warning(f"{priority_class.name} can not have a lower nice than recording, using {recording_nice}.")
+            priority_class.nice = recording_nice
+        if recording.ionice == "idle" and priority_class.ionice != "idle":
+            log.warning(f"{priority_class.name} can not have a better ionice class than recording, using idle.")
+            priority_class.ionice = "idle"
+    if classes[CLASS_PLUGINS].cgroup:
+        log.warning("Plugins run as threads in the StreamWatcher, so can not have cgroup settings.")
+        classes[CLASS_PLUGINS].cgroup = {}
+    return classes
+
+
+def _load_syscall():
+    """
+    :return: (ioprio_set, ioprio_get) as functions, None if not available
+    """
+    global _syscall
+    if _syscall is None:
+        numbers = IOPRIO_SYSCALLS.get(platform.machine())
+        try:
+            if numbers is None:
+                raise OSError(f"no ioprio syscalls known for {platform.machine()}")
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            libc.syscall.restype = ctypes.c_long
+        except (OSError, AttributeError) as e:
+            log.debug(f"Can not set IO priorities: {e}")
+            _syscall = False
+            return None
+        _syscall = (lambda ioprio: libc.syscall(numbers[0], IOPRIO_WHO_PROCESS, 0, ioprio),
+                    lambda: libc.syscall(numbers[1], IOPRIO_WHO_PROCESS, 0))
+    return _syscall or None
+
+
+def _ioprio(ionice, nice):
+    # The best-effort level the kernel would derive from nice (0 is the highest, 7 the lowest)
+    level = min(max((nice + 20) // 5, 0), 7) if ionice == "best-effort" else 0
+    return (IONICE_CLASSES[ionice] << IOPRIO_CLASS_SHIFT) | level
+
+
+def _cgroup2_mount():
+    """
+    :return: where the cgroup v2 hierarchy is mounted, None if it is not
+    """
+    try:
+        with open("/proc/self/mounts") as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) > 2 and fields[2] == "cgroup2":
+                    return fields[1]
+    except OSError:
+        pass
+    return None
+
+
+def _own_cgroup():
+    """
+    :return: path of this process's cgroup v2, e.g. /system.slice/saa.service, None if it is not in one
+    """
+    try:
+        with open("/proc/self/cgroup") as f:
+            for line in f:
+                if line.startswith("0::"):
+                    return line[3:].strip()
+    except OSError:
+        pass
+    return None
+
+
+def _write(path, value):
+    with open(path, "w") as f:
+        f.write(value)
+
+
+def setup_cgroups(classes):
+    """
+    Create a cgroup leaf for each class with cgroup settings, in SAA's cgroup, moving SAA's processes to a leaf of
+    their own first. To be called once by the main process at startup, before starting the others.
+    Classes whose cgroup could not be set up are left without one.
+    """
+    wanted = [c for c in classes.values() if c.cgroup]
+    if not wanted:
+        return
+    mount, own = _cgroup2_mount(), _own_cgroup()
+    if mount is None or own is None:
+        log.warning("cgroup settings need cgroup v2, skipping them.")
+        return
+    base = os.path.join(mount, own.lstrip("/"))
+    if not os.access(os.path.join(base, "cgroup.subtree_control"), os.W_OK):
+        log.warning(f"Can not write to SAA's cgroup {own}, skipping the cgroup settings. "
+                    f"Start SAA in a delegated cgroup (e.g. Delegate=yes under systemd).")
+        return
+
+    controllers = set()
+    try:
+        with open(os.path.join(base, "cgroup.controllers")) as f:
+            available = set(f.read().split())
+        needed = {setting.split(".", 1)[0] for c in wanted for setting in c.cgroup}
+        controllers = needed & available
+        for controller in sorted(needed - available):
+            log.warning(f"The {controller} cgroup controller is not available in {own}, skipping its settings.")
+        if own != "/":
+            # Only leaves can have processes once controllers are enabled for the children
+            main = os.path.join(base, PRIORITY_CGROUP_MAIN)
+            os.makedirs(main, exist_ok=True)
+            with open(os.path.join(base, "cgroup.procs")) as f:
+                pids = f.read().split()
+            for pid in pids:
+                try:
+                    _write(os.path.join(main, "cgroup.procs"), pid)
+                except OSError:
+                    # e.g. it has exited
+                    pass
+        if controllers:
+            _write(os.path.join(base, "cgroup.subtree_control"), " ".join("+" + c for c in sorted(controllers)))
+    except OSError as e:
+        log.warning(f"Could not set up cgroups in {own}, skipping the cgroup settings: {e}")
+        return
+
+    for priority_class in wanted:
+        path = os.path.join(base, priority_class.name)
+        try:
+            os.makedirs(path, exist_ok=True)
+        except OSError as e:
+            log.warning(f"Could not create cgroup {path}: {e}")
+            continue
+        priority_class.cgroup_path = path
+        for setting, value in priority_class.cgroup.items():
+            if setting.split(".", 1)[0] not in controllers:
+                continue
+            try:
+                _write(os.path.join(path, setting), value)
+            except OSError as e:
+                log.warning(f"Could not set {setting} to {value} for {priority_class.name}: {e}")
+
+
+def apply(priority_class):
+    """
+    Apply a priority class to the calling thread, and move its process to the class's cgroup.
+    Threads and processes it starts from then on inherit it.
+    :param priority_class: PriorityClass, None to leave everything
+    """
+    if priority_class is None:
+        return
+    if priority_class.nice is not None:
+        try:
+            os.setpriority(os.PRIO_PROCESS, 0, priority_class.nice)
+        except OSError as e:
+            log.warning(f"Could not set nice {priority_class.nice} for {priority_class.name}: {e}")
+    if priority_class.ionice is not None:
+        syscall = _load_syscall()
+        if syscall is not None and syscall[0](_ioprio(priority_class.ionice, os.getpriority(os.PRIO_PROCESS, 0))) != 0:
+            log.warning(f"Could not set ionice {priority_class.ionice} for {priority_class.name}: "
+                        f"{os.strerror(ctypes.get_errno())}")
+    if priority_class.cgroup_path is not None:
+        try:
+            _write(os.path.join(priority_class.cgroup_path, "cgroup.procs"), str(os.getpid()))
+        except OSError as e:
+            log.warning(f"Could not move to cgroup {priority_class.cgroup_path}: {e}")
+
+
+def verify(priority_class):
+    """
+    Read back what the calling thread is running with, and warn about any of the class's settings that did not take.
+    :return: description of what it is running with
+    """
+    nice = os.getpriority(os.PRIO_PROCESS, 0)
+    applied = [f"nice {nice}"]
+    if priority_class is not None and priority_class.nice is not None and nice != priority_class.nice:
+        log.warning(f"Running {priority_class.name} with nice {nice}, not {priority_class.nice}.")
+
+    syscall = _load_syscall()
+    if syscall is not None:
+        ioprio = syscall[1]()
+        ionice = {v: k for k, v in IONICE_CLASSES.items()}.get(ioprio >> IOPRIO_CLASS_SHIFT, "none")
+        applied.append(f"ionice {ionice}" + (f" {ioprio & 0xff}" if ionice == "best-effort" else ""))
+        if priority_class is not None and priority_class.ionice is not None and ionice != priority_class.ionice:
+            log.warning(f"Running {priority_class.name} with ionice {ionice}, not {priority_class.ionice}.")
+
+    own = _own_cgroup()
+    if own is not None:
+        applied.append(f"cgroup {own}")
+    if priority_class is not None and priority_class.cgroup_path is not None:
+        for setting in priority_class.cgroup:
+            try:
+                with open(os.path.join(priority_class.cgroup_path, setting)) as f:
+                    applied.append(f"{setting}={f.read().strip()}")
+            except OSError:
+                pass
+        if own is None or not priority_class.cgroup_path.endswith(own):
+            log.warning(f"Running {priority_class.name} in cgroup {own}, not {priority_class.cgroup_path}.")
+    return ", ".join(applied)
+
+
+def apply_and_log(priority_class, level=logging.INFO):
+    """
+    Apply a priority class (see apply), and log what was applied.
+    """
+    if priority_class is None:
+        return
+    apply(priority_class)
+    log.log(level, f"Running with the {priority_class.name} priority class ({verify(priority_class)}).")
@@ -0,0 +1,96 @@
+"""
+On-demand profiling of a running SAA process, toggled by signals.
+
+SIGUSR1 - start cProfile, send again to stop and dump stats to <name>-<pid>-<time>.prof (view with pstats/snakeviz)
+          If timing spans are enabled (saa.instrumentation), they are dumped to <name>-<pid>-<time>.spans.json too.
+SIGUSR2 - start tracemalloc, send again to dump a snapshot to <name>-<pid>-<time>.tracemalloc
+          (and the top allocations to a .txt next to it) and stop
+
+Note cProfile only profiles the main thread, as that is where signal handlers run.
+This leaves SIGTERM/SIGINT alone, so it can be installed alongside StreamArchiver.kill_handler.
+"""
+import multiprocessing
+import tracemalloc
+import tempfile
+import logging
+import cProfile
+import signal
+import os
+import saa.utils as utils
+import saa.instrumentation as instrumentation
+from saa.const import TRACEMALLOC_FRAMES, TRACEMALLOC_TOP_STATS
+
+log = logging.getLogger('root')
+
+
+class SignalProfiler:
+
+    def __init__(self, directory=None):
+        self.directory = directory or tempfile.gettempdir()
+        self._profile = None
+
+    def install(self):
+        """
+        Install the signal handlers in the current process.
+        :return: True if installed, False if not supported on this platform
+        """
+        if not hasattr(signal, "SIGUSR1"):
+            log.debug("SIGUSR1/SIGUSR2 not available, not installing profiling handlers.")
+            return False
+        signal.signal(signal.SIGUSR1, self.toggle_cprofile)
+        signal.signal(signal.SIGUSR2, self.toggle_tracemalloc)
+        return True
+
+    def _output_path(self, ext):
+        name = utils.convert_to_basic_string(multiprocessing.current_process().name)
+        return os.path.join(self.directory, f"{name}-{os.getpid()}-{utils.get_utc_nice()}{ext}")
+
+    def toggle_cprofile(self, sig=None, frame=None):
+        if self._profile is None:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+            log.info(f"Started cProfile (pid {os.getpid()}), send SIGUSR1 again to stop and dump stats.")
+            return
+
+        self._profile.disable()
+        path = self._output_path(".prof")
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            self._profile.dump_stats(path)
+            log.info(f"Stopped cProfile, stats written to {path}")
+            if instrumentation.is_enabled():
+                instrumentation.dump(path[:-len(".prof")] + ".spans.json")
+        except OSError as e:
+            log.error(f"Failed to write cProfile stats to {path}: {e}")
+        self._profile = None
+
+    def toggle_tracemalloc(self, sig=None, frame=None):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            log.info(f"Started tracemalloc (pid {os.getpid()}), send SIGUSR2 again to dump a snapshot.")
+            return
+
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        path = self._output_path(".tracemalloc")
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            snapshot.dump(path)
+            with open(path + ".txt", "w") as f:
+                for stat in snapshot.statistics("lineno")[:TRACEMALLOC_TOP_STATS]:
+                    f.write(f"{stat}\n")
+            log.info(f"Stopped tracemalloc, snapshot written to {path}")
+        except OSError as e:
+            log.error(f"Failed to write tracemalloc snapshot to {path}: {e}")
+
+
+def install_profiling_handlers(directory=None):
+    """
+    Install the profiling signal handlers in the current process.
+    :param directory: where to write stats to, defaults to the temp directory
+    :return: SignalProfiler
+    """
+    profiler = SignalProfiler(directory)
+    if profiler.install():
+        log.debug(f"Profiling signal handlers installed, output directory: {profiler.directory}")
+    return profiler
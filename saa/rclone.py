@@ -2,19 +2,28 @@ import os
 import logging
 import yaml
 import saa.utils as utils
+import saa.profiling as profiling
+import saa.instrumentation as instrumentation
+import saa.priority as priority_module
+from saa.journal import ChunkJournal, is_journal_file
+from saa.checksum import manifest_name
+from saa.pipeline import is_temp_file
+from saa.specs import ConfigCompiler, create_upload_specs
+import sqlite3
 import subprocess
 import argparse
 import tempfile
-from time import sleep
+from time import sleep, time
+from queue import Empty
 from saa.const import (
 
     TEMP_FILE_EXT,
+    MANIFEST_FILE_EXT,
     RCLONE_BIN_LOCATION,
     RCLONE_CONFIG_LOCATION,
     RCLONE_DEFAULT_TRANSFERS,
     RCLONE_DEFAULT_OPERATION,
-    LOG_LEVEL_DEFAULT,
-    DEFAULT_DOWNLOAD_DIR
+    LOG_LEVEL_DEFAULT
 
 )
 
@@ -47,6 +56,21 @@ class RcloneWrapper:
         os.unlink(file_name)
         return d
 
+    def check_from_checkfile(self, hash_type: str, checkfile_lines: list, dest: str, extra_args=[]):
+        """
+        Check the files on dest against a checksum file, without reading the local files.
+        --one-way, as dest will have files from earlier transfers that are not in the checksum file.
+        :return: If fails (including any mismatch), None. else the Output of command.
+        """
+        with tempfile.NamedTemporaryFile(mode='w', delete=False) as fp:
+            file_name = fp.name
+            fp.writelines(checkfile_lines)
+
+        d = self._run_command(['check', '--one-way', '--checkfile', hash_type, str(file_name), str(dest)] + extra_args)
+        os.unlink(file_name)
+        return d
+
+    @instrumentation.timed("rclone_run_command")
     def _run_command(self, command_args: list):
         """
 
@@ -76,6 +100,7 @@ class RecordingsTransfer:
 
     def __init__(self, **kwargs):
 
+        self.streamer = kwargs.get('streamer')
         self.source_dir = kwargs.get('source_dir')
         self.source_dir_basename = os.path.basename(self.source_dir)
         self.rclone_config = kwargs.get('rclone_config', RCLONE_CONFIG_LOCATION)
@@ -84,16 +109,71 @@ class RecordingsTransfer:
         self.operation = kwargs.get('operation', RCLONE_DEFAULT_OPERATION)
         self.rclone_args = list(kwargs.get('rclone_args', []))
         self.transfers = kwargs.get('transfers', RCLONE_DEFAULT_TRANSFERS)
+        self.checksum = kwargs.get('checksum')
+        self.verify_checksum = bool(kwargs.get('verify_checksum', False))
+        self._journal = None
         self.run()
 
+    def _open_journal(self):
+        if self.streamer is None:
+            return None
+        try:
+            return ChunkJournal.open_existing(self.source_dir, self.streamer)
+        except sqlite3.Error as e:
+            log.warning(f"Could not open chunk journal for {self.streamer}, listing {self.source_dir} instead: {e}")
+            return None
+
     def _get_recordings_filtered(self):
 
-        if os.path.exists(self.source_dir):
-            return [a for a in os.listdir(self.source_dir) if not a.endswith(TEMP_FILE_EXT)]
-        else:
+        if not os.path.exists(self.source_dir):
             log.debug(f"{self.source_dir} does not exist (probably no stream downloaded yet) - skipping")
             return []
 
+        # If the streamer has a chunk journal, only transfer the chunks it has as finalized (and not yet transferred)
+        self._journal = self._open_journal()
+        if self._journal is not None:
+            recordings = []
+            for chunk in self._journal.finalized_chunks():
+                if not os.path.exists(os.path.join(self.source_dir, chunk['final_name'])):
+                    continue
+                recordings.append(chunk['final_name'])
+                if self.checksum and os.path.exists(
+                        os.path.join(self.source_dir, manifest_name(chunk['final_name'], self.checksum))):
+                    recordings.append(manifest_name(chunk['final_name'], self.checksum))
+                # Files made by post-processing (see saa.pipeline)
+                recordings.extend(name for name in self._journal.outputs(chunk['id'])
+                                  if os.path.exists(os.path.join(self.source_dir, name)))
+            return recordings
+
+        return [a for a in os.listdir(self.source_dir)
+                if not a.endswith(TEMP_FILE_EXT) and not is_journal_file(a) and not is_temp_file(a)]
+
+    def _read_manifests(self, recordings):
+        """
+        :return: dict of {hash type: [checksum file lines]} for the manifests in recordings
+        """
+        manifests = {}
+        for name in recordings:
+            if not name.endswith(MANIFEST_FILE_EXT):
+                continue
+            hash_type = name[:-len(MANIFEST_FILE_EXT)].rsplit(".", 1)[-1]
+            try:
+                with open(os.path.join(self.source_dir, name)) as f:
+                    manifests.setdefault(hash_type, []).extend(f.readlines())
+            except OSError as e:
+                log.warning(f"Could not read manifest {name}: {e}")
+        return manifests
+
+    def _verify(self, wrapper, manifests):
+        """
+        Check the transferred chunks on the remote against their manifests.
+        """
+        for hash_type, lines in manifests.items():
+            if wrapper.check_from_checkfile(hash_type, lines, self.remote_dir, extra_args=self.rclone_args) is None:
+                log.critical(f"[{self.streamer}] Checksum verification of transferred chunks on {self.remote_dir} failed!")
+            else:
+                log.info(f"[{self.streamer}] Verified {len(lines)} transferred chunks against their {hash_type} manifests.")
+
     def run(self):
 
         log.debug("Getting list of recordings")
@@ -103,49 +183,22 @@ class RecordingsTransfer:
 
         # Transferring to remote using Rclone
         if len(recordings_unfiltered) > 0:
+            # Read the manifests now, as a move will take them away
+            manifests = self._read_manifests(recordings_unfiltered) if self.verify_checksum else {}
             t = RcloneWrapper(binary=self.rclone_bin, config=self.rclone_config)
-            t.operation_from(self.operation, files=recordings_unfiltered, dest=self.remote_dir, common_path=self.source_dir, extra_args=self.rclone_args, transfers=self.transfers)
+            output = t.operation_from(self.operation, files=recordings_unfiltered, dest=self.remote_dir, common_path=self.source_dir, extra_args=self.rclone_args, transfers=self.transfers)
+            if output is not None and self._journal is not None:
+                self._journal.mark_uploaded(recordings_unfiltered)
+            if output is not None and manifests:
+                self._verify(t, manifests)
             log.debug("Completed Transfer")
 
+        if self._journal is not None:
+            self._journal.close()
 
-def create_tasks(streamers_conf: dict, rclone_conf: dict):
-
-    tasks = []
-
-    for stream in streamers_conf:
-
-        # Check if the stream has rclone arguments to start with
 
-        rclone_stream = utils.try_get(streamers_conf[stream], lambda x: x['rclone'], expected_type=dict) or None
-
-        if rclone_stream is None:
-            log.debug(f"No rclone entry for {stream}, skipping.")
-            continue
-
-        task = {}
-        task['operation'] = utils.try_get(rclone_stream, lambda x: x['operation'], expected_type=str) or utils.try_get(rclone_conf, lambda x:x['default_operation'], expected_type=str) or RCLONE_DEFAULT_OPERATION
-        task['remote_dir'] = utils.try_get(rclone_stream, lambda x: x['remote_dir'], expected_type=str) or None
-
-        if task['remote_dir'] is None:
-            log.critical(f"[{stream}] remote_dir is a required argument. Skipping.")
-
-        task['rclone_args'] = utils.try_get(rclone_stream, lambda x: x['rclone_args'], expected_type=list) or []
-        task['rclone_bin'] = utils.try_get(rclone_stream, lambda x: x['rclone_bin'], expected_type=str) or utils.try_get(
-            rclone_conf, lambda x: x['rclone_bin'], expected_type=str) or RCLONE_BIN_LOCATION
-
-        task['source_dir'] = utils.try_get(streamers_conf[stream], lambda x: x['download_directory'], expected_type=str) or DEFAULT_DOWNLOAD_DIR
-
-        task['rclone_config'] = utils.try_get(rclone_stream, lambda x: x['config'], expected_type=str) or utils.try_get(rclone_conf, lambda x: x['config'], expected_type=str) or RCLONE_CONFIG_LOCATION
-
-        task['transfers'] = utils.try_get(rclone_stream, lambda x: x['transfers'], expected_type=int) or utils.try_get(
-            rclone_conf, lambda x: x['transfers'], expected_type=int) or RCLONE_DEFAULT_TRANSFERS
-
-        tasks.append(task)
-    log.debug(tasks)
-    return tasks
-
-
-def rclone_watcher(rclone_conf, streamers_file, sleep_time: int):
+def rclone_watcher(rclone_conf, streamers_file, sleep_time: int, profile_directory=None,
+                   enable_instrumentation=False, volumes=None, request_queue=None, priority=None):
     """
 
 
@@ -154,25 +207,68 @@ def rclone_watcher(rclone_conf, streamers_file, sleep_time: int):
     :param rclone_conf:
     :param streamers_file:
     :param sleep_time:
+    :param profile_directory: where to write profiling stats to (see saa.profiling)
+    :param enable_instrumentation: record timing spans (see saa.instrumentation)
+    :param volumes: volume pool from config.yml (see saa.volumes)
+    :param request_queue: queue of requests from the control API (see saa.control), handled between runs,
+                          and of upload specs from the StreamWatcher (see saa.specs)
+    :param priority: PriorityClass to run with (see saa.priority), which rclone inherits, None to leave it
     :return:
     """
+    priority_module.apply_and_log(priority)
+    profiling.install_profiling_handlers(profile_directory)
+    instrumentation.enable(enable_instrumentation)
     log.info(f"Running with a sleep delay of {sleep_time/3600}hrs")
+    api_streamers = {}  # streamers added through the control API
+    compiler = ConfigCompiler(streamers_file, {'volumes': volumes}, rclone_conf)
+    uploads = None  # upload specs from the StreamWatcher, streamers.yml is compiled here until it has sent them
     while True:
-        run_rclone(rclone_conf, streamers_file)
-        sleep(sleep_time)
-
-
-def run_rclone(rclone_conf, streamers_file):
-
-    # Load the streams from config_dev.yml
-    with open(streamers_file) as f:
-        streamers = yaml.load(f, Loader=yaml.FullLoader)['streamers']
-
-    tasks = create_tasks(streamers, rclone_conf)
-
-    log.info(f"Running transfer of completed files for {len(tasks)} streams.")
-    for task in tasks:
-        RecordingsTransfer(**task)
+        run_rclone(rclone_conf, streamers_file, volumes, api_streamers, uploads, compiler)
+        if request_queue is None:
+            sleep(sleep_time)
+            continue
+        next_run = time() + sleep_time
+        while time() < next_run:
+            try:
+                request = request_queue.get(timeout=next_run - time())
+            except Empty:
+                break
+            if request['action'] == 'specs':
+                uploads = request['uploads']
+                continue
+            handle_request(request, rclone_conf, volumes, api_streamers)
+
+
+def handle_request(request: dict, rclone_conf, volumes, api_streamers: dict):
+    """
+    Handle a request from the control API.
+    :param api_streamers: streamers added through the control API, updated by add/remove requests
+    """
+    if request['action'] == 'add':
+        api_streamers[request['key']] = request['config']
+    elif request['action'] == 'remove':
+        api_streamers.pop(request['key'], None)
+    elif request['action'] == 'upload':
+        uploads = create_upload_specs({request['key']: request['config']}, rclone_conf, volumes)
+        log.info(f"Running requested transfer of completed files for {request['key']}.")
+        for upload in uploads:
+            RecordingsTransfer(**upload.as_kwargs())
+
+
+def run_rclone(rclone_conf, streamers_file, volumes=None, api_streamers=None, uploads=None, compiler=None):
+    """
+    :param uploads: upload specs (see saa.specs) sent by the StreamWatcher, None to compile streamers.yml here
+    :param compiler: ConfigCompiler to reuse, so streamers.yml is only parsed again once it has changed
+    """
+    if uploads is None:
+        if compiler is None:
+            compiler = ConfigCompiler(streamers_file, {'volumes': volumes}, rclone_conf)
+        overlay = (lambda streamers: {**streamers, **api_streamers}) if api_streamers else None
+        uploads = compiler.compile(overlay, utils.hash_dict(api_streamers) if api_streamers else None).uploads
+
+    log.info(f"Running transfer of completed files for {len(uploads)} streams.")
+    for upload in uploads:
+        RecordingsTransfer(**upload.as_kwargs())
     log.info(f"Completed transfers")
 
 
@@ -196,5 +292,5 @@ if __name__ == "__main__":
     log.addHandler(utils.LoggingHandler())
     log.setLevel(log_level)
 
-    run_rclone(config_rclone, STREAMERS_FILE)
+    run_rclone(config_rclone, STREAMERS_FILE, utils.try_get(config_gen, lambda x: x['volumes'], list))
 
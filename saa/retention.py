@@ -0,0 +1,122 @@
+"""
+Retention for the local copies of uploaded chunks.
+
+With rclone's copy operation, chunks stay in the download directory after they are uploaded. A streamer's retention
+budgets decide how many of them are kept:
+
+    max_age   - seconds since a chunk finished
+    max_bytes - bytes of chunks the streamer keeps locally (not yet uploaded ones included)
+    min_free  - bytes to keep free on the filesystem of each download directory
+
+Only chunks the journal has as uploaded are ever deleted, oldest first, until every budget is met (or there are no
+uploaded chunks left). The journal is the index: uploaded chunks, their sizes and end times come from it rather
+than from listing the download directories. A deleted chunk (along with its checksum manifest and post-processing
+outputs) is marked as evicted in the journal.
+"""
+import logging
+import shutil
+import time
+import os
+
+import saa.utils as utils
+from saa.checksum import manifest_name, HASHLIB_ALGORITHMS, XXHASH_ALGORITHMS
+
+log = logging.getLogger('root')
+
+
+class RetentionPolicy:
+
+    def __init__(self, max_age=None, max_bytes=None, min_free=None):
+        self.max_age = float(max_age) if max_age is not None else None
+        self.max_bytes = int(max_bytes) if max_bytes is not None else None
+        self.min_free = int(min_free) if min_free is not None else None
+
+    @classmethod
+    def from_conf(cls, conf):
+        """
+        :param conf: the retention section of a streamer (or config.yml)
+        :return: RetentionPolicy, None if no budget is set
+        """
+        if not conf:
+            return None
+        policy = cls(utils.try_get(conf, lambda x: x['max_age'], int),
+                     utils.try_get(conf, lambda x: x['max_bytes'], int),
+                     utils.try_get(conf, lambda x: x['min_free'], int))
+        if policy.max_age is None and policy.max_bytes is None and policy.min_free is None:
+            return None
+        return policy
+
+    def __repr__(self):
+        return f"max_age={self.max_age}, max_bytes={self.max_bytes}, min_free={self.min_free}"
+
+    def select(self, chunks, local_bytes, free_bytes, now):
+        """
+        :param chunks: [(directory, chunk)] of the uploaded chunks, oldest first
+        :param local_bytes: bytes of all the chunks kept locally
+        :param free_bytes: {directory: free bytes on its filesystem}
+        :return: [(directory, chunk)] to evict
+        """
+        free_bytes = dict(free_bytes)
+        evict = []
+        for directory, chunk in chunks:
+            size = chunk['bytes'] or 0
+            if not ((self.max_age is not None and (chunk['end_time'] or 0) < now - self.max_age)
+                    or (self.max_bytes is not None and local_bytes > self.max_bytes)
+                    or (self.min_free is not None and free_bytes[directory] < self.min_free)):
+                continue
+            evict.append((directory, chunk))
+            local_bytes -= size
+            free_bytes[directory] += size
+        return evict
+
+    def apply(self, journals: dict, now=None):
+        """
+        Evict uploaded chunks until the budgets are met.
+        :param journals: {download directory: ChunkJournal}
+        :return: (chunks evicted, bytes reclaimed)
+        """
+        now = now or time.time()
+        chunks = [(directory, chunk) for directory, journal in journals.items()
+                  for chunk in journal.uploaded_chunks()]
+        if not chunks:
+            return 0, 0
+        chunks.sort(key=lambda c: (c[1]['end_time'] or 0, c[1]['id']))
+        local_bytes = sum(journal.local_bytes() for journal in journals.values())
+        free_bytes = {directory: shutil.disk_usage(directory).free if self.min_free is not None else 0
+                      for directory in journals}
+
+        evicted = {}
+        reclaimed = 0
+        for directory, chunk in self.select(chunks, local_bytes, free_bytes, now):
+            deleted, size = evict_chunk(directory, chunk, journals[directory].outputs(chunk['id']))
+            reclaimed += size
+            if deleted:
+                evicted.setdefault(directory, []).append(chunk['id'])
+        for directory, chunk_ids in evicted.items():
+            journals[directory].mark_evicted(chunk_ids)
+        return sum(len(ids) for ids in evicted.values()), reclaimed
+
+
+def evict_chunk(directory, chunk, outputs=()):
+    """
+    Delete an uploaded chunk, with its manifest and post-processing outputs.
+    :return: (False if the chunk could not be deleted, bytes reclaimed)
+    """
+    deleted = True
+    reclaimed = 0
+    names = [chunk['final_name']] + list(outputs)
+    names += [manifest_name(chunk['final_name'], a) for a in HASHLIB_ALGORITHMS + XXHASH_ALGORITHMS]
+    for name in names:
+        path = os.path.join(directory, name)
+        try:
+            size = os.path.getsize(path)
+            os.unlink(path)
+        except FileNotFoundError:
+            # e.g. moved by rclone
+            continue
+        except OSError as e:
+            log.warning(f"Could not delete {path}: {e}")
+            deleted = deleted and name != chunk['final_name']
+            continue
+        reclaimed += size
+    return deleted, reclaimed
@@ -1,103 +1,145 @@
 import multiprocessing
 import logging
+import signal
+import time
+import sys
+import os
 import yaml
 import saa.utils as utils
 import argparse
 import saa.rclone as rclone
-from time import sleep
-from saa.plugins.pluginhandler import launch_reporting_plugins
-import saa.archiver as archiver
+import saa.profiling as profiling
+import saa.instrumentation as instrumentation
+import saa.logwriter as logwriter
+import saa.workers as workers
+import saa.priority as priority_module
+from saa.control import ArchiverControl, ControlState, start_control_server
+from saa.admission import AdmissionController
+from saa.cluster import SqliteLeaseStore, ClusterMember
+from saa.specs import ConfigCompiler
+from saa.plugins.pluginhandler import launch_reporting_plugins, launch_probe_plugins
 from saa.const import (
 
     LOG_LEVEL_DEFAULT,
-    STREAMLINK_BINARY,
-    STREAMERS_REQUIRED_FIELDS,
     RCLONE_PROCESS_REPEAT_TIME,
-    STREAMERS_WATCHER_DEFAULT_SLEEP
+    STREAMERS_WATCHER_DEFAULT_SLEEP,
+    HANDOFF_JOIN_TIMEOUT,
+    CLUSTER_LEASE_TTL,
+    PIPELINE_WORKERS
 
 )
 
+log = logging.getLogger('root')
 
-def create_jobs(config_conf: dict, streamers_conf: dict):
-    """
 
-    Parses the configs to create a dict that can be sent to archiver.py, and jobs
-    :return:
-    """
-    jobs = {}
-    for stream in streamers_conf:
-        skip = False
-        # create a copy, we are just editing a few values
-        stream_job = streamers_conf[stream].copy()
-
-        # check required fields
-        for r in STREAMERS_REQUIRED_FIELDS:
-            if r not in stream_job.keys():
-                log.critical(f"[{stream}] {r} is a required value. Skipping job builder for this streamer..")
-                skip = True
-                break
-            else:
-                if not isinstance(stream_job[r], STREAMERS_REQUIRED_FIELDS[r]):
-                    log.critical((f"[{stream}] {r} needs to be a {STREAMERS_REQUIRED_FIELDS[r].__name__},"
-                                  f" currently it is {type(stream_job[r]).__name__}."
-                                  f" Skipping job builder for this streamer."))
-                    skip = True
-                    break
-        if 'name' not in stream_job.keys():
-            stream_job['name'] = stream
-
-        if 'enabled' not in stream_job.keys():
-            stream_job['enabled'] = True
-        stream_job['make_dirs'] = bool(
-            utils.try_get(src=config_conf, getter=lambda x: x['make_dirs'], expected_type=bool)) or True
-        stream_job['streamlink_bin'] = utils.try_get(src=config_conf, getter=lambda x: x['streamlink_bin'],
-                                                     expected_type=str) or STREAMLINK_BINARY
-
-        if not skip:
-            jobs[stream] = stream_job
-
-    return jobs
-
-
-def streamers_watcher(config_conf: dict, streamers_file: str, plugin_configs: dict):
+def streamers_watcher(config_conf: dict, streamers_file: str, plugin_configs: dict, upload_queue=None,
+                      probe_configs=None, compiler=None, priorities=None):
     """
     Main process that watches the streamers config file for changes
 
     Launches new processes for streams
     Terminates those processes when disabled etc.
+    Serves the control API, if enabled (see saa.control)
+    Decides which live streams can be recorded, if there are capacity limits (see saa.admission)
+    In cluster mode, only runs the streamers this node holds a lease on (see saa.cluster)
+    Runs the post-processing pipeline process, once a streamer has a pipeline (see saa.pipeline)
+    On SIGHUP, passes it on to the archivers (to hand off their recordings, in handoff mode) and exits once they have.
 
     This function currently runs indefinitely.
 
     :param config_conf: dictionary containing the contents of a config.yml file
     :param streamers_file: path to the streamers.yml file
+    :param upload_queue: queue to send upload requests to the rclone watcher on, None if rclone is disabled
+    :param probe_configs: enabled probe plugins (probes section of config.yml)
+    :param compiler: ConfigCompiler for streamers.yml, its upload specs are sent to the rclone watcher on upload_queue
+    :param priorities: priority classes (see saa.priority) for the archivers, the pipeline and the plugins
     :return:
     """
     active = True
+    priorities = priorities or {}
     current_proc = {}  # keys are the keys of streamers
     first_run = True
     no_streams = False
     disabled_jobs = []
 
+    profiling.install_profiling_handlers(utils.try_get(config_conf, lambda x: x['profile_directory'], str))
+    instrumentation.enable(utils.try_get(config_conf, lambda x: x['instrumentation'], bool))
+
+    def handoff_handler(sig, frame):
+        if multiprocessing.current_process().name != "StreamWatcher":
+            return
+        log.info("Received SIGHUP, handing off to the next SAA.")
+        for proc in current_proc.values():
+            if proc['process'].is_alive():
+                os.kill(proc['process'].pid, signal.SIGHUP)
+        deadline = time.time() + HANDOFF_JOIN_TIMEOUT
+        for proc in current_proc.values():
+            proc['process'].join(max(deadline - time.time(), 0))
+            if proc['process'].is_alive():
+                log.warning(f"{proc['process'].name} did not exit in time, terminating.")
+                proc['process'].terminate()
+        sys.exit(0)
+
+    signal.signal(signal.SIGHUP, handoff_handler)
+
+    control_state = ControlState(upload_queue)
+    control_state.processes = current_proc
+    start_control_server(control_state,
+                         socket_path=utils.try_get(config_conf, lambda x: x['control_socket'], str),
+                         port=utils.try_get(config_conf, lambda x: x['control_port'], int),
+                         token=utils.try_get(config_conf, lambda x: x['control_token'], str))
+
+    # Archivers are started from a forkserver by default (see saa.workers), start it before any are needed
+    worker_context = workers.get_context(utils.try_get(config_conf, lambda x: x['worker_start_method'], str))
+    workers.start_forkserver(worker_context)
+
     # Launch any plugins, if enabled.
     if plugin_configs != {}:
-        master_reporting_queue = multiprocessing.Queue()
-        launch_reporting_plugins(master_reporting_queue, plugin_configs)
+        master_reporting_queue = worker_context.Queue()
+        control_state.plugins = launch_reporting_plugins(master_reporting_queue, plugin_configs,
+                                                         priorities.get(priority_module.CLASS_PLUGINS))
     else:
         master_reporting_queue = None
         log.debug("No plugins enabled.")
 
+    # Launch any probe plugins, if enabled.
+    if probe_configs:
+        launch_probe_plugins(probe_configs, current_proc, priorities.get(priority_module.CLASS_PLUGINS))
+
+    capacity = utils.try_get(config_conf, lambda x: x['capacity'], dict)
+    admission = AdmissionController(capacity, current_proc, master_reporting_queue) if capacity else None
+
+    cluster_conf = utils.try_get(config_conf, lambda x: x['cluster'], dict)
+    cluster = None
+    if cluster_conf:
+        cluster = ClusterMember(SqliteLeaseStore(cluster_conf['store']),
+                                node_id=cluster_conf.get('node_id'),
+                                capacity=cluster_conf.get('capacity') or (capacity or {}).get('max_recordings') or 1,
+                                lease_ttl=cluster_conf.get('lease_ttl') or CLUSTER_LEASE_TTL)
+        log.info(f"Cluster mode, node {cluster.node_id} (capacity {cluster.capacity:g}) using {cluster_conf['store']}")
+    not_owned = set()
+
+    pipeline_conf = utils.try_get(config_conf, lambda x: x['pipeline'], dict) or {}
+    pipeline_queue = None
+    pipeline_proc = None
+
+    if compiler is None:
+        compiler = ConfigCompiler(streamers_file, config_conf)
+    uploads_fingerprint = None
+
     while active:
 
-        # Load the streams
-        with open(streamers_file) as f:
-            streamers = yaml.load(f, Loader=yaml.FullLoader)['streamers'] or {}
+        # Load the streams, only parsed if streamers.yml or the control API changes have changed
+        compiled = compiler.compile(control_state.apply, control_state.version)
+        if upload_queue is not None and compiled.fingerprints['uploads'] != uploads_fingerprint:
+            upload_queue.put({'action': 'specs', 'uploads': compiled.uploads})
+            uploads_fingerprint = compiled.fingerprints['uploads']
 
-        # create the jobs
-        jobs = create_jobs(config_conf, streamers)
+        jobs = dict(compiled.jobs)
 
         # remove any disabled streams
         for j in jobs:
-            if jobs[j]['enabled'] is False:
+            if not jobs[j].enabled:
                 if j not in disabled_jobs:
                     disabled_jobs.append(j)
                     log.info(f'{j} has been disabled.')
@@ -109,6 +151,14 @@ def streamers_watcher(config_conf: dict, streamers_file: str, plugin_configs: di
         for disabled in disabled_jobs:
             jobs.pop(disabled)
 
+        # only keep the streamers this node has a lease on
+        if cluster is not None:
+            recording = {k for k, p in current_proc.items() if p['process'].is_alive() and p['control'].state()['is_live']}
+            owned = cluster.update(jobs.keys(), recording)
+            not_owned = set(jobs.keys()) - owned
+            for key in not_owned:
+                jobs.pop(key)
+
         if first_run:
             if len(jobs) > 0:
                 log.info(f"Adding {len(jobs)} streams")
@@ -125,17 +175,28 @@ def streamers_watcher(config_conf: dict, streamers_file: str, plugin_configs: di
         for remove in removed:
             if remove in disabled_jobs:
                 log.info(f"{remove} has been disabled, terminating.")
+            elif remove in not_owned:
+                log.info(f"{remove} is no longer owned by this node, terminating.")
             else:
                 log.info(f"{remove} has been removed from the config file, terminating.")
             current_proc[remove]['process'].terminate()
             current_proc.pop(remove)
 
+        # (Re)start the post-processing pipeline whenever a streamer has one, before any archivers that send to it
+        if any(spec.config.get('pipeline') for spec in jobs.values()):
+            pipeline_queue = pipeline_queue or worker_context.Queue()
+            pipeline_proc = workers.ensure_pipeline(worker_context, pipeline_proc, pipeline_queue, {
+                'workers': pipeline_conf.get('workers') or PIPELINE_WORKERS,
+                'priority': priorities.get(priority_module.CLASS_PROCESSING),
+                'profile_directory': utils.try_get(config_conf, lambda x: x['profile_directory'], str),
+                'enable_instrumentation': bool(utils.try_get(config_conf, lambda x: x['instrumentation'], bool))})
+
         for j in jobs:
 
-            j_inner = jobs[j]
+            spec = jobs[j]
             if j in current_proc:
                 # check if hash is different
-                if current_proc[j]['config_hash'] == utils.hash_dict(j_inner):
+                if current_proc[j]['config_hash'] == spec.fingerprint:
                     # Check if the process is still running
                     if current_proc[j]['process'].is_alive():
                         # Skip if stream is already added and no config has changed, and is alive
@@ -148,18 +209,24 @@ def streamers_watcher(config_conf: dict, streamers_file: str, plugin_configs: di
                     current_proc[j]['process'].terminate()
             else:
                 if not first_run:
-                    log.info(f"Adding new stream: {j_inner['name']}")
+                    log.info(f"Adding new stream: {spec.name}")
 
             # create a process
-            process = multiprocessing.Process(target=archiver.worker, args=(master_reporting_queue,), kwargs=j_inner,
-                                              name=j_inner['name'])
-            current_proc[j] = {'process': process, 'config_hash': utils.hash_dict(j_inner)}
-            process.start()
+            control = ArchiverControl(worker_context)
+            process = workers.start_worker(worker_context, spec.name, spec.as_kwargs(), master_reporting_queue, control,
+                                           pipeline_queue, priorities.get(priority_module.CLASS_RECORDING))
+            current_proc[j] = {'process': process, 'config': spec.config, 'config_hash': spec.fingerprint,
+                               'control': control}
 
             if no_streams:
                 no_streams = False
 
-        sleep(STREAMERS_WATCHER_DEFAULT_SLEEP)
+        if admission is not None:
+            admission.step()
+
+        # Sleep until the next check, or until there is a change from the control API
+        control_state.wake.wait(STREAMERS_WATCHER_DEFAULT_SLEEP)
+        control_state.wake.clear()
 
 
 def main():
@@ -178,16 +245,30 @@ def main():
         config_rclone = utils.try_get(d, lambda x: x['rclone']) or {}
         # TODO: Sort plugins by type. For now assuming all are status
         config_plugins = utils.try_get(d, lambda x: x['plugins']) or {}
+        config_probes = utils.try_get(d, lambda x: x['probes']) or {}
     # Configure logging
     global log
     log = logging.getLogger('root')
     log_level = utils.try_get(config, lambda x: x['log_level'], str) or LOG_LEVEL_DEFAULT
-    log.addHandler(utils.LoggingHandler())
     log.setLevel(log_level)
+    # All processes log through the log writer process, which is the only one writing to stderr/the log file
+    logwriter.start_log_writer(config, log,
+                               workers.get_context(utils.try_get(config, lambda x: x['worker_start_method'], str)))
     log.debug(f"general config: {config}")
     log.debug(f"rclone config: {config_rclone}")
 
-    stream_proc = multiprocessing.Process(target=streamers_watcher, args=(config, STREAMERS_FILE, config_plugins),
+    # CPU and IO priorities of the recordings, uploads, post-processing and plugins (see saa.priority)
+    priorities = priority_module.load_classes(config)
+    priority_module.setup_cgroups(priorities)
+    log.info("Priority classes: " + "; ".join(repr(c) for c in priorities.values()))
+
+    # The control API sends upload requests to the rclone watcher on this
+    upload_queue = multiprocessing.Queue() if not args.disable_rclone else None
+    # streamers.yml is compiled by the StreamWatcher, which sends the upload specs on to the rclone watcher
+    compiler = ConfigCompiler(STREAMERS_FILE, config, config_rclone if not args.disable_rclone else None)
+    stream_proc = multiprocessing.Process(target=streamers_watcher,
+                                          args=(config, STREAMERS_FILE, config_plugins, upload_queue, config_probes,
+                                                compiler, priorities),
                                           name="StreamWatcher")
     stream_proc.start()
 
@@ -198,7 +279,24 @@ def main():
         rclone_delay = utils.try_get(config_rclone, lambda x: x['sleep_interval'],
                                      expected_type=int) or RCLONE_PROCESS_REPEAT_TIME
         rclone_proc = multiprocessing.Process(target=rclone.rclone_watcher,
-                                              args=(config_rclone, STREAMERS_FILE, rclone_delay), name="rcloneWatcher")
+                                              args=(config_rclone, STREAMERS_FILE, rclone_delay,
+                                                    utils.try_get(config, lambda x: x['profile_directory'], str),
+                                                    utils.try_get(config, lambda x: x['instrumentation'], bool),
+                                                    utils.try_get(config, lambda x: x['volumes'], list),
+                                                    upload_queue,
+                                                    priorities.get(priority_module.CLASS_UPLOAD)),
+                                              name="rcloneWatcher")
         rclone_proc.start()
+    else:
+        rclone_proc = None
+
+    def handoff_handler(sig, frame):
+        # Recordings are handed off by the StreamWatcher, rclone is simply stopped (the next SAA uploads what is left)
+        log.info("Received SIGHUP, exiting once the recordings have been handed off.")
+        os.kill(stream_proc.pid, signal.SIGHUP)
+        if rclone_proc is not None:
+            rclone_proc.terminate()
+
+    signal.signal(signal.SIGHUP, handoff_handler)
 
     stream_proc.join()
@@ -0,0 +1,278 @@
+"""
+Config compiler, shared by the StreamWatcher and the rclone watcher.
+
+streamers.yml is only parsed, and each streamer's settings resolved (with the config.yml and rclone defaults) and
+validated, when it changes, rather than every loop. The result is immutable specs:
+
+    StreamerSpec  - an archiver's settings, what StreamArchiver is created with
+    UploadSpec    - one rclone task, a directory to transfer (a streamer with a volume pool has one per volume)
+
+Each spec, and each section (all the streamers, all the uploads), has a fingerprint, a hash of its settings, so a change
+can be spotted without comparing settings. With rclone enabled, the StreamWatcher sends the upload specs to the
+rclone watcher whenever the uploads fingerprint changes, so the rclone watcher does not parse streamers.yml itself.
+"""
+from types import MappingProxyType
+import logging
+import os
+import yaml
+import saa.utils as utils
+import saa.instrumentation as instrumentation
+from saa.volumes import volume_directories
+from saa.const import (
+
+    STREAMLINK_BINARY,
+    STREAMERS_REQUIRED_FIELDS,
+    RCLONE_BIN_LOCATION,
+    RCLONE_CONFIG_LOCATION,
+    RCLONE_DEFAULT_TRANSFERS,
+    RCLONE_DEFAULT_OPERATION,
+    DEFAULT_DOWNLOAD_DIR
+
+)
+
+log = logging.getLogger('root')
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def _thaw(value):
+    if isinstance(value, MappingProxyType):
+        return {k: _thaw(v) for k, v in value.items()}
+    if isinstance(value, tuple):
+        return [_thaw(v) for v in value]
+    return value
+
+
+class Spec:
+    """
+    Immutable settings, with a fingerprint of them.
+    Specs are pickled (e.g. sent over a queue) as their settings, and rebuilt on the other side.
+    """
+    __slots__ = ("key", "config", "fingerprint")
+
+    def __init__(self, key, config: dict):
+        object.__setattr__(self, "key", key)
+        object.__setattr__(self, "config", _freeze(config))
+        object.__setattr__(self, "fingerprint", utils.hash_dict(config))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{self.__class__.__name__} is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{self.__class__.__name__} is immutable")
+
+    def __reduce__(self):
+        return self.__class__, (self.key, self.as_kwargs())
+
+    def __eq__(self, other):
+        return isinstance(other, self.__class__) and (self.key, self.fingerprint) == (other.key, other.fingerprint)
+
+    def __hash__(self):
+        return hash((self.key, self.fingerprint))
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.key!r}, {self.fingerprint})"
+
+    def as_kwargs(self):
+        """
+        :return: a (mutable) copy of the settings, e.g. to pass to a process
+        """
+        return _thaw(self.config)
+
+
+class StreamerSpec(Spec):
+    __slots__ = ()
+
+    @property
+    def name(self):
+        return self.config['name']
+
+    @property
+    def enabled(self):
+        return self.config['enabled'] is not False
+
+
+class UploadSpec(Spec):
+    __slots__ = ()
+
+    @property
+    def streamer(self):
+        return self.config['streamer']
+
+
+class CompiledConfig:
+    __slots__ = ("streamers", "jobs", "uploads", "fingerprints")
+
+    def __init__(self, streamers: dict, jobs: dict, uploads: tuple):
+        """
+        :param streamers: the streamers section, as loaded (with any control API changes)
+        :param jobs: key: StreamerSpec, of the valid streamers
+        :param uploads: UploadSpecs
+        """
+        self.streamers = streamers
+        self.jobs = jobs
+        self.uploads = uploads
+        self.fingerprints = {'streamers': utils.hash_dict({k: s.fingerprint for k, s in jobs.items()}),
+                             'uploads': utils.hash_dict({'uploads': [u.fingerprint for u in uploads]})}
+
+
+@instrumentation.timed("create_jobs")
+def create_jobs(config_conf: dict, streamers_conf: dict):
+    """
+
+    Parses the configs to create a dict that can be sent to archiver.py, and jobs
+    :return:
+    """
+    jobs = {}
+    for stream in streamers_conf:
+        skip = False
+        # create a copy, we are just editing a few values
+        stream_job = streamers_conf[stream].copy()
+
+        # check required fields
+        for r in STREAMERS_REQUIRED_FIELDS:
+            if r not in stream_job.keys():
+                log.critical(f"[{stream}] {r} is a required value. Skipping job builder for this streamer..")
+                skip = True
+                break
+            else:
+                if not isinstance(stream_job[r], STREAMERS_REQUIRED_FIELDS[r]):
+                    log.critical((f"[{stream}] {r} needs to be a {STREAMERS_REQUIRED_FIELDS[r].__name__},"
+                                  f" currently it is {type(stream_job[r]).__name__}."
+                                  f" Skipping job builder for this streamer."))
+                    skip = True
+                    break
+        if 'name' not in stream_job.keys():
+            stream_job['name'] = stream
+
+        if 'enabled' not in stream_job.keys():
+            stream_job['enabled'] = True
+        stream_job['make_dirs'] = bool(
+            utils.try_get(src=config_conf, getter=lambda x: x['make_dirs'], expected_type=bool)) or True
+        stream_job['streamlink_bin'] = utils.try_get(src=config_conf, getter=lambda x: x['streamlink_bin'],
+                                                     expected_type=str) or STREAMLINK_BINARY
+        stream_job['profile_directory'] = utils.try_get(config_conf, lambda x: x['profile_directory'], str)
+        stream_job['enable_instrumentation'] = bool(utils.try_get(config_conf, lambda x: x['instrumentation'], bool))
+        # The volume pool in config.yml applies to all streamers, unless a streamer has its own
+        if 'volumes' not in stream_job.keys():
+            stream_job['volumes'] = utils.try_get(config_conf, lambda x: x['volumes'], list)
+        if 'volume_min_free' not in stream_job.keys():
+            stream_job['volume_min_free'] = utils.try_get(config_conf, lambda x: x['volume_min_free'], int)
+        # So do the retention budgets in config.yml (see saa.retention)
+        if 'retention' not in stream_job.keys():
+            stream_job['retention'] = utils.try_get(config_conf, lambda x: x['retention'], dict)
+        stream_job['handoff'] = bool(utils.try_get(config_conf, lambda x: x['handoff'], bool))
+        stream_job['admission_control'] = bool(utils.try_get(config_conf, lambda x: x['capacity'], dict))
+        stream_job['pipeline_max_backlog'] = utils.try_get(config_conf, lambda x: x['pipeline']['max_backlog'], int)
+
+        if not skip:
+            jobs[stream] = stream_job
+
+    return jobs
+
+
+@instrumentation.timed("create_tasks")
+def create_tasks(streamers_conf: dict, rclone_conf: dict, volumes=None):
+
+    tasks = []
+
+    for stream in streamers_conf:
+
+        # Check if the stream has rclone arguments to start with
+
+        rclone_stream = utils.try_get(streamers_conf[stream], lambda x: x['rclone'], expected_type=dict) or None
+
+        if rclone_stream is None:
+            log.debug(f"No rclone entry for {stream}, skipping.")
+            continue
+
+        task = {}
+        task['streamer'] = utils.try_get(streamers_conf[stream], lambda x: x['name'], expected_type=str) or stream
+        task['operation'] = utils.try_get(rclone_stream, lambda x: x['operation'], expected_type=str) or utils.try_get(rclone_conf, lambda x:x['default_operation'], expected_type=str) or RCLONE_DEFAULT_OPERATION
+        task['remote_dir'] = utils.try_get(rclone_stream, lambda x: x['remote_dir'], expected_type=str) or None
+
+        if task['remote_dir'] is None:
+            log.critical(f"[{stream}] remote_dir is a required argument. Skipping.")
+
+        task['rclone_args'] = utils.try_get(rclone_stream, lambda x: x['rclone_args'], expected_type=list) or []
+        task['rclone_bin'] = utils.try_get(rclone_stream, lambda x: x['rclone_bin'], expected_type=str) or utils.try_get(
+            rclone_conf, lambda x: x['rclone_bin'], expected_type=str) or RCLONE_BIN_LOCATION
+
+        # The same default as the archiver's, rather than the working directory itself
+        task['source_dir'] = utils.try_get(streamers_conf[stream], lambda x: x['download_directory'], expected_type=str) or os.path.join(DEFAULT_DOWNLOAD_DIR, task['streamer'])
+
+        task['rclone_config'] = utils.try_get(rclone_stream, lambda x: x['config'], expected_type=str) or utils.try_get(rclone_conf, lambda x: x['config'], expected_type=str) or RCLONE_CONFIG_LOCATION
+
+        task['transfers'] = utils.try_get(rclone_stream, lambda x: x['transfers'], expected_type=int) or utils.try_get(
+            rclone_conf, lambda x: x['transfers'], expected_type=int) or RCLONE_DEFAULT_TRANSFERS
+
+        task['checksum'] = utils.try_get(streamers_conf[stream], lambda x: x['checksum'], expected_type=str)
+        task['verify_checksum'] = bool(utils.try_get(rclone_stream, lambda x: x['verify_checksum'], expected_type=bool))
+
+        # With a volume pool, the streamer's chunks are spread over its directory on each volume
+        stream_volumes = utils.try_get(streamers_conf[stream], lambda x: x['volumes'], expected_type=list) or volumes
+        if stream_volumes:
+            for directory in volume_directories(stream_volumes, task['streamer']):
+                tasks.append({**task, 'source_dir': directory})
+            continue
+
+        tasks.append(task)
+    log.debug(tasks)
+    return tasks
+
+
+def create_upload_specs(streamers_conf: dict, rclone_conf: dict, volumes=None):
+    """
+    :return: tuple of UploadSpecs, see create_tasks
+    """
+    return tuple(UploadSpec(task['source_dir'], task) for task in create_tasks(streamers_conf, rclone_conf, volumes))
+
+
+class ConfigCompiler:
+
+    def __init__(self, streamers_file: str, config_conf: dict = None, rclone_conf: dict = None):
+        """
+        :param streamers_file: path to the streamers.yml file
+        :param config_conf: config section of config.yml
+        :param rclone_conf: rclone section of config.yml, None to not build upload specs
+        """
+        self.streamers_file = streamers_file
+        self.config_conf = config_conf or {}
+        self.rclone_conf = rclone_conf
+        self._stamp = None
+        self._compiled = None
+
+    def _file_stamp(self):
+        st = os.stat(self.streamers_file)
+        return st.st_ino, st.st_size, st.st_mtime_ns
+
+    def compile(self, overlay=None, overlay_version=None):
+        """
+        Load and compile streamers.yml, if it (or the overlay) has changed since the last time.
+        :param overlay: function applied to the streamers loaded from streamers.yml, e.g. ControlState.apply
+        :param overlay_version: changes whenever the overlay would give a different result
+        :return: CompiledConfig, the same one as last time if nothing has changed
+        """
+        stamp = (self._file_stamp(), overlay_version)
+        if self._compiled is not None and stamp == self._stamp:
+            return self._compiled
+
+        with open(self.streamers_file) as f:
+            streamers = yaml.load(f, Loader=yaml.FullLoader)['streamers'] or {}
+        if overlay is not None:
+            streamers = overlay(streamers)
+
+        jobs = {key: StreamerSpec(key, job) for key, job in create_jobs(self.config_conf, streamers).items()}
+        uploads = ()
+        if self.rclone_conf is not None:
+            uploads = create_upload_specs(streamers, self.rclone_conf,
+                                          utils.try_get(self.config_conf, lambda x: x['volumes'], list))
+        self._compiled = CompiledConfig(streamers, jobs, uploads)
+        self._stamp = stamp
+        return self._compiled
@@ -0,0 +1,64 @@
+"""
+Classifier for Streamlink's log output.
+
+Streamlink logs each line as "[<module>][<level>] <message>" (its default log format, the same in every version), and
+the error it exits with as "error: <message>". It has no machine-readable log format, so each line is matched once
+against a precompiled pattern, and only error, warning and info messages are then checked for the events the stream
+watchdog acts on:
+
+    segment_error           - a segment could not be downloaded (Streamlink skips it)
+    playlist_reload_failed  - the HLS playlist could not be reloaded (the stream may have ended)
+    stream_ended            - Streamlink has finished the stream, and is exiting
+    no_streams              - the stream is not live (any more)
+    error                   - any other error
+    log                     - anything else (debug output, the output file name, ...)
+"""
+from collections import namedtuple
+import re
+
+EVENT_SEGMENT_ERROR = "segment_error"
+EVENT_PLAYLIST_RELOAD_FAILED = "playlist_reload_failed"
+EVENT_STREAM_ENDED = "stream_ended"
+EVENT_NO_STREAMS = "no_streams"
+EVENT_ERROR = "error"
+EVENT_LOG = "log"
+
+# Events counted in the streamer's reported metrics
+COUNTED_EVENTS = (EVENT_SEGMENT_ERROR, EVENT_PLAYLIST_RELOAD_FAILED, EVENT_STREAM_ENDED)
+
+StreamlinkLine = namedtuple("StreamlinkLine", ("event", "module", "level", "message"))
+
+LINE_RE = re.compile(r"\[(?P<module>[\w.\-]+)\]\[(?P<level>\w+)\] ?(?P<message>.*)")
+EXIT_ERROR_RE = re.compile(r"error: (?P<message>.*)")
+# One pass over the message, the name of the group that matched is the event
+MESSAGE_RE = re.compile(r"(?P<segment_error>^Failed to (?:open|fetch|download|write) segment)"
+                        r"|(?P<playlist_reload_failed>^Failed to reload playlist)"
+                        r"|(?P<stream_ended>^Stream ended)"
+                        r"|(?P<no_streams>No playable streams found)", re.IGNORECASE)
+
+# Levels never checked for events
+VERBOSE_LEVELS = frozenset(("debug", "trace", "all"))
+ERROR_LEVELS = frozenset(("error", "critical"))
+
+
+def classify(line: str) -> StreamlinkLine:
+    """
+    :param line: a line of Streamlink's output
+    :return: StreamlinkLine(event, module, level, message), module and level are None if it is not a log line
+    """
+    line = line.rstrip()
+    match = LINE_RE.match(line)
+    if match is not None:
+        module, level, message = match.group("module", "level", "message")
+    else:
+        match = EXIT_ERROR_RE.match(line)
+        if match is None:
+            return StreamlinkLine(EVENT_LOG, None, None, line)
+        module, level, message = "cli", "error", match.group("message")
+
+    if level in VERBOSE_LEVELS:
+        return StreamlinkLine(EVENT_LOG, module, level, message)
+    match = MESSAGE_RE.search(message)
+    if match is not None:
+        return StreamlinkLine(match.lastgroup, module, level, message)
+    return StreamlinkLine(EVENT_ERROR if level in ERROR_LEVELS else EVENT_LOG, module, level, message)
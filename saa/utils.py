@@ -1,8 +1,8 @@
 from datetime import datetime
 from saa.const import TIME_NICE_FORMAT
+import saa.instrumentation as instrumentation
 import logging
 import json
-from time import time
 import hashlib
 from string import ascii_letters, digits
 
@@ -48,17 +48,13 @@ def is_alive_safe(proc):
 
 def time_test(func):
     """
-    Decorator to time a function
+    Decorator to time a function, recorded as a span named after the function.
+    See saa.instrumentation.
     """
-    def inner(*args, **kwargs):
-        s = time()
-        o = func(*args, **kwargs)
-        e = time()
-        print(f"{func.__name__} took {e-s}.")
-        return o
-    return inner
+    return instrumentation.timed(func.__name__)(func)
 
 
+@instrumentation.timed("hash_dict")
 def hash_dict(data: dict):
     """
 
@@ -0,0 +1,108 @@
+"""
+Download placement across a pool of volumes.
+
+With volumes set in config.yml, each streamer gets a directory on every volume (<volume>/<streamer name>),
+and each chunk is placed on one of them when it starts. The least loaded volume is picked:
+
+    1. volumes with less than VOLUME_MIN_FREE_BYTES free are skipped (unless they all are)
+    2. the volume with the least recent write throughput (rounded to VOLUME_THROUGHPUT_BUCKET, so similar loads tie)
+    3. the volume with the most free space
+
+Write throughput is per block device, from /proc/diskstats, so it counts writes from everything on the host,
+not just this streamer. It is averaged since the previous placement. Where /proc/diskstats is not available
+(or the device is not in it), only free space is used.
+"""
+import logging
+import shutil
+import time
+import os
+
+from saa.const import VOLUME_MIN_FREE_BYTES, VOLUME_THROUGHPUT_BUCKET
+
+log = logging.getLogger('root')
+
+DISKSTATS_PATH = "/proc/diskstats"
+SECTOR_SIZE = 512
+
+
+def volume_directories(volumes: list, streamer_name: str):
+    """
+    :return: the streamer's download directory on each volume
+    """
+    return [os.path.join(str(v), streamer_name) for v in volumes]
+
+
+def device_of(directory):
+    """
+    :return: (major, minor) of the block device the directory is on
+    """
+    st = os.stat(directory)
+    return os.major(st.st_dev), os.minor(st.st_dev)
+
+
+def read_sectors_written():
+    """
+    :return: dict of {(major, minor): sectors written}, empty if /proc/diskstats is not available
+    """
+    sectors = {}
+    try:
+        with open(DISKSTATS_PATH) as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 10:
+                    continue
+                sectors[(int(fields[0]), int(fields[1]))] = int(fields[9])
+    except (OSError, ValueError):
+        return {}
+    return sectors
+
+
+class VolumePool:
+
+    def __init__(self, directories: list, min_free=VOLUME_MIN_FREE_BYTES):
+        """
+        :param directories: directories (one per volume) to place chunks in, they must exist
+        :param min_free: bytes a volume needs free for chunks to be placed on it
+        """
+        self.directories = list(directories)
+        self.min_free = min_free
+        self._last_sample = None  # (time, {device: sectors written})
+
+    def _write_rates(self):
+        """
+        :return: dict of {device: bytes written per second} since the last call
+        """
+        now, sectors = time.monotonic(), read_sectors_written()
+        last, self._last_sample = self._last_sample, (now, sectors)
+        if last is None or now <= last[0]:
+            return {}
+        return {device: (count - last[1][device]) * SECTOR_SIZE / (now - last[0])
+                for device, count in sectors.items() if device in last[1]}
+
+    def stats(self):
+        """
+        :return: list of (directory, free bytes, write bytes per second), for the volumes that can be read
+        """
+        rates = self._write_rates()
+        stats = []
+        for directory in self.directories:
+            try:
+                free = shutil.disk_usage(directory).free
+                rate = rates.get(device_of(directory), 0.0)
+            except OSError as e:
+                log.warning(f"Could not read volume {directory}, skipping it: {e}")
+                continue
+            stats.append((directory, free, rate))
+        return stats
+
+    def choose(self):
+        """
+        :return: the directory to place the next chunk in, None if no volume could be read
+        """
+        stats = self.stats()
+        if not stats:
+            return None
+        candidates = [s for s in stats if s[1] >= self.min_free] or stats
+        directory, free, rate = min(candidates, key=lambda s: (int(s[2] // VOLUME_THROUGHPUT_BUCKET), -s[1]))
+        log.debug(f"Placing chunk on {directory} ({free / 2**30:.1f}GiB free, writing {rate / 2**20:.1f}MiB/s)")
+        return directory
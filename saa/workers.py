@@ -0,0 +1,114 @@
+"""
+Starting archiver worker processes.
+
+By default archivers are started from a forkserver: a process started once, with saa.archiver and the rest of what an
+archiver needs already imported, that forks a new worker from itself for each archiver. Workers are then not forked
+from the StreamWatcher, so they do not inherit its threads (control API, probe plugins, queue feeders), the locks
+those could be holding, or its open files and connections (e.g. the cluster store).
+
+Everything passed to a worker is pickled, so the queues it uses (the log queue, the reporting queue, its
+ArchiverControl) have to be created from the worker context. Workers do not inherit the logging setup either,
+they log through the log writer's queue (see saa.logwriter) themselves.
+
+worker_start_method in config.yml can be set to "fork" to fork workers from the StreamWatcher as before.
+The post-processing pipeline process (see saa.pipeline) is started the same way.
+Each worker applies its priority class (see saa.priority) to itself when it starts.
+"""
+from multiprocessing import forkserver
+import multiprocessing
+import logging
+
+import saa.archiver as archiver
+import saa.pipeline as pipeline
+import saa.logwriter as logwriter
+import saa.priority as priority_module
+import saa.utils as utils
+from saa.const import WORKER_START_METHOD, WORKER_PRELOAD_MODULES
+
+log = logging.getLogger('root')
+
+
+def get_context(start_method=None):
+    """
+    :param start_method: multiprocessing start method, default WORKER_START_METHOD
+    :return: multiprocessing context to start workers (and create the queues they use) with
+    """
+    start_method = start_method or WORKER_START_METHOD
+    if start_method not in multiprocessing.get_all_start_methods():
+        log.warning(f"Start method {start_method} is not available, using {multiprocessing.get_start_method()}.")
+        return multiprocessing.get_context()
+    context = multiprocessing.get_context(start_method)
+    if start_method == "forkserver":
+        context.set_forkserver_preload(list(WORKER_PRELOAD_MODULES))
+    return context
+
+
+def start_forkserver(context):
+    """
+    Start the forkserver now (if the context uses one), rather than when the first worker is started.
+    """
+    if context.get_start_method() == "forkserver":
+        forkserver.ensure_running()
+
+
+def _init_logging(log_queue, log_level):
+    logger = logging.getLogger('root')
+    if log_queue is not None:
+        logwriter.install_queue_handler(logger, log_queue)
+    elif not logger.handlers:
+        logger.addHandler(utils.LoggingHandler())
+    logger.setLevel(log_level)
+
+
+def _run_worker(log_queue, log_level, master_reporting_queue, control, kwargs, pipeline_queue=None, priority=None):
+    _init_logging(log_queue, log_level)
+    priority_module.apply_and_log(priority, logging.DEBUG)
+    archiver.worker(master_reporting_queue, control, pipeline_queue, **kwargs)
+
+
+def _run_pipeline(log_queue, log_level, request_queue, kwargs):
+    _init_logging(log_queue, log_level)
+    pipeline.pipeline_worker(request_queue, **kwargs)
+
+
+def start_worker(context, name: str, kwargs: dict, master_reporting_queue=None, control=None, pipeline_queue=None,
+                 priority=None):
+    """
+    Start an archiver process.
+    :param context: from get_context
+    :param name: process name, the streamer's name
+    :param kwargs: StreamArchiver arguments
+    :param pipeline_queue: queue to the post-processing pipeline process, None if it is not running
+    :param priority: PriorityClass to record with (see saa.priority), None to leave it
+    :return: the started process
+    """
+    process = context.Process(target=_run_worker, args=(logwriter.log_queue(), log.level, master_reporting_queue,
+                                                        control, kwargs, pipeline_queue, priority), name=name)
+    process.start()
+    return process
+
+
+def start_pipeline(context, request_queue, kwargs: dict):
+    """
+    Start the post-processing pipeline process, it exits along with the StreamWatcher.
+    :param kwargs: pipeline_worker arguments
+    :return: the started process
+    """
+    process = context.Process(target=_run_pipeline, args=(logwriter.log_queue(), log.level, request_queue, kwargs),
+                              name="Pipeline", daemon=True)
+    process.start()
+    return process
+
+
+def ensure_pipeline(context, process, request_queue, kwargs: dict):
+    """
+    Start the post-processing pipeline process if it is not running, restarting it if it has died.
+    :param process: the pipeline process started before, None if it has not been started
+    :param kwargs: pipeline_worker arguments
+    :return: the running pipeline process
+    """
+    if process is not None and process.is_alive():
+        return process
+    if process is not None:
+        log.error(f"The post-processing pipeline has crashed (exit code {process.exitcode}), restarting...")
+    return start_pipeline(context, request_queue, kwargs)
@@ -0,0 +1,160 @@
+"""
+SAA-owned write path for chunk files.
+
+Rather than Streamlink writing the chunk itself (-o), Streamlink writes the stream to stdout and a ChunkWriter
+copies it to the chunk file. This is used when a streamer has any of:
+
+- checksum          - hash the chunk as it is written (see saa.checksum)
+- expected_bitrate  - preallocate expected_bitrate / 8 * split_time bytes for the chunk, so it is laid out contiguously
+                      rather than fragmenting with many chunks being written in parallel. The space is reserved past the
+                      end of the file (FALLOC_FL_KEEP_SIZE), so the file size is always what has been written, and any
+                      unused reservation is released when the chunk finishes.
+- write_buffer_size - write to the file in blocks of this many bytes, rather than as Streamlink outputs it
+- drop_page_cache   - periodically flush what has been written and tell the kernel it won't be read again soon
+                      (posix_fadvise DONTNEED), so recordings don't evict everything else from the page cache
+
+Preallocation needs Linux (fallocate), and is skipped where it is not available or the filesystem does not support it.
+"""
+import threading
+import ctypes
+import ctypes.util
+import logging
+import os
+
+from saa.checksum import new_hasher
+from saa.const import CHUNK_WRITER_READ_SIZE, CHUNK_WRITER_DROP_CACHE_INTERVAL
+
+log = logging.getLogger('root')
+
+FALLOC_FL_KEEP_SIZE = 0x01
+
+_fallocate = None
+
+
+def _load_fallocate():
+    """
+    :return: libc fallocate, or None if not available
+    """
+    global _fallocate
+    if _fallocate is None:
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            func = getattr(libc, "fallocate64", None) or libc.fallocate
+        except (OSError, AttributeError):
+            _fallocate = False
+            return None
+        func.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64]
+        func.restype = ctypes.c_int
+        _fallocate = func
+    return _fallocate or None
+
+
+def preallocate(fd, length):
+    """
+    Reserve length bytes for a file, without changing its size.
+    :return: True if preallocated, False if not supported
+    """
+    func = _load_fallocate()
+    if func is None:
+        return False
+    if func(fd, FALLOC_FL_KEEP_SIZE, 0, length) != 0:
+        errno = ctypes.get_errno()
+        log.debug(f"Could not preallocate {length} bytes: {os.strerror(errno)}")
+        return False
+    return True
+
+
+def drop_page_cache(fd, length):
+    """
+    Flush the first length bytes of a file and drop them from the page cache.
+    """
+    os.fdatasync(fd)
+    if hasattr(os, "posix_fadvise"):
+        os.posix_fadvise(fd, 0, length, os.POSIX_FADV_DONTNEED)
+
+
+class ChunkWriter:
+    """
+    Copies a stream (e.g. Streamlink's stdout) to a file in a separate thread,
+    counting (and optionally hashing) the bytes as they are written.
+    """
+
+    def __init__(self, source, path: str, algorithm: str = None, read_size=CHUNK_WRITER_READ_SIZE,
+                 buffer_size=None, preallocate_bytes=0, drop_cache=False):
+        """
+        :param source: file object to read from, must have read1 (e.g. Popen.stdout)
+        :param algorithm: checksum algorithm, None to not hash
+        :param buffer_size: bytes to buffer before writing to the file, None for read_size
+        :param preallocate_bytes: bytes to preallocate for the file, 0 to not preallocate
+        :param drop_cache: drop what has been written from the page cache as it goes
+        """
+        self.source = source
+        self.path = path
+        self.algorithm = algorithm
+        self.read_size = read_size
+        self.buffer_size = buffer_size or read_size
+        self.preallocate_bytes = preallocate_bytes
+        self.drop_cache = drop_cache
+        self.bytes_written = 0
+        self._hasher = new_hasher(algorithm) if algorithm else None
+        self._preallocated = False
+        self._dropped = 0  # bytes dropped from the page cache so far
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._error = None
+
+    def start(self):
+        self._thread.start()
+
+    def _open(self):
+        f = open(self.path, "wb", buffering=self.buffer_size)
+        if self.preallocate_bytes > 0:
+            self._preallocated = preallocate(f.fileno(), self.preallocate_bytes)
+        return f
+
+    def _run(self):
+        f = None
+        try:
+            while True:
+                data = self.source.read1(self.read_size)
+                if not data:
+                    break
+                # Like Streamlink, only create the file once there is something to write
+                if f is None:
+                    f = self._open()
+                f.write(data)
+                if self._hasher is not None:
+                    self._hasher.update(data)
+                self.bytes_written += len(data)
+                if self.drop_cache and self.bytes_written - self._dropped >= CHUNK_WRITER_DROP_CACHE_INTERVAL:
+                    f.flush()
+                    drop_page_cache(f.fileno(), self.bytes_written)
+                    self._dropped = self.bytes_written
+        except (OSError, ValueError) as e:
+            self._error = e
+        finally:
+            if f is not None:
+                self._close(f)
+
+    def _close(self, f):
+        try:
+            f.flush()
+            if self._preallocated:
+                # Release the part of the reservation that was not used
+                f.truncate(self.bytes_written)
+            if self.drop_cache:
+                drop_page_cache(f.fileno(), self.bytes_written)
+        except (OSError, ValueError) as e:
+            self._error = self._error or e
+        finally:
+            f.close()
+
+    def join(self, timeout=None):
+        """
+        Wait for the source to close (i.e. Streamlink to exit).
+        :return: (hex digest, bytes written), digest is None if not hashing or writing failed
+        """
+        self._thread.join(timeout)
+        if self._error is not None or self._thread.is_alive() or self._hasher is None:
+            return None, self.bytes_written
+        return self._hasher.hexdigest(), self.bytes_written
@@ -4,7 +4,7 @@ with open('requirements.txt') as f:
     requirements = f.read().splitlines()
 
 entry_points = {
-    "console_scripts": ["saa=saa.saa:main"]
+    "console_scripts": ["saa=saa.saa:main", "saa-history=saa.history:main"]
 }
 
 setup(
@@ -12,7 +12,7 @@ setup(
     version='20240630',
     author='coletdjnz',
     author_email='coletdjnz@protonmail.com',
-    packages=['saa', 'saa.plugins', 'saa.plugins.reporting'],
+    packages=['saa', 'saa.plugins', 'saa.plugins.reporting', 'saa.plugins.probes'],
     entry_points=entry_points,
     license='LICENSE.txt',
     description='Stream Auto Archiver - Automatically archive livestreams',
@@ -0,0 +1,28 @@
+import threading
+import sys
+import os
+
+import pytest
+
+# The local stand-ins for the services SAA talks to live with the benchmarks
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+
+@pytest.fixture
+def serve():
+    """
+    Serve a stand-in server in a thread for the test.
+    :return: function taking the server, returning its base url
+    """
+    servers = []
+
+    def start(server):
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_port}"
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
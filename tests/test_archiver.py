@@ -0,0 +1,75 @@
+"""
+StreamArchiver against the stand-in Streamlink (benchmarks/bin/streamlink).
+"""
+import json
+import os
+import time
+
+import pytest
+
+from saa.archiver import StreamArchiver
+
+BENCHMARKS_BIN = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks", "bin")
+
+
+@pytest.fixture
+def streamlink_log(monkeypatch, tmp_path):
+    """
+    Put the stand-in Streamlink first on PATH.
+    :return: function returning the events it has logged
+    """
+    monkeypatch.setenv("PATH", BENCHMARKS_BIN + os.pathsep + os.environ.get("PATH", ""))
+    path = tmp_path / "streamlink.log"
+    monkeypatch.setenv("FAKE_STREAMLINK_LOG", str(path))
+
+    def events():
+        if not path.exists():
+            return []
+        return [json.loads(line) for line in path.read_text().splitlines()]
+
+    return events
+
+
+def archiver(tmp_path, duration=60, resolved_fails=False, **kwargs):
+    url = f"fake://streamer?live_at={time.time() - 1}&duration={duration}&bitrate=80000"
+    if resolved_fails:
+        url += "&resolved_fails=1"
+    return StreamArchiver(url, name="streamer", download_directory=str(tmp_path / "download"), **kwargs)
+
+
+def test_resolved_stream_off_by_default(streamlink_log, tmp_path):
+    stream_archiver = archiver(tmp_path)
+    assert stream_archiver._is_live()
+
+    assert stream_archiver._resolved_stream() is None
+
+
+def test_resolved_stream(streamlink_log, tmp_path):
+    stream_archiver = archiver(tmp_path, resolution_max_age=20)
+    assert stream_archiver._is_live()
+
+    url, quality, args = stream_archiver._resolved_stream()
+    assert url.startswith("hls://http://127.0.0.1/fake/live.m3u8?src=")
+    assert quality == "best"
+    assert args == ["--http-header", "User-Agent=fake"]
+    # Only the first chunk is downloaded from it
+    assert stream_archiver._resolved_stream() is None
+
+
+def test_resolved_stream_stale(streamlink_log, tmp_path):
+    stream_archiver = archiver(tmp_path, resolution_max_age=0.1)
+    assert stream_archiver._is_live()
+    time.sleep(0.2)
+
+    assert stream_archiver._resolved_stream() is None
+
+
+def test_failed_resolved_stream_resolved_again(streamlink_log, tmp_path):
+    stream_archiver = archiver(tmp_path, duration=3, resolved_fails=True, resolution_max_age=20)
+    os.makedirs(stream_archiver.download_directory)
+    assert stream_archiver._is_live()
+
+    # Ends with the stream, rather than when the resolved stream's download failed
+    assert stream_archiver._stream_download_handler(stream_archiver.url) == 1
+    assert [(e['event'], e.get('resolved')) for e in streamlink_log()] == [
+        ("check", None), ("fail", None), ("start", False), ("end", None)]
@@ -0,0 +1,217 @@
+"""
+Cluster mode (saa.cluster): several ClusterMembers sharing streamers through a SqliteLeaseStore.
+"""
+import sqlite3
+
+import pytest
+
+import saa.cluster as cluster
+from saa.cluster import ClusterMember, SqliteLeaseStore
+
+TTL = 60
+STREAMERS = [f"streamer{i}" for i in range(10)]
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 1000000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cluster, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def store_path(tmp_path, monkeypatch):
+    # Give up on a locked store straight away, rather than after CLUSTER_BUSY_TIMEOUT
+    monkeypatch.setattr(cluster, "CLUSTER_BUSY_TIMEOUT", 0.1)
+    return str(tmp_path / "cluster.db")
+
+
+@pytest.fixture
+def member(store_path):
+    stores = []
+
+    def new(node_id, capacity=1):
+        store = SqliteLeaseStore(store_path)
+        stores.append(store)
+        return ClusterMember(store, node_id=node_id, capacity=capacity, lease_ttl=TTL)
+
+    yield new
+    for store in stores:
+        store.close()
+
+
+def leases(store_path):
+    conn = sqlite3.connect(store_path)
+    try:
+        return dict(conn.execute("SELECT streamer, node_id FROM leases").fetchall())
+    finally:
+        conn.close()
+
+
+def test_claims_and_renews(clock, member, store_path):
+    a = member("a")
+    owned = a.update(STREAMERS)
+    assert owned == set(STREAMERS)
+    assert leases(store_path) == {key: "a" for key in STREAMERS}
+
+    # Renewed every update, so they do not expire while the node is running
+    for _ in range(5):
+        clock.now += TTL / 2
+        assert a.update(STREAMERS) == owned
+
+    # Streamers removed from streamers.yml lose their lease
+    assert a.update(STREAMERS[:8]) == set(STREAMERS[:8])
+    assert set(leases(store_path)) == set(STREAMERS[:8])
+
+    # and held leases are not claimed by other nodes
+    clock.now += TTL / 2
+    assert member("b").update(STREAMERS) == set(STREAMERS[8:])
+
+
+def test_rebalanced_when_node_joins(clock, member, store_path):
+    a, b = member("a", capacity=3), member("b", capacity=1)
+    a.update(STREAMERS)
+
+    # b's heartbeat counts from its first update, a then releases what is over its share for b to claim
+    assert b.update(STREAMERS) == set()
+    clock.now += 5
+    assert len(a.update(STREAMERS)) == 8  # ceil(10 * 3 / 4)
+    assert len(b.update(STREAMERS)) == 2
+    assert a.owned.isdisjoint(b.owned) and a.owned | b.owned == set(STREAMERS)
+
+    # Stable from then on
+    clock.now += 5
+    assert (a.update(STREAMERS), b.update(STREAMERS)) == (a.owned, b.owned)
+    assert len(set(leases(store_path).values())) == 2
+
+
+def test_rebalanced_when_node_leaves(clock, member):
+    a, b = member("a"), member("b")
+    a.update(STREAMERS)
+    b.update(STREAMERS)
+    a.update(STREAMERS)
+    b.update(STREAMERS)
+    assert len(a.owned) == len(b.owned) == 5
+
+    # b stops updating, its leases are only taken once they expire
+    clock.now += TTL - 1
+    assert len(a.update(STREAMERS)) == 5
+    clock.now += 2
+    assert a.update(STREAMERS) == set(STREAMERS)
+
+
+def test_recording_never_released(clock, member):
+    a, b = member("a"), member("b")
+    a.update(STREAMERS)
+    b.update(STREAMERS)
+
+    recording = set(STREAMERS[:7])
+    clock.now += 5
+    assert a.update(STREAMERS, recording) == recording
+    assert b.update(STREAMERS) == set(STREAMERS[7:])
+
+    # Once they are no longer recording, they are released down to a's share
+    clock.now += 5
+    assert a.update(STREAMERS, STREAMERS[:2]) >= set(STREAMERS[:2])
+    assert len(a.owned) == 5
+    assert len(b.update(STREAMERS)) == 5
+
+
+def test_dead_node_streamers_taken_after_leases_expire(clock, member):
+    a = member("a")
+    a.update(STREAMERS, STREAMERS)
+    b = member("b")
+
+    # a has died, b counts it until its heartbeat and leases expire
+    for _ in range(TTL // 10 - 1):
+        clock.now += 10
+        assert b.update(STREAMERS) == set()
+    clock.now += 11
+    assert b.update(STREAMERS) == set(STREAMERS)
+
+    # If a comes back, it has to take its share again
+    clock.now += 1
+    assert a.update(STREAMERS) == set()
+    clock.now += 1
+    assert len(b.update(STREAMERS)) == 5
+    assert len(a.update(STREAMERS)) == 5
+
+
+def test_store_locked(clock, member, store_path):
+    a = member("a")
+    owned = a.update(STREAMERS)
+    locker = sqlite3.connect(store_path, isolation_level=None)
+    locker.execute("BEGIN EXCLUSIVE")
+    try:
+        # Kept while the leases can still be valid
+        clock.now += TTL - 1
+        assert a.update(STREAMERS) == owned
+        # and stopped once they would have expired, as another node can take them then
+        clock.now += 2
+        assert a.update(STREAMERS) == set()
+    finally:
+        locker.execute("ROLLBACK")
+        locker.close()
+
+    # Reclaimed when the store is back
+    clock.now += 1
+    assert a.update(STREAMERS) == set(STREAMERS)
+
+
+class UnreachableStore(SqliteLeaseStore):
+    """
+    A store on shared storage that can go away, failing as SQLite does when the storage does.
+    """
+    unreachable = False
+    clock = None
+    wait = 0  # seconds each request takes to fail
+
+    def transaction(self):
+        if self.unreachable:
+            self.clock.now += self.wait
+            raise sqlite3.OperationalError("disk I/O error")
+        return super().transaction()
+
+    def rollback(self):
+        if self.unreachable:
+            raise sqlite3.OperationalError("disk I/O error")
+        super().rollback()
+
+
+def test_store_unreachable(clock, store_path):
+    a = ClusterMember(UnreachableStore(store_path), node_id="a", lease_ttl=TTL)
+    owned = a.update(STREAMERS)
+    a.store.clock, a.store.unreachable = clock, True
+
+    clock.now += 10
+    assert a.update(STREAMERS) == owned
+    clock.now += TTL
+    assert a.update(STREAMERS) == set()
+
+    a.store.unreachable = False
+    clock.now += 1
+    assert a.update(STREAMERS) == owned
+    a.store.close()
+
+
+def test_store_unreachable_while_waiting(clock, store_path):
+    a = ClusterMember(UnreachableStore(store_path), node_id="a", lease_ttl=TTL)
+    owned = a.update(STREAMERS)
+    a.store.clock, a.store.unreachable = clock, True
+
+    # The leases expire while waiting for the store
+    a.store.wait = 20
+    clock.now += TTL - 30
+    assert a.update(STREAMERS) == owned
+    clock.now += 5
+    assert a.update(STREAMERS) == set()
+    a.store.close()
@@ -0,0 +1,131 @@
+"""
+saa.hls, parsing playlists and downloading them from the stand-in CDN (benchmarks/fake_hls_server.py).
+"""
+import time
+
+import pytest
+
+import fake_hls_server
+
+from saa.hls import HLSDownload, UnsupportedPlaylist, parse_media_playlist
+
+PLAYLIST_URL = "https://cdn.example/live/stream/index.m3u8"
+
+
+def test_parse_media_playlist():
+    playlist = parse_media_playlist("\n".join([
+        "#EXTM3U", "#EXT-X-VERSION:7", "#EXT-X-TARGETDURATION:4", "#EXT-X-MEDIA-SEQUENCE:41",
+        '#EXT-X-MAP:URI="init.mp4"',
+        "#EXTINF:4.000,", "41.m4s",
+        "#EXT-X-KEY:METHOD=NONE",
+        "#EXTINF:3.5,live", "https://other.example/42.m4s?token=abc",
+        "#EXT-X-ENDLIST"]), PLAYLIST_URL)
+
+    assert playlist.target_duration == 4
+    assert playlist.ended
+    assert [(s.sequence, s.url, s.duration) for s in playlist.segments] == [
+        (41, "https://cdn.example/live/stream/41.m4s", 4.0), (42, "https://other.example/42.m4s?token=abc", 3.5)]
+    assert {s.map_url for s in playlist.segments} == {"https://cdn.example/live/stream/init.mp4"}
+
+
+def test_parse_live_playlist():
+    playlist = parse_media_playlist("#EXTM3U\n#EXTINF:2,\na.ts\n", PLAYLIST_URL)
+
+    assert not playlist.ended
+    assert playlist.target_duration == 6.0  # not given
+    assert [s.sequence for s in playlist.segments] == [0]
+
+
+@pytest.mark.parametrize("line", ['#EXT-X-KEY:METHOD=AES-128,URI="key"', "#EXT-X-BYTERANGE:1000@0",
+                                  '#EXT-X-MAP:URI="init.mp4",BYTERANGE="100@0"',
+                                  "#EXT-X-STREAM-INF:BANDWIDTH=1000000"])
+def test_parse_unsupported(line):
+    with pytest.raises(UnsupportedPlaylist):
+        parse_media_playlist(f"#EXTM3U\n{line}\n#EXTINF:2,\na.ts\n", PLAYLIST_URL)
+
+
+def test_parse_not_a_playlist():
+    with pytest.raises(ValueError):
+        parse_media_playlist("<html></html>", PLAYLIST_URL)
+
+
+@pytest.fixture
+def cdn(serve):
+    server = fake_hls_server.make_server(print_connections=False)
+    base = serve(server)
+
+    def ended_stream(segments, window=None, **query):
+        """
+        :return: playlist url of a stream of segments 0 to segments - 1 (1s each) that has already ended
+        """
+        query = {'live_at': time.time() - segments - 1, 'duration': segments, 'segment': 1, 'bitrate': 8 * 188 * 4,
+                 'window': window or segments, **query}
+        return f"{base}/live/test.m3u8?" + "&".join(f"{k}={v}" for k, v in query.items())
+
+    ended_stream.server = server
+    return ended_stream
+
+
+def download(url, file, **kwargs):
+    """
+    :return: (media sequence numbers of the segments written in order, what the download logged)
+    """
+    hls = HLSDownload(url, str(file), **kwargs).start()
+    assert hls.wait(30) == 0
+    log = hls.stdout.read().decode()
+    data = file.read_bytes()
+    segment_size = 188 * 4
+    assert len(data) % segment_size == 0
+    sequences = [fake_hls_server.SEQUENCE.unpack_from(data, offset + 1)[0]
+                 for offset in range(0, len(data), segment_size)]
+    return sequences, log
+
+
+def test_segments_written_in_order(cdn, tmp_path):
+    # Every third segment is slow, so the segments after it are fetched first
+    url = cdn(8, slow_every=3, slow_delay=0.5)
+    sequences, log = download(url, tmp_path / "chunk.ts", start_after=-1, concurrency=3, prefetch=6)
+
+    assert sequences == list(range(8))
+    assert "Stream ended" in log
+
+
+def test_starts_at_live_edge(cdn, tmp_path):
+    sequences, _ = download(cdn(8), tmp_path / "chunk.ts")
+
+    assert sequences == [5, 6, 7]
+
+
+def test_carries_on_after_last_segment(cdn, tmp_path):
+    url = cdn(8)
+    sequences, _ = download(url, tmp_path / "first.ts", start_after=1)
+    assert sequences == [2, 3, 4, 5, 6, 7]
+
+    # The next chunk's download picks up from the last segment the previous one wrote
+    sequences, _ = download(url, tmp_path / "second.ts", start_after=4)
+    assert sequences == [5, 6, 7]
+
+
+def test_missed_segments_carry_on_from_oldest(cdn, tmp_path):
+    sequences, log = download(cdn(8, window=3), tmp_path / "chunk.ts", start_after=1)
+
+    assert sequences == [5, 6, 7]
+    assert "Missed 3 segments" in log
+
+
+def test_failed_segment_is_skipped(cdn, tmp_path):
+    sequences, log = download(cdn(6, fail_every=4), tmp_path / "chunk.ts", start_after=-1)
+
+    assert sequences == [1, 2, 3, 5]  # 0 and 4 always fail
+    assert "Failed to fetch segment 4" in log
+
+
+def test_connections_kept_alive(cdn, tmp_path):
+    url = cdn(12)
+    download(url, tmp_path / "first.ts", start_after=-1, concurrency=3)
+    connections = cdn.server.connections
+    assert connections <= 4  # the playlist and a connection per segment fetched at once
+
+    # A later download in the same process (the next chunk) reuses them
+    download(url, tmp_path / "second.ts", start_after=-1, concurrency=3)
+    assert cdn.server.connections == connections
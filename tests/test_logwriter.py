@@ -0,0 +1,99 @@
+"""
+The log writer's dedupe and rate limiting (saa.logwriter), without the writer process.
+"""
+import logging
+
+import pytest
+
+import saa.logwriter as logwriter
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(logwriter.time, "monotonic", clock)
+    return clock
+
+
+def writer(**kwargs):
+    """
+    :return: (LogWriter, list of the messages it writes)
+    """
+    written = []
+    log_writer = logwriter.LogWriter(None, **kwargs)
+    log_writer._write = lambda record: written.append(record.getMessage())
+    return log_writer, written
+
+
+def record(msg, level=logging.DEBUG, process="streamer"):
+    return logging.makeLogRecord({"name": "root", "levelno": level, "levelname": logging.getLevelName(level),
+                                  "processName": process, "msg": msg})
+
+
+def test_off_by_default(clock):
+    log_writer, written = writer()
+    for i in range(200):
+        log_writer.handle(record(f"Segment {i} complete"))
+        log_writer.handle(record(f"info {i}", logging.INFO))
+
+    assert len(written) == 400
+
+
+def test_dedupe_similar_debug_messages(clock):
+    log_writer, written = writer(dedupe_window=10)
+    for i in range(5):
+        log_writer.handle(record(f"Segment {i} complete"))
+    log_writer.handle(record("Something else"))
+    log_writer.handle(record("Segment 9 complete", process="other"))
+    # Info and above are never deduplicated
+    log_writer.handle(record("Cutting stream", logging.INFO))
+    log_writer.handle(record("Cutting stream", logging.INFO))
+
+    assert written == ["Segment 0 complete", "Something else", "Segment 9 complete", "Cutting stream",
+                       "Cutting stream"]
+
+    # Once the window is over, the count of suppressed messages comes before the next one
+    clock.now += 10
+    log_writer.handle(record("Segment 5 complete"))
+    assert written[-2:] == ["(suppressed 4 similar messages like: Segment # complete)", "Segment 5 complete"]
+
+
+def test_flush_reports_suppressed(clock):
+    log_writer, written = writer(dedupe_window=10)
+    log_writer.handle(record("Segment 1 complete"))
+    log_writer.handle(record("Segment 2 complete"))
+
+    log_writer._flush(clock.now + 5)
+    assert written == ["Segment 1 complete"]
+    log_writer._flush(clock.now + 10)
+    assert written == ["Segment 1 complete", "(suppressed 1 similar messages like: Segment # complete)"]
+    assert log_writer._seen == {}
+
+
+def test_rate_limit_per_process(clock):
+    log_writer, written = writer(rate_limit=5)
+    for i in range(10):
+        log_writer.handle(record(f"a {i}", logging.INFO, "a"))
+    log_writer.handle(record("b", logging.INFO, "b"))
+    # Warnings and above are never dropped
+    log_writer.handle(record("a warning", logging.WARNING, "a"))
+
+    assert written == [f"a {i}" for i in range(5)] + ["b", "a warning"]
+
+    log_writer._flush(clock.now)
+    assert written[-1] == "(rate limited, dropped 5 messages)"
+
+    # Refilled at rate_limit a second
+    clock.now += 0.5
+    for i in range(3):
+        log_writer.handle(record(f"later {i}", logging.INFO, "a"))
+    assert written[-2:] == ["later 0", "later 1"]
@@ -0,0 +1,145 @@
+"""
+Stopping and restarting async reporting plugins (ReportingPluginHandler), directly and through the control API.
+"""
+from http.client import HTTPConnection
+from queue import Queue
+import asyncio
+import threading
+import socket
+import json
+import time
+
+import pytest
+
+from saa.control import ControlState, start_control_server
+from saa.plugins.pluginhandler import ReportingPluginHandler
+from saa.plugins.plugins import AsyncReportingPluginBase, ReportingPluginBase
+
+
+class Ticker(AsyncReportingPluginBase):
+    """
+    Counts up on the event loop while it is running, each instance on its own.
+    """
+    name = "ticker"
+    instances = []
+
+    def __init__(self, data_queue):
+        super().__init__(data_queue)
+        self.ticks = 0
+        self.cancelled = False
+        Ticker.instances.append(self)
+
+    async def main(self):
+        try:
+            while True:
+                self.ticks += 1
+                await asyncio.sleep(0.01)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+
+
+class Threaded(ReportingPluginBase):
+    name = "threaded"
+
+    def main(self):
+        while True:
+            self._data_queue.get()
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def instances(name):
+    return [i for i in Ticker.instances if i.config_name == name]
+
+
+@pytest.fixture
+def handler(monkeypatch):
+    Ticker.instances = []
+    # Each instance knows which plugin (config name) it was started as
+    monkeypatch.setattr(Ticker, "set_config", lambda self, **kwargs: setattr(self, "config_name", kwargs['name']))
+    monkeypatch.setattr("saa.plugins.pluginhandler.REPORTING_PLUGIN_HANDLER_SLEEP", 0.05)
+    configs = {'a': {'name': "a"}, 'b': {'name': "b"}, 'c': {'name': "c"}, 'threaded': {}}
+    plugin_handler = ReportingPluginHandler(Queue(), configs)
+    plugin_handler._plugins = {'a': Ticker, 'b': Ticker, 'c': Ticker, 'threaded': Threaded}
+    threading.Thread(target=plugin_handler.start, daemon=True).start()
+    assert wait_for(lambda: all(instances(name) and instances(name)[0].ticks for name in "abc"))
+    return plugin_handler
+
+
+def test_stop_and_restart_one_plugin(handler):
+    a, = instances("a")
+    assert handler.stop_plugin("a")
+    assert wait_for(lambda: a.cancelled)
+
+    # The others carry on, and the handler does not relaunch the stopped one
+    ticks = {name: instances(name)[0].ticks for name in "bc"}
+    time.sleep(0.2)
+    assert all(instances(name)[0].ticks > ticks[name] for name in "bc")
+    assert instances("a") == [a]
+    stopped_at = a.ticks
+    assert not handler.stop_plugin("a")
+
+    assert handler.restart_plugin("a")
+    assert wait_for(lambda: len(instances("a")) == 2 and instances("a")[1].ticks > 0)
+    assert a.ticks == stopped_at
+    assert not any(instances(name)[0].cancelled for name in "bc")
+
+
+def test_restart_running_plugin(handler):
+    b, = instances("b")
+    assert handler.restart_plugin("b")
+
+    assert wait_for(lambda: b.cancelled and len(instances("b")) == 2 and instances("b")[1].ticks > 0)
+    assert not instances("a")[0].cancelled
+
+
+def test_thread_plugins_can_not_be_stopped(handler):
+    assert not handler.stop_plugin("threaded")
+    assert not handler.restart_plugin("threaded")
+    assert not handler.restart_plugin("missing")
+
+
+class UnixHTTPConnection(HTTPConnection):
+
+    def __init__(self, path):
+        super().__init__("saa")
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.path)
+
+
+def test_control_api(handler, tmp_path):
+    state = ControlState()
+    state.plugins = handler
+    path = str(tmp_path / "saa.sock")
+    servers = start_control_server(state, socket_path=path)
+
+    def post(url):
+        connection = UnixHTTPConnection(path)
+        connection.request("POST", url, headers={"Content-Type": "application/json"})
+        response = connection.getresponse()
+        return response.status, json.loads(response.read())
+
+    try:
+        c, = instances("c")
+        assert post("/plugins/c/stop") == (200, {'ok': True})
+        assert wait_for(lambda: c.cancelled)
+        assert post("/plugins/c/stop")[0] == 404
+        assert post("/plugins/c/restart") == (200, {'ok': True})
+        assert wait_for(lambda: len(instances("c")) == 2)
+        assert post("/plugins/threaded/stop")[0] == 404
+        assert post("/plugins/c/pause")[0] == 404
+    finally:
+        for server in servers:
+            server.shutdown()
+            server.server_close()
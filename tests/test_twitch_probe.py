@@ -0,0 +1,98 @@
+"""
+TwitchProbe and ProbePluginHandler against the stand-in Twitch API (benchmarks/fake_twitch_api.py).
+"""
+import time
+
+import fake_twitch_api
+
+from saa.plugins.pluginhandler import ProbePluginHandler
+from saa.plugins.probes.twitch import TwitchProbe
+from saa.control import ArchiverControl
+
+
+def probe_config(url, **kwargs):
+    return {'client_id': "fake", 'client_secret': "fake", 'api_url': f"{url}/helix",
+            'token_url': f"{url}/oauth2/token", **kwargs}
+
+
+def streams_requests(server):
+    return [r for r in server.requests if r['path'] == "/helix/streams"]
+
+
+def test_probe_live_and_offline(serve):
+    server = fake_twitch_api.make_server(live=["OnAir"])
+    probe = TwitchProbe()
+    probe.set_config(**probe_config(serve(server)))
+
+    assert probe.probe(["onair", "offair"]) == {"onair": True, "offair": False}
+    assert [r['path'] for r in server.requests] == ["/oauth2/token", "/helix/streams"]
+
+
+def test_handler_batches_channels(serve):
+    channels = [f"channel{i:02}" for i in range(25)]
+    server = fake_twitch_api.make_server(live=channels[::2])
+    processes = {c: {'config': {'url': f"https://www.twitch.tv/{c}"}, 'control': ArchiverControl()} for c in channels}
+    handler = ProbePluginHandler({'twitch': probe_config(serve(server))}, processes)
+    handler._probes[0].batch_size = 10
+    handler.run_probes()
+
+    assert [len(r['logins']) for r in streams_requests(server)] == [10, 10, 5]
+    for i, channel in enumerate(channels):
+        assert processes[channel]['control'].state()['probe_live'] == (i % 2 == 0)
+
+
+def test_handler_sets_verdict_and_expiry(serve):
+    server = fake_twitch_api.make_server(live=["shared"])
+    url = serve(server)
+    processes = {
+        'a': {'config': {'url': "https://twitch.tv/shared"}, 'control': ArchiverControl()},
+        'b': {'config': {'url': "https://twitch.tv/shared"}, 'control': ArchiverControl()},
+        'c': {'config': {'url': "https://www.youtube.com/@someone/live"}, 'control': ArchiverControl()},
+    }
+    handler = ProbePluginHandler({'twitch': probe_config(url, ttl=60)}, processes)
+    before = time.time()
+    handler.run_probes()
+
+    # Streamers with the same url share one lookup
+    assert [r['logins'] for r in streams_requests(server)] == [["shared"]]
+    for key in ('a', 'b'):
+        state = processes[key]['control'].state()
+        assert state['probe_live'] is True
+        assert before + 60 <= state['probe_expires'] <= time.time() + 60
+    # Not handled by any probe, so left to Streamlink
+    assert processes['c']['control'].state()['probe_expires'] == 0
+
+
+def test_probe_renews_expired_token(serve):
+    server = fake_twitch_api.make_server(live=["onair"], token_requests=1)
+    probe = TwitchProbe()
+    probe.set_config(**probe_config(serve(server)))
+
+    assert probe.probe(["onair"]) == {"onair": True}
+    assert probe.probe(["onair"]) == {"onair": True}
+    assert [(r['path'], r['status']) for r in server.requests] == [
+        ("/oauth2/token", 200), ("/helix/streams", 200),
+        ("/helix/streams", 401), ("/oauth2/token", 200), ("/helix/streams", 200)]
+
+
+def test_probe_without_secret_gives_up_on_401(serve):
+    server = fake_twitch_api.make_server(live=["onair"])
+    probe = TwitchProbe()
+    probe.set_config(**probe_config(serve(server), client_secret=None, token="stale"))
+
+    # Unknown rather than offline, so Streamlink checks them
+    assert probe.probe(["onair"]) == {}
+    assert [r['status'] for r in server.requests] == [401]
+
+
+def test_probe_ttl_must_be_positive():
+    url = "http://127.0.0.1:1"  # never requested
+    for ttl in (0, -5, "soon"):
+        probe = TwitchProbe()
+        probe.set_config(**probe_config(url, ttl=ttl))
+        # Otherwise the handler would run the probes in a busy loop (every ttl / 2 seconds)
+        assert probe.ttl == TwitchProbe.ttl
+
+    probe = TwitchProbe()
+    probe.set_config(**probe_config(url, ttl="45"))
+    assert probe.ttl == 45
@@ -0,0 +1,66 @@
+"""
+Keeping the post-processing pipeline process running (saa.workers.ensure_pipeline).
+"""
+import signal
+import time
+import os
+
+import pytest
+
+import saa.workers as workers
+from saa.journal import ChunkJournal
+from saa.pipeline import build_steps
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+@pytest.fixture
+def context():
+    context = workers.get_context()
+    workers.start_forkserver(context)
+    return context
+
+
+def add_chunk(directory, name):
+    """
+    Record a finished chunk waiting for post-processing, as an archiver would.
+    """
+    with open(os.path.join(directory, name), "wb") as f:
+        f.write(b"\x47" + bytes(187))
+    journal = ChunkJournal(directory, "streamer")
+    chunk_id = journal.open_chunk(name + ".temp")
+    journal.begin_finalize(chunk_id, name, size=188)
+    journal.finalize_chunk(chunk_id, process=True)
+    journal.close()
+
+
+def test_pipeline_restarted_after_it_dies(context, tmp_path):
+    queue = context.Queue()
+    steps = build_steps([{'command': ["cp", "{input}", "{output}"], 'output': "{stem}.copy"}])
+    pipeline = workers.ensure_pipeline(context, None, queue, {'workers': 1})
+    try:
+        assert wait_for(pipeline.is_alive)
+        # Left running while it is alive
+        assert workers.ensure_pipeline(context, pipeline, queue, {'workers': 1}) is pipeline
+
+        os.kill(pipeline.pid, signal.SIGKILL)
+        pipeline.join(10)
+        restarted = workers.ensure_pipeline(context, pipeline, queue, {'workers': 1})
+        assert restarted is not pipeline
+        assert wait_for(restarted.is_alive)
+        pipeline = restarted
+
+        # and it carries on with the requests sent on the same queue
+        add_chunk(str(tmp_path), "chunk.ts")
+        queue.put({'streamer': "streamer", 'directory': str(tmp_path), 'steps': steps})
+        assert wait_for(lambda: (tmp_path / "chunk.copy").exists())
+    finally:
+        pipeline.terminate()
+        pipeline.join(10)